@@ -3,6 +3,7 @@ import contextlib
 import json
 import logging
 import os
+import threading
 import time
 
 # others
@@ -32,7 +33,36 @@ def create_app():
     app.config['TRAP_BAD_REQUEST_ERRORS'] = True
 
     blockchain_filename = os.getenv("TOYCHAIN_BLOCKCHAIN_FILE", "blockchain.json")
+    block_log_directory = os.getenv("TOYCHAIN_BLOCK_LOG")
+    block_log = toychain.main.BlockLog(block_log_directory) if block_log_directory else None
+    chainstate_filename = os.getenv("TOYCHAIN_CHAINSTATE")
+    chainstate = toychain.main.SQLiteChainstate(chainstate_filename) if chainstate_filename else None
+    snapshot_filename = os.getenv("TOYCHAIN_SNAPSHOT_FILE")
     blockchain_peers = set(os.getenv("TOYCHAIN_PEERS", "").split())
+    transaction_pool_max_transactions = os.getenv("TOYCHAIN_TRANSACTION_POOL_MAX_TRANSACTIONS")
+    transaction_pool_max_bytes = os.getenv("TOYCHAIN_TRANSACTION_POOL_MAX_BYTES")
+    mining_engine = toychain.main.MiningEngine(processes=int(os.getenv("TOYCHAIN_MINING_PROCESSES", 1)) or None)
+    signature_verifier = toychain.main.SignatureVerifier(workers=int(os.getenv("TOYCHAIN_VERIFICATION_WORKERS", 0)))
+    signature_cache = toychain.main.LRUCache(maxsize=int(os.getenv("TOYCHAIN_SIGNATURE_CACHE_SIZE", 100000)))
+    wire_format = os.getenv("TOYCHAIN_WIRE_FORMAT", "json")
+    fetch_timeout = float(os.getenv("TOYCHAIN_FETCH_TIMEOUT", 10))
+    gossip_dispatcher = toychain.main.GossipDispatcher(
+        workers=int(os.getenv("TOYCHAIN_GOSSIP_WORKERS", 4)),
+        max_queue_size=int(os.getenv("TOYCHAIN_GOSSIP_QUEUE_SIZE", 1000))
+    )
+
+    def setup_blockchain(blockchain):
+        blockchain.peers = blockchain_peers
+        blockchain.transaction_pool = toychain.main.TransactionPool(
+            max_transactions=int(transaction_pool_max_transactions) if transaction_pool_max_transactions else None,
+            max_bytes=int(transaction_pool_max_bytes) if transaction_pool_max_bytes else None
+        )
+        blockchain.mining_engine = mining_engine
+        blockchain.signature_verifier = signature_verifier
+        blockchain.signature_cache = signature_cache
+        blockchain.wire_format = wire_format
+        blockchain.fetch_timeout = fetch_timeout
+        blockchain.gossip_dispatcher = gossip_dispatcher
 
     def load_blockchain(blockchain_filename):
         global blockchain
@@ -40,13 +70,27 @@ def create_app():
         with open(blockchain_filename) as f:
             serialized_blockchain = json.load(f)
 
-        blockchain = toychain.main.Blockchain.unserialize(serialized_blockchain)
-        blockchain.peers = blockchain_peers
+        blockchain = toychain.main.Blockchain.unserialize(serialized_blockchain, chainstate=chainstate)
+        setup_blockchain(blockchain)
         app.logger.info(
             "Load blockchain call, blocks: %s, fork blocks: %s, orphan blocks: %s",
             len(blockchain.blocks), len(blockchain.fork), len(blockchain.orphans)
         )
 
+    def load_block_log():
+        global blockchain
+
+        if len(block_log) == 0 and os.path.exists(blockchain_filename):
+            app.logger.info("Import blockchain file: %s into the block log: %s", blockchain_filename, block_log_directory)
+            toychain.main.import_blockchain_file(blockchain_filename, block_log)
+
+        blockchain = toychain.main.Blockchain.load(block_log, chainstate=chainstate)
+        setup_blockchain(blockchain)
+        app.logger.info(
+            "Load block log call, blocks: %s, fork blocks: %s, orphan blocks: %s",
+            len(blockchain.blocks), len(blockchain.fork), len(blockchain.orphans)
+        )
+
     @contextlib.contextmanager
     def restart_miner():
         global miner
@@ -66,6 +110,27 @@ def create_app():
             )
             miner.start()
 
+    def read_block_or_transaction(cls):
+        # JSON, unless sent with the binary Content-Type.
+        if flask.request.mimetype == toychain.main.BINARY_CONTENT_TYPE:
+            return cls.decode(flask.request.get_data())
+
+        return cls.unserialize(flask.request.json)
+
+    def block_or_transaction_response(block_or_transaction):
+        # JSON, unless the client's Accept header prefers the binary encoding.
+        best_match = flask.request.accept_mimetypes.best_match(
+            ["application/json", toychain.main.BINARY_CONTENT_TYPE], default="application/json"
+        )
+        if best_match == toychain.main.BINARY_CONTENT_TYPE:
+            try:
+                return flask.Response(block_or_transaction.encode(), mimetype=toychain.main.BINARY_CONTENT_TYPE)
+            except ValueError:
+                # can't be represented exactly in binary
+                pass
+
+        return flask.jsonify(block_or_transaction.serialize())
+
     ##
     # balances
 
@@ -73,6 +138,28 @@ def create_app():
     def get_balance(address):
         return flask.jsonify({"balance": blockchain.calculate_balance(address) or 0})
 
+    @app.route('/balances', methods=['POST'])
+    def get_balances():
+        """
+        Body:
+            {
+                "addresses": list of addresses
+            }
+        Query string:
+            include-unspent-outputs
+        """
+        body = flask.request.get_json(silent=True)
+        addresses = body.get('addresses') if isinstance(body, dict) else None
+        if not isinstance(addresses, list) or not all(isinstance(address, str) for address in addresses):
+            return "", 400
+
+        response = {"balances": blockchain.calculate_balances(addresses)}
+
+        if "include-unspent-outputs" in flask.request.args:
+            response["unspent_outputs"] = {address: blockchain.get_unspent_outputs(address) for address in addresses}
+
+        return flask.jsonify(response)
+
     ##
     # blocks
 
@@ -82,7 +169,40 @@ def create_app():
         if not block:
             return "", 404
 
-        return flask.jsonify(block.serialize())
+        return block_or_transaction_response(block)
+
+    @app.route('/blocks/<block_hash>/compact', methods=['GET'])
+    def get_compact_block(block_hash):
+        compact_block = blockchain.get_compact_block(block_hash)
+        if not compact_block:
+            return "", 404
+
+        return flask.jsonify(compact_block)
+
+    @app.route('/blocks/<block_hash>/transactions', methods=['GET'])
+    def get_block_transactions(block_hash):
+        """
+        Query string:
+            indexes: comma separated positions of the transactions in the block.
+        """
+        try:
+            indexes = [int(index) for index in flask.request.args.get('indexes', '').split(',') if index]
+            transactions = blockchain.get_block_transactions(block_hash, indexes)
+        except (ValueError, IndexError):
+            return "", 400
+
+        if transactions is None:
+            return "", 404
+
+        return flask.jsonify([transaction.serialize() for transaction in transactions])
+
+    @app.route('/blocks/<block_hash>/header', methods=['GET'])
+    def get_block_header(block_hash):
+        block = blockchain.get_block(hash=block_hash)
+        if not block or block.version < 2:
+            return "", 404
+
+        return flask.jsonify(block.header)
 
     @app.route('/blocks/get-next', methods=['GET'])
     def get_next_block():
@@ -99,8 +219,12 @@ def create_app():
         if not peer_tip:
             # return Genesis block
             block = blockchain.blocks[0]
-            app.logger.info("Get next block call, no peer tip provided. Genesis block: %s", json.dumps(block.serialize()))
-            return flask.jsonify(block.serialize())
+            if block is None:
+                # not backfilled yet
+                return "", 404
+
+            app.logger.info("Get next block call, no peer tip provided. Genesis block: %s", block.calculate_hash())
+            return block_or_transaction_response(block)
 
         try:
             block = blockchain.get_next_block(previous_hash=peer_tip)
@@ -112,14 +236,66 @@ def create_app():
             app.logger.info("Get next block call, peer's tip: %s is same as ours", peer_tip)
             return "", 404
 
-        app.logger.info("Get next block call, peer tip: %s, next block: %s", peer_tip, json.dumps(block.serialize()))
-        return flask.jsonify(block.serialize())
+        app.logger.info("Get next block call, peer tip: %s, next block: %s", peer_tip, block.calculate_hash())
+        return block_or_transaction_response(block)
+
+    @app.route('/blocks/range', methods=['GET'])
+    def get_block_range():
+        """
+        Query string:
+            from-hash: hash of the block to start after, optional. if no from-hash is provided, start from the Genesis
+                block.
+            limit: how many blocks, at most, optional. defaults to, and is capped at, 500.
+        """
+        from_hash = flask.request.args.get('from-hash')
+        limit = min(flask.request.args.get('limit', 500, type=int), 500)
+        try:
+            blocks = blockchain.get_blocks_after(previous_hash=from_hash, limit=limit)
+        except toychain.main.BlockIsNotInMainChainError as e:
+            app.logger.info(str(e))
+            return "", 400
+        except toychain.main.HistoryIsUnavailableError as e:
+            app.logger.info(str(e))
+            return "", 404
+
+        app.logger.info("Get block range call, from: %s, blocks: %s", from_hash, len(blocks))
+
+        # newline delimited JSON, unless the client's Accept header prefers the binary stream.
+        best_match = flask.request.accept_mimetypes.best_match(
+            [toychain.main.NDJSON_CONTENT_TYPE, toychain.main.BINARY_STREAM_CONTENT_TYPE],
+            default=toychain.main.NDJSON_CONTENT_TYPE
+        )
+        binary = best_match == toychain.main.BINARY_STREAM_CONTENT_TYPE
+        return flask.Response(toychain.main.encode_block_stream(blocks, binary=binary), mimetype=best_match)
+
+    @app.route('/blocks/hashes', methods=['GET'])
+    def get_block_hashes():
+        """
+        Query string:
+            from-hash: same as in `/blocks/range`.
+            limit: how many hashes, at most, optional. defaults to, and is capped at, 10000.
+        """
+        from_hash = flask.request.args.get('from-hash')
+        limit = min(flask.request.args.get('limit', 10000, type=int), 10000)
+        try:
+            block_hashes = blockchain.get_block_hashes_after(previous_hash=from_hash, limit=limit)
+        except toychain.main.BlockIsNotInMainChainError as e:
+            app.logger.info(str(e))
+            return "", 400
+        except toychain.main.HistoryIsUnavailableError as e:
+            app.logger.info(str(e))
+            return "", 404
+
+        app.logger.info("Get block hashes call, from: %s, hashes: %s", from_hash, len(block_hashes))
+        return flask.jsonify(block_hashes)
 
     @app.route('/blocks', methods=['POST'])
     def receive_block():
-        # note: we will try to retransmit the block to the sender, too, because the `publish_block` method is unaware
-        #   of who sent it.
-        block = toychain.main.Block.unserialize(flask.request.json)
+        block = read_block_or_transaction(toychain.main.Block)
+        if blockchain.has_seen(block.calculate_hash()):
+            app.logger.info("Block with hash: %s has been received already", block.calculate_hash())
+            return "", 202
+
         app.logger.info("New block received, with hash: %s, prev: %s", block.calculate_hash(), block.prev)
 
         blockchain.receive_block(block)
@@ -131,22 +307,123 @@ def create_app():
 
     @app.route('/transactions/<string:transaction_id>', methods=['GET'])
     def get_transaction(transaction_id):
-        transaction = blockchain.get_transaction(transaction_id)
+        """
+        Query string:
+            include-transaction-pool: also look the transaction up in the transaction pool, optional.
+        """
+        transaction = blockchain.get_transaction(
+            transaction_id, include_transaction_pool="include-transaction-pool" in flask.request.args
+        )
         if transaction:
-            return flask.jsonify(transaction.serialize())
+            return block_or_transaction_response(transaction)
+        else:
+            return "", 404
+
+    @app.route('/transactions/lookup', methods=['POST'])
+    def get_transactions():
+        """
+        Query string:
+            include-transaction-pool: also look the transactions up in the transaction pool, optional.
+
+        Body:
+            transaction_ids: the hashes of the transactions, at most 10000 of them.
+        """
+        body = flask.request.get_json(silent=True)
+        transaction_ids = body.get("transaction_ids") if isinstance(body, dict) else None
+        if not isinstance(transaction_ids, list) or not all(isinstance(t, str) for t in transaction_ids):
+            return "", 400
+
+        if len(transaction_ids) > 10000:
+            return "", 413
+
+        include_transaction_pool = "include-transaction-pool" in flask.request.args
+        transactions = [
+            blockchain.get_transaction(transaction_id, include_transaction_pool=include_transaction_pool)
+            for transaction_id in transaction_ids
+        ]
+
+        return flask.jsonify([transaction.serialize() if transaction else None for transaction in transactions])
+
+    @app.route('/transactions/<string:transaction_id>/proof', methods=['GET'])
+    def get_transaction_proof(transaction_id):
+        proof = blockchain.get_transaction_proof(transaction_id)
+        if proof:
+            return flask.jsonify(proof)
+        else:
+            return "", 404
+
+    @app.route('/transactions/<string:transaction_id>/outputs/<int:vout>', methods=['GET'])
+    def get_unspent_output(transaction_id, vout):
+        output = blockchain.get_unspent_output(transaction_id, vout)
+        if output:
+            return flask.jsonify(output)
         else:
             return "", 404
 
     @app.route('/transactions', methods=['POST'])
     def receive_transaction():
-        # note: same as on receive_block
-        transaction = toychain.main.Transaction.unserialize(flask.request.json)
+        transaction = read_block_or_transaction(toychain.main.Transaction)
+        if blockchain.has_seen(transaction.calculate_hash()):
+            app.logger.info("Transaction with hash: %s has been received already", transaction.calculate_hash())
+            return "", 202
+
         app.logger.info("New transaction received, with hash: %s", transaction.calculate_hash())
 
         blockchain.add_transaction_to_pool(transaction)
 
         return "", 202
 
+    @app.route('/transactions/batch', methods=['POST'])
+    def receive_transactions():
+        """
+        Body:
+            a JSON array of serialized Transactions, or one per line with `Content-Type: application/x-ndjson`. at most
+                10000 of them.
+        """
+        ndjson = flask.request.mimetype == toychain.main.NDJSON_CONTENT_TYPE
+        if ndjson:
+            serialized_transactions = [line for line in flask.request.get_data().splitlines() if line.strip()]
+        else:
+            serialized_transactions = flask.request.get_json(silent=True)
+            if not isinstance(serialized_transactions, list):
+                return "", 400
+
+        if len(serialized_transactions) > 10000:
+            return "", 413
+
+        # the malformed ones are reported as such, the rest are verified and added to the pool together.
+        results = [None] * len(serialized_transactions)
+        transactions = []
+        for index, serialized_transaction in enumerate(serialized_transactions):
+            try:
+                if ndjson:
+                    serialized_transaction = json.loads(serialized_transaction)
+                transaction = toychain.main.Transaction.unserialize(serialized_transaction)
+                transaction.calculate_hash()
+            except (AttributeError, KeyError, TypeError, ValueError) as e:
+                results[index] = {"error": type(e).__name__, "message": str(e)}
+            else:
+                transactions.append((index, transaction))
+
+        for (index, transaction), result in zip(
+            transactions, blockchain.add_transactions_to_pool([transaction for _, transaction in transactions])
+        ):
+            if isinstance(result, Exception):
+                results[index] = {
+                    "transaction_id": transaction.calculate_hash(),
+                    "error": type(result).__name__,
+                    "message": str(result)
+                }
+            else:
+                results[index] = {"transaction_id": transaction.calculate_hash(), "fee": result}
+
+        app.logger.info(
+            "Transaction batch received, transactions: %s, accepted: %s",
+            len(results), sum(1 for result in results if "fee" in result)
+        )
+
+        return flask.jsonify(results)
+
     @app.route('/transactions/sign', methods=['POST'])
     def sign_transaction():
         """
@@ -171,6 +448,17 @@ def create_app():
     ##
     # control, not a part of the public API
 
+    @app.route('/transaction-pool', methods=['GET'])
+    def get_transaction_pool_stats():
+        transaction_pool = blockchain.transaction_pool
+        return flask.jsonify({
+            "transactions": len(transaction_pool),
+            "bytes": transaction_pool.size_bytes,
+            "max_transactions": transaction_pool.max_transactions,
+            "max_bytes": transaction_pool.max_bytes,
+            "stats": transaction_pool.stats
+        })
+
     @app.route('/mine', methods=['POST'])
     def mine():
         address = flask.request.json['address']
@@ -181,38 +469,128 @@ def create_app():
 
         return "", 409
 
+    @app.route('/verification', methods=['GET'])
+    def get_verification_stats():
+        return flask.jsonify({"signature_cache": blockchain.signature_cache.stats})
+
+    @app.route('/gossip', methods=['GET'])
+    def get_gossip_stats():
+        return flask.jsonify(
+            blockchain.gossip_dispatcher.stats
+            | {
+                "seen_cache": blockchain.seen_cache.stats, "rejected_cache": blockchain.rejected_cache.stats,
+                "compact_blocks": blockchain.compact_block_stats
+            }
+        )
+
+    @app.route('/inventory', methods=['POST'])
+    def receive_inventory():
+        """
+        Body:
+            {
+                "blocks": hashes of the blocks being announced, optional.
+                "transactions": hashes of the transactions being announced, optional.
+            }
+        """
+        inventory = flask.request.get_json(silent=True)
+        if not isinstance(inventory, dict):
+            return "", 400
+
+        # the announcing node is asked first: the peer it is, or else the address it announced from.
+        peer = blockchain.find_peer(flask.request.remote_addr)
+        receiving_blockchain = blockchain
+
+        def fetch():
+            fetched = receiving_blockchain.receive_inventory(inventory, peer=peer)
+            app.logger.info(
+                "Inventory received from: %s, blocks fetched: %s, transactions fetched: %s",
+                peer, len(fetched["blocks"]), len(fetched["transactions"])
+            )
+
+        # fetched by a gossip worker, the announcing node doesn't wait for it.
+        if not blockchain.gossip_dispatcher.submit(fetch):
+            app.logger.warning("Gossip queue is full, inventory from: %s dropped", peer)
+            return "", 503
+
+        return "", 202
+
     @app.route('/persistence/save', methods=['POST'])
     def save():
+        try:
+            if block_log is not None and 'filename' not in flask.request.json:
+                blockchain.save(block_log)
+                app.logger.info("Save blockchain call, block log: %s, blocks: %s", block_log_directory, len(block_log))
+                return "", 200
+
+            serialized_blockchain = blockchain.serialize()
+        except toychain.main.HistoryIsUnavailableError as e:
+            app.logger.info(str(e))
+            return "", 409
+
         with open(flask.request.json.get('filename', blockchain_filename), "w") as f:
             app.logger.info(
                 "Save blockchain call, blocks: %s, fork blocks: %s, orphan blocks: %s",
                 len(blockchain.blocks), len(blockchain.fork), len(blockchain.orphans)
             )
-            json.dump(blockchain.serialize(), f)
+            json.dump(serialized_blockchain, f)
 
         return "", 200
 
+    @app.route('/persistence/snapshot', methods=['POST'])
+    def write_snapshot():
+        filename = flask.request.json.get('filename', snapshot_filename or "snapshot.dat")
+        snapshot_hash = blockchain.write_snapshot(filename, recent_blocks=flask.request.json.get('recent-blocks', 16))
+        app.logger.info("Snapshot call, file: %s, height: %s, hash: %s", filename, blockchain.height, snapshot_hash)
+
+        return flask.jsonify({
+            "filename": filename,
+            "height": blockchain.height,
+            "block_hash": blockchain.tip.calculate_hash(),
+            "hash": snapshot_hash
+        })
+
     @app.route('/persistence/load', methods=['POST'])
     @restart_miner()
     def load():
-        load_blockchain(flask.request.json.get('filename', blockchain_filename))
+        if block_log is not None and 'filename' not in flask.request.json:
+            load_block_log()
+        else:
+            load_blockchain(flask.request.json.get('filename', blockchain_filename))
+
         return "", 200
 
     @app.route('/synchronize', methods=['POST'])
     @restart_miner()
     def synchronize():
-        blockchain.synchronize()
-        return "", 200
+        return flask.jsonify(blockchain.synchronize())
 
     ##
 
     # load blockchain (if available)
     try:
-        load_blockchain(blockchain_filename)
+        if chainstate is not None and len(chainstate.blocks) > 0:
+            # it's all there already
+            blockchain = toychain.main.Blockchain(chainstate=chainstate)
+            setup_blockchain(blockchain)
+            app.logger.info("Open chainstate: %s, blocks: %s", chainstate_filename, len(blockchain.blocks))
+        elif snapshot_filename and os.path.exists(snapshot_filename):
+            blockchain = toychain.main.Blockchain.load_snapshot(
+                snapshot_filename, snapshot_hash=os.getenv("TOYCHAIN_SNAPSHOT_HASH"), chainstate=chainstate
+            )
+            setup_blockchain(blockchain)
+            app.logger.info("Load snapshot: %s, height: %s", snapshot_filename, blockchain.height)
+        elif block_log is not None:
+            load_block_log()
+        else:
+            load_blockchain(blockchain_filename)
     except FileNotFoundError:
         app.logger.info("No blockchain file exists.")
-        blockchain = toychain.main.Blockchain()
-        blockchain.peers = blockchain_peers
+        blockchain = toychain.main.Blockchain(chainstate=chainstate)
+        setup_blockchain(blockchain)
+
+    if blockchain.chainstate.history_start > 0:
+        # the blocks below the snapshot, in the background
+        threading.Thread(target=blockchain.backfill, name="backfill", daemon=True).start()
 
     # blockchain.initialize(miner_address="b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d")
 
@@ -222,7 +600,7 @@ def create_app():
             try:
                 blockchain.synchronize()
                 break
-            except requests.exceptions.ConnectionError as e:
+            except requests.exceptions.RequestException as e:
                 app.logger.error(str(e))
                 time.sleep(2)
 
@@ -1,13 +1,38 @@
 import base64
+import collections
+import collections.abc
+import concurrent.futures
+import contextlib
+import functools
 import hashlib
+import heapq
+import itertools
 import json
 import logging
+import math
+import mmap
+import multiprocessing
+import os
+import queue
+import socket
+import sqlite3
+import struct
+import threading
 import time
 
 # others
 import ecdsa
 import requests
 
+try:
+    # optional, a faster signature backend. 44.0 onwards, for RFC 6979 signatures.
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import ec, utils as ec_utils
+    ec.ECDSA(hashes.SHA256(), deterministic_signing=True)
+except (ImportError, TypeError):
+    ec = None
+
 
 logger = logging.getLogger('toychain')
 
@@ -28,12 +53,181 @@ class BlockIsNotInMainChainError(BlockchainError):
     pass
 
 
+class InvalidBlockError(BlockchainError):
+    pass
+
+
+class InvalidEncodingError(BlockchainError):
+    pass
+
+
+class BlockLogError(BlockchainError):
+    pass
+
+
+class HistoryIsUnavailableError(BlockchainError):
+    pass
+
+
+class TransactionPoolError(BlockchainError):
+    pass
+
+
+class TransactionConflictError(TransactionPoolError):
+    pass
+
+
+class TransactionPoolIsFullError(TransactionPoolError):
+    pass
+
+
+class FrozenDict(dict):
+    # inputs and outputs are hashed, so they must not change once they are part of a transaction.
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("%s is immutable" % self.__class__.__name__)
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _immutable
+
+    def __reduce__(self):
+        # pickle would otherwise restore the items through __setitem__
+        return self.__class__, (dict(self),)
+
+
+class LRUCache:
+    # a bounded mapping that drops the least recently used entries first, with hit/miss counters to size it.
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._entries.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def stats(self):
+        return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
 class TransactionPool:
-    def __init__(self):
+    def __init__(self, max_transactions=None, max_bytes=None):
+        # limits, None means unbounded. when they are exceeded, the lowest fee transactions are evicted.
+        self.max_transactions = max_transactions
+        self.max_bytes = max_bytes
+
+        # {transaction_id: {"transaction": Transaction, "fee": int, "size": int, "sequence": int}}
         self._transactions = {}
+        self._bytes = 0
+
+        # {(transaction_id, vout): transaction_id of the pooled transaction spending it}
+        self._spends = {}
+
+        # max-heap by fee of (-fee, sequence, transaction_id) entries, ties are broken by arrival order. deleted
+        #   transactions are left in the heap and skipped when they come up, until they are half of it.
+        self._heap = []
+        # the same, as a min-heap of (fee, -sequence, transaction_id) entries, for eviction: newest goes first.
+        self._eviction_heap = []
+        self._sequence = itertools.count()
+
+        self.stats = {"evicted": 0, "replaced": 0, "conflicts": 0}
+
+    def __len__(self):
+        return len(self._transactions)
+
+    def __contains__(self, transaction_id):
+        return transaction_id in self._transactions
+
+    def __iter__(self):
+        # the pooled transactions, in no particular order.
+        return iter([entry['transaction'] for entry in self._transactions.values()])
+
+    @property
+    def size_bytes(self):
+        return self._bytes
 
     def add_transaction(self, transaction, fee):
-        self._transactions[transaction.calculate_hash()] = {"transaction": transaction, "fee": fee}
+        transaction_id = transaction.calculate_hash()
+        # [(transaction_id, entry)] taken out of the pool for this transaction, put back if it doesn't get in after all.
+        removed = []
+        if transaction_id in self._transactions:
+            removed.append((transaction_id, self.delete_transaction(transaction_id)))
+
+        # a transaction that spends the same outputs as pooled ones replaces them only if it pays more fees than all
+        #   of them together.
+        conflicts = self.get_conflicts(transaction)
+        if conflicts:
+            conflicts_fee = sum(self._transactions[conflict]['fee'] for conflict in conflicts)
+            if fee <= conflicts_fee:
+                self._restore(removed)
+                self.stats["conflicts"] += 1
+                raise TransactionConflictError(
+                    "transaction_id: %s conflicts with pooled transaction(s): %s, which pay %s units in fees" % (
+                        transaction_id, ", ".join(conflicts), conflicts_fee
+                    )
+                )
+
+            removed.extend((conflict, self.delete_transaction(conflict)) for conflict in conflicts)
+
+        sequence = next(self._sequence)
+        size = len(json.dumps(transaction.serialize()))
+        self._transactions[transaction_id] = {"transaction": transaction, "fee": fee, "size": size, "sequence": sequence}
+        self._bytes += size
+        for input in transaction.inputs:
+            self._spends[(input['transaction_id'], input['vout'])] = transaction_id
+
+        heapq.heappush(self._heap, (-fee, sequence, transaction_id))
+        heapq.heappush(self._eviction_heap, (fee, -sequence, transaction_id))
+
+        evicted = self._evict()
+        if transaction_id in dict(evicted):
+            # it's the lowest fee transaction once the pool is full: the pool stays as it was, with the transactions
+            #   it replaced or pushed out on its way in.
+            self._restore(removed + [(evicted_id, v) for evicted_id, v in evicted if evicted_id != transaction_id])
+            self.stats["evicted"] += 1
+            raise TransactionPoolIsFullError(
+                "transaction_id: %s pays %s units in fees, not enough to enter the full transaction pool" % (
+                    transaction_id, fee
+                )
+            )
+
+        for conflict in conflicts:
+            logger.info("transaction_id: %s is replaced by transaction_id: %s", conflict, transaction_id)
+            self.stats["replaced"] += 1
+
+        for evicted_id, v in evicted:
+            logger.info("transaction_id: %s is evicted from the transaction pool, fee: %s", evicted_id, v['fee'])
+            self.stats["evicted"] += 1
+
+        return [evicted_id for evicted_id, _ in evicted]
 
     def get_transaction(self, transaction_id):
         try:
@@ -41,39 +235,322 @@ class TransactionPool:
         except KeyError:
             raise TransactionIsNotInPoolError()
 
+    def get_conflicts(self, transaction):
+        # ids of the pooled transactions that spend any of `transaction`'s inputs.
+        conflicts = []
+        for input in transaction.inputs:
+            conflict = self._spends.get((input['transaction_id'], input['vout']))
+            if conflict is not None and conflict not in conflicts:
+                conflicts.append(conflict)
+
+        return conflicts
+
     def get_transactions(self, count):
-        # this is rather inefficient, i am well aware.
-        count = min(count, len(self._transactions))
-        transaction_list = [
-            {"transaction_id": transaction_id, "fee": v['fee'], "transaction": v['transaction']}
-            for transaction_id, v in self._transactions.items()
-        ]
+        # pop the `count` highest fee transactions, then push them back.
+        popped = []
+        transaction_list = []
+        while self._heap and len(transaction_list) < count:
+            entry = heapq.heappop(self._heap)
+            _, sequence, transaction_id = entry
+            v = self._transactions.get(transaction_id)
+            if v is None or v['sequence'] != sequence:
+                continue  # stale entry, drop it for good
+
+            popped.append(entry)
+            transaction_list.append(
+                {"transaction_id": transaction_id, "fee": v['fee'], "transaction": v['transaction']}
+            )
+
+        for entry in popped:
+            heapq.heappush(self._heap, entry)
 
-        return sorted(transaction_list, key=lambda transaction: transaction["fee"], reverse=True)[:count]
+        return transaction_list
 
     def delete_transaction(self, transaction_id):
         try:
-            del self._transactions[transaction_id]
+            v = self._transactions.pop(transaction_id)
         except KeyError:
             raise TransactionIsNotInPoolError()
 
+        self._bytes -= v['size']
+        for input in v['transaction'].inputs:
+            self._spends.pop((input['transaction_id'], input['vout']), None)
+
+        if len(self._heap) > 2 * len(self._transactions) or len(self._eviction_heap) > 2 * len(self._transactions):
+            self._compact()
+
+        return v
+
+    def delete_conflicts(self, transaction):
+        # remove the pooled transactions that spend any of `transaction`'s inputs, i.e. once it has been mined.
+        return [self.delete_transaction(conflict) for conflict in self.get_conflicts(transaction)]
+
+    def _is_full(self):
+        return (
+            (self.max_transactions is not None and len(self._transactions) > self.max_transactions) or
+            (self.max_bytes is not None and self._bytes > self.max_bytes)
+        )
+
+    def _evict(self):
+        # [(transaction_id, entry)] of the lowest fee transactions, taken out until the pool is within its limits.
+        evicted = []
+        while self._is_full():
+            _, sequence, transaction_id = heapq.heappop(self._eviction_heap)
+            v = self._transactions.get(transaction_id)
+            if v is None or v['sequence'] != -sequence:
+                continue  # stale entry
+
+            evicted.append((transaction_id, self.delete_transaction(transaction_id)))
+
+        return evicted
+
+    def _restore(self, entries):
+        # put deleted [(transaction_id, entry)] back, as they were, then rebuild the heaps rather than push entries
+        #   that may still be in them.
+        if not entries:
+            return
+
+        for transaction_id, v in entries:
+            self._transactions[transaction_id] = v
+            self._bytes += v['size']
+            for input in v['transaction'].inputs:
+                self._spends[(input['transaction_id'], input['vout'])] = transaction_id
+
+        self._compact()
+
+    def _compact(self):
+        self._heap = [(-v['fee'], v['sequence'], k) for k, v in self._transactions.items()]
+        heapq.heapify(self._heap)
+        self._eviction_heap = [(v['fee'], -v['sequence'], k) for k, v in self._transactions.items()]
+        heapq.heapify(self._eviction_heap)
+
     def flush(self):
         self._transactions = {}
+        self._bytes = 0
+        self._spends = {}
+        self._heap = []
+        self._eviction_heap = []
+
+
+def calculate_merkle_root(transaction_ids):
+    # bitcoin style: hash pairs of nodes together, duplicating the last one on odd levels, up to a single root.
+    if not transaction_ids:
+        return "0" * 64
+
+    level = [bytes.fromhex(transaction_id) for transaction_id in transaction_ids]
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+
+        level = [hashlib.sha256(level[i] + level[i + 1]).digest() for i in range(0, len(level), 2)]
+
+    return level[0].hex()
+
+
+def calculate_merkle_proof(transaction_ids, transaction_id):
+    # the sibling hashes on the way from `transaction_id` up to the root: [{"hash": str, "side": "left" | "right"}]
+    index = transaction_ids.index(transaction_id)
+    proof = []
+
+    level = [bytes.fromhex(transaction_id) for transaction_id in transaction_ids]
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+
+        sibling = index ^ 1
+        proof.append({"hash": level[sibling].hex(), "side": "left" if sibling < index else "right"})
+
+        level = [hashlib.sha256(level[i] + level[i + 1]).digest() for i in range(0, len(level), 2)]
+        index //= 2
+
+    return proof
+
+
+def verify_merkle_proof(transaction_id, proof, merkle_root):
+    node = bytes.fromhex(transaction_id)
+    for step in proof:
+        sibling = bytes.fromhex(step["hash"])
+        node = hashlib.sha256(sibling + node if step["side"] == "left" else node + sibling).digest()
+
+    return node.hex() == merkle_root
+
+
+def calculate_short_transaction_id(block_hash, transaction_id):
+    # 6 bytes, enough to tell apart the transactions in a pool. keyed by the block, so that colliding transactions
+    #   can't be made ahead of it.
+    return hashlib.sha256(bytes.fromhex(block_hash) + bytes.fromhex(transaction_id)).hexdigest()[:12]
+
+
+# the binary encoding of blocks and transactions, a fraction of the size of their JSON serialization. a message is
+#   BINARY_MAGIC, the format version and the kind of object (1 byte each), then the object. integers are unsigned
+#   LEB128 varints, amounts are zigzag encoded first, hashes and addresses are the 32 bytes of their hex, and
+#   everything of variable length is prefixed with its length. decoded objects must hash the same as the encoded ones,
+#   so values that can't be represented exactly, e.g. uppercase hex or float amounts, can't be encoded.
+BINARY_CONTENT_TYPE = "application/vnd.toychain.binary"
+BINARY_MAGIC = b"TC"
+BINARY_FORMAT_VERSION = 1
+_BINARY_BLOCK = 1
+_BINARY_TRANSACTION = 2
+_BINARY_SNAPSHOT = 3
+
+
+def _write_varint(buffer, value):
+    if type(value) is not int or value < 0:
+        raise ValueError("Can't encode: %r as an unsigned varint" % (value, ))
+
+    while value > 0x7f:
+        buffer.append(value & 0x7f | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _write_amount(buffer, value):
+    # zigzag, so that small negative amounts are small varints too. they're invalid, but they can be relayed.
+    if type(value) is not int:
+        raise ValueError("Can't encode: %r as an amount" % (value, ))
+
+    _write_varint(buffer, value * 2 if value >= 0 else -value * 2 - 1)
+
+
+def _write_hash(buffer, value):
+    # hex strings only round trip if they are lowercase and 32 bytes long.
+    if not isinstance(value, str) or len(value) != 64 or value != value.lower():
+        raise ValueError("Can't encode: %r as a hash" % (value, ))
+
+    buffer += bytes.fromhex(value)
+
+
+def _write_bytes(buffer, value):
+    _write_varint(buffer, len(value))
+    buffer += value
+
+
+def _write_header(buffer, kind):
+    buffer += BINARY_MAGIC
+    buffer.append(BINARY_FORMAT_VERSION)
+    buffer.append(kind)
+
+
+class _BinaryReader:
+    # reads a binary message without copying it, everything but the decoded values are views of the original buffer.
+    def __init__(self, data):
+        self._view = memoryview(data)
+        self._offset = 0
+
+    def read(self, length):
+        if self._offset + length > len(self._view):
+            raise InvalidEncodingError("Message is truncated at byte: %s" % len(self._view))
+
+        view = self._view[self._offset:self._offset + length]
+        self._offset += length
+        return view
+
+    def read_varint(self):
+        # the hottest path, hence the locals.
+        view, offset = self._view, self._offset
+        value = shift = 0
+        try:
+            while True:
+                byte = view[offset]
+                offset += 1
+                value |= (byte & 0x7f) << shift
+                if byte < 0x80:
+                    self._offset = offset
+                    return value
+                shift += 7
+        except IndexError:
+            raise InvalidEncodingError("Message is truncated at byte: %s" % len(view))
+
+    def read_amount(self):
+        value = self.read_varint()
+        return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+    def read_hash(self):
+        return self.read(32).hex()
+
+    def read_bytes(self):
+        return self.read(self.read_varint())
+
+    def read_header(self, kind):
+        if bytes(self.read(2)) != BINARY_MAGIC:
+            raise InvalidEncodingError("Not a binary encoded message")
+
+        format_version, message_kind = self.read(2)
+        if format_version != BINARY_FORMAT_VERSION:
+            raise InvalidEncodingError("Unsupported binary format version: %s" % format_version)
+        if message_kind != kind:
+            raise InvalidEncodingError("Unexpected kind of object: %s, expected: %s" % (message_kind, kind))
+
+    def done(self):
+        if self._offset != len(self._view):
+            raise InvalidEncodingError("%s trailing bytes" % (len(self._view) - self._offset))
 
 
 class Block:
-    def __init__(self, prev, nonce=0, timestamp=None, transactions=None):
-        self.prev = prev
-        self.nonce = nonce
-        self.timestamp = timestamp or time.time_ns()
-        self.transactions = transactions or []
+    # version 1 blocks hash their full contents, transactions included. version 2 blocks hash a fixed size header,
+    #   which commits to the transactions through a merkle root of their ids.
+    version = 2
+
+    def __init__(self, prev, nonce=0, timestamp=None, transactions=None, version=None):
+        # everything but the nonce is frozen, so that the hash can be cached.
+        self._prev = prev
+        self._nonce = nonce
+        self._timestamp = timestamp or time.time_ns()
+        self._transactions = tuple(transactions or ())
+        if version is not None:
+            self.version = version
+
+        self._hash = None
+        self._merkle_root = None
+
+    @property
+    def prev(self):
+        return self._prev
+
+    @property
+    def timestamp(self):
+        return self._timestamp
+
+    @property
+    def transactions(self):
+        return self._transactions
+
+    @property
+    def nonce(self):
+        return self._nonce
+
+    @nonce.setter
+    def nonce(self, nonce):
+        self._nonce = nonce
+        self._hash = None
 
     @property
     def is_genesis(self):
         return self.prev == "0" * 64
 
+    @property
+    def merkle_root(self):
+        if self._merkle_root is None:
+            self._merkle_root = calculate_merkle_root([t.calculate_hash() for t in self.transactions])
+
+        return self._merkle_root
+
+    @property
+    def header(self):
+        # everything that is hashed in a version 2 block, it can be validated (and relayed) on its own.
+        return {
+            'version': self.version,
+            'timestamp': self.timestamp,
+            'prev': self.prev,
+            'nonce': self.nonce,
+            'merkle_root': self.merkle_root
+        }
+
     @property
     def hashable_contents(self):
+        if self.version >= 2:
+            return self.header
+
         return {
             'timestamp': self.timestamp,
             'prev': self.prev,
@@ -82,7 +559,8 @@ class Block:
         }
 
     def serialize(self):
-        return {
+        serialized_block = {
+            'version': self.version,
             'timestamp': self.timestamp,
             'prev': self.prev,
             'nonce': self.nonce,
@@ -90,96 +568,1483 @@ class Block:
             'transactions': [t.serialize() for t in self.transactions]
         }
 
-    @classmethod
-    def unserialize(cls, serialized_block):
-        return Block(
-            prev=serialized_block["prev"],
-            nonce=serialized_block["nonce"],
-            timestamp=serialized_block["timestamp"],
-            transactions=[
-                Transaction.unserialize(transaction) for transaction in serialized_block['transactions']
-            ]
+        if self.version >= 2:
+            serialized_block['merkle_root'] = self.merkle_root
+
+        return serialized_block
+
+    def compact(self, prefilled_indexes=()):
+        # the block, with the transactions but the prefilled ones replaced by their short ids. the receiver rebuilds it
+        #   from the transactions in its pool.
+        block_hash = self.calculate_hash()
+        compact_block = {
+            'version': self.version,
+            'timestamp': self.timestamp,
+            'prev': self.prev,
+            'nonce': self.nonce,
+            'hash': block_hash,
+            'short_ids': [
+                calculate_short_transaction_id(block_hash, transaction.calculate_hash())
+                for index, transaction in enumerate(self.transactions) if index not in prefilled_indexes
+            ],
+            'prefilled_transactions': [
+                {'index': index, 'transaction': self.transactions[index].serialize()}
+                for index in sorted(prefilled_indexes)
+            ]
+        }
+
+        if self.version >= 2:
+            compact_block['merkle_root'] = self.merkle_root
+
+        return compact_block
+
+    @classmethod
+    def unserialize(cls, serialized_block):
+        # blocks serialized before versioning was introduced are version 1.
+        block = Block(
+            prev=serialized_block["prev"],
+            nonce=serialized_block["nonce"],
+            timestamp=serialized_block["timestamp"],
+            transactions=[
+                Transaction.unserialize(transaction) for transaction in serialized_block['transactions']
+            ],
+            version=serialized_block.get("version", 1)
+        )
+
+        merkle_root = serialized_block.get("merkle_root")
+        if merkle_root is not None:
+            block.check_merkle_root(merkle_root)
+
+        return block
+
+    def encode(self):
+        buffer = bytearray()
+        _write_header(buffer, _BINARY_BLOCK)
+        _write_varint(buffer, self.version)
+        _write_varint(buffer, self.timestamp)
+        _write_hash(buffer, self.prev)
+        _write_varint(buffer, self.nonce)
+        if self.version >= 2:
+            _write_hash(buffer, self.merkle_root)
+
+        _write_varint(buffer, len(self.transactions))
+        for transaction in self.transactions:
+            transaction_buffer = bytearray()
+            transaction._encode_into(transaction_buffer)
+            _write_bytes(buffer, transaction_buffer)
+
+        return bytes(buffer)
+
+    @classmethod
+    def decode(cls, data):
+        # data: a bytes-like object, as returned by `encode`.
+        reader = _BinaryReader(data)
+        reader.read_header(_BINARY_BLOCK)
+        version = reader.read_varint()
+        timestamp = reader.read_varint()
+        prev = reader.read_hash()
+        nonce = reader.read_varint()
+        merkle_root = reader.read_hash() if version >= 2 else None
+        transactions = []
+        for _ in range(reader.read_varint()):
+            transaction_reader = _BinaryReader(reader.read_bytes())
+            transactions.append(Transaction._decode_from(transaction_reader))
+            transaction_reader.done()
+        reader.done()
+
+        block = Block(prev=prev, nonce=nonce, timestamp=timestamp, transactions=transactions, version=version)
+        if merkle_root is not None:
+            block.check_merkle_root(merkle_root)
+
+        return block
+
+    def check_merkle_root(self, merkle_root):
+        # the last node of an odd level is paired with itself, so the same root (and header hash) can be had by
+        #   repeating the last transactions (CVE-2012-2459). blocks with repeated transaction ids are rejected first.
+        transaction_ids = [t.calculate_hash() for t in self.transactions]
+        if len(set(transaction_ids)) != len(transaction_ids):
+            raise InvalidBlockError("Block has duplicate transaction ids")
+
+        if merkle_root != self.merkle_root:
+            raise InvalidBlockError(
+                "Merkle root: %s does not match the block's transactions: %s" % (merkle_root, self.merkle_root)
+            )
+
+    @staticmethod
+    def hash_header(header):
+        return hashlib.sha256(json.dumps(header, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def merkle_proof(self, transaction_id):
+        return calculate_merkle_proof([t.calculate_hash() for t in self.transactions], transaction_id)
+
+    def calculate_hash(self):
+        if self._hash is None:
+            self._hash = hashlib.sha256(json.dumps(self.hashable_contents, sort_keys=True).encode('utf-8')).hexdigest()
+
+        return self._hash
+
+    def preimage_template(self):
+        # the hash preimage split around the nonce: prefix + str(nonce) + suffix, so that miners don't need to
+        #   serialize the whole block for every nonce.
+        marker = "\0nonce\0"
+        preimage = json.dumps(self.hashable_contents | {'nonce': marker}, sort_keys=True)
+        prefix, suffix = preimage.split(json.dumps(marker))
+        return prefix.encode('utf-8'), suffix.encode('utf-8')
+
+
+_encode_json_string = json.encoder.encode_basestring_ascii
+
+
+def _is_canonical_scalar(value):
+    # what `_transaction_preimage` knows how to write: the C encoder takes care of escaping strings the way
+    #   `json.dumps` does, bools and floats are left to `json.dumps`.
+    return type(value) is str or type(value) is int
+
+
+def _transaction_preimage(inputs, outputs, timestamp):
+    # json.dumps({"inputs": inputs, "outputs": outputs, "timestamp": timestamp}, sort_keys=True), byte for byte, with
+    #   the keys written in their sorted order rather than sorted for every dict. anything but the usual fields falls
+    #   back to `json.dumps`.
+    if not (
+        _is_canonical_scalar(timestamp)
+        and all(
+            i.keys() == {'transaction_id', 'vout'}
+            and _is_canonical_scalar(i['transaction_id']) and _is_canonical_scalar(i['vout'])
+            for i in inputs
+        )
+        and all(
+            o.keys() == {'address', 'amount'} and _is_canonical_scalar(o['address']) and _is_canonical_scalar(o['amount'])
+            for o in outputs
+        )
+    ):
+        return json.dumps({'inputs': inputs, 'outputs': outputs, 'timestamp': timestamp}, sort_keys=True).encode('utf-8')
+
+    def scalar(value):
+        return _encode_json_string(value) if type(value) is str else int.__repr__(value)
+
+    return (
+        '{"inputs": [%s], "outputs": [%s], "timestamp": %s}' % (
+            ', '.join(
+                '{"transaction_id": %s, "vout": %s}' % (scalar(i['transaction_id']), scalar(i['vout'])) for i in inputs
+            ),
+            ', '.join('{"address": %s, "amount": %s}' % (scalar(o['address']), scalar(o['amount'])) for o in outputs),
+            scalar(timestamp)
+        )
+    ).encode('utf-8')
+
+
+class Transaction:
+    def __init__(self, inputs, outputs, timestamp=None):
+        # hashed contents are frozen, so that the hash can be cached. signature and public key aren't hashed.
+        self._inputs = tuple(FrozenDict(i) for i in inputs)  # {"transaction_id": str, "vout": int} Dicts.
+        self._outputs = tuple(FrozenDict(o) for o in outputs)  # {"address": str, "amount": int} Dicts.
+        self._timestamp = timestamp or time.time_ns()
+
+        self._hash = None
+        self._preimage = None
+
+        self.signature = None
+        self.public_key = None
+
+    @property
+    def inputs(self):
+        return self._inputs
+
+    @property
+    def outputs(self):
+        return self._outputs
+
+    @property
+    def timestamp(self):
+        return self._timestamp
+
+    @property
+    def is_coinbase(self):
+        return len(self.inputs) == 0
+
+    @property
+    def hashable_contents(self):
+        return {
+            'inputs': self.inputs,
+            'outputs': self.outputs,
+            'timestamp': self.timestamp
+        }
+
+    @property
+    def preimage(self):
+        # the bytes that are hashed, signed and verified: the JSON of `hashable_contents` with sorted keys.
+        if self._preimage is None:
+            self._preimage = _transaction_preimage(self.inputs, self.outputs, self.timestamp)
+
+        return self._preimage
+
+    def serialize(self):
+        return self.hashable_contents | {
+            'signature': self.signature.decode('utf-8') if self.signature else None,
+            'public_key': self.public_key.decode('utf-8') if self.public_key else None,
+            'hash': self.calculate_hash()
+        }
+
+    @classmethod
+    def unserialize(cls, serialized_transaction):
+        transaction = Transaction(
+            inputs=serialized_transaction["inputs"],
+            outputs=serialized_transaction["outputs"],
+            timestamp=serialized_transaction["timestamp"],
+        )
+
+        # unsigned transactions won't have these
+        signature = serialized_transaction.get('signature')
+        if signature:
+            transaction.signature = signature.encode('utf-8')
+
+        public_key = serialized_transaction.get('public_key')
+        if public_key:
+            transaction.public_key = public_key.encode('utf-8')
+
+        return transaction
+
+    def encode(self):
+        buffer = bytearray()
+        _write_header(buffer, _BINARY_TRANSACTION)
+        self._encode_into(buffer)
+        return bytes(buffer)
+
+    def _encode_into(self, buffer):
+        _write_varint(buffer, self.timestamp)
+
+        _write_varint(buffer, len(self.inputs))
+        for input in self.inputs:
+            if input.keys() != {'transaction_id', 'vout'}:
+                raise ValueError("Can't encode input: %s" % input)
+            _write_hash(buffer, input['transaction_id'])
+            _write_varint(buffer, input['vout'])
+
+        _write_varint(buffer, len(self.outputs))
+        for output in self.outputs:
+            if output.keys() != {'address', 'amount'}:
+                raise ValueError("Can't encode output: %s" % output)
+            _write_hash(buffer, output['address'])
+            _write_amount(buffer, output['amount'])
+
+        # base64 encoded in memory, raw bytes on the wire. empty if unsigned.
+        for value in (self.signature, self.public_key):
+            raw_value = base64.b64decode(value) if value else b''
+            if base64.b64encode(raw_value) != (value or b''):
+                raise ValueError("Can't encode: %r as base64" % (value, ))
+            _write_bytes(buffer, raw_value)
+
+    @classmethod
+    def decode(cls, data):
+        # data: a bytes-like object, as returned by `encode`.
+        reader = _BinaryReader(data)
+        reader.read_header(_BINARY_TRANSACTION)
+        transaction = cls._decode_from(reader)
+        reader.done()
+        return transaction
+
+    @classmethod
+    def _decode_from(cls, reader):
+        timestamp = reader.read_varint()
+        inputs = [
+            {'transaction_id': reader.read_hash(), 'vout': reader.read_varint()} for _ in range(reader.read_varint())
+        ]
+        outputs = [
+            {'address': reader.read_hash(), 'amount': reader.read_amount()} for _ in range(reader.read_varint())
+        ]
+
+        transaction = Transaction(inputs=inputs, outputs=outputs, timestamp=timestamp)
+
+        signature = reader.read_bytes()
+        if signature:
+            transaction.signature = base64.b64encode(signature)
+
+        public_key = reader.read_bytes()
+        if public_key:
+            transaction.public_key = base64.b64encode(public_key)
+
+        return transaction
+
+    def calculate_hash(self):
+        if self._hash is None:
+            self._hash = hashlib.sha256(self.preimage).hexdigest()
+
+        return self._hash
+
+    def sign(self, key: ecdsa.SigningKey):
+        # not a fan of these capabilities on what are otherwise plain data structs, however this is rather convenient,
+        # at least for now.
+        signature = crypto_backend.sign(key, self.preimage)
+        self.signature = base64.b64encode(signature)
+        self.public_key = base64.b64encode(crypto_backend.public_key(key))
+
+
+def get_process_context():
+    # worker processes are started by a forkserver rather than forked from the node, whose other threads (Flask, the
+    #   miner, gossip) could be holding a lock, of the logging module or of a cache, that the child would inherit held.
+    return multiprocessing.get_context("forkserver")
+
+
+_mining_stop = None  # set in the mining engine's worker processes
+
+
+def _init_mining_worker(stop):
+    global _mining_stop
+    _mining_stop = stop
+
+
+def _try_nonces(preimage_prefix_hash, preimage_suffix, target, start, step, count):
+    # only the nonce and what follows it in the preimage is hashed per nonce, the digest is compared to the target as
+    #   bytes, which for equal lengths is the same as comparing them as big-endian integers.
+    for nonce in range(start, start + step * count, step):
+        sha256 = preimage_prefix_hash.copy()
+        sha256.update(b'%d' % nonce + preimage_suffix)
+        if sha256.digest() <= target:
+            return nonce
+
+    return None
+
+
+def _search_nonce(preimage_prefix, preimage_suffix, target, start, step, check_interval):
+    # runs in a worker process: try nonces start, start + step, start + 2 * step... until one is found or we're told
+    #   to stop.
+    preimage_prefix_hash = hashlib.sha256(preimage_prefix)
+    while not _mining_stop.is_set():
+        nonce = _try_nonces(preimage_prefix_hash, preimage_suffix, target, start, step, check_interval)
+        if nonce is not None:
+            return nonce
+
+        start += step * check_interval
+
+    return None
+
+
+class MiningEngine:
+    # nonces to try between checks of whether the attempt should be given up.
+    check_interval = 1000
+    # how often (in seconds) the parent process checks on its workers.
+    poll_interval = 0.05
+
+    def __init__(self, processes=1):
+        # processes: how many processes to split the nonce space across, 1 mines in the calling thread and None uses
+        #   every core.
+        self.processes = processes or os.cpu_count()
+
+        self._pool = None
+        self._stop = None
+        self._lock = threading.Lock()
+
+    def search(self, block, mask, should_abort):
+        # return a nonce that makes `block`'s hash lower or equal than `mask`, or None if `should_abort()` returned
+        #   True first.
+        preimage_prefix, preimage_suffix = block.preimage_template()
+        target = mask.to_bytes(32, 'big')
+
+        with self._lock:
+            if self.processes == 1:
+                return self._search(preimage_prefix, preimage_suffix, target, block.nonce, should_abort)
+
+            return self._parallel_search(preimage_prefix, preimage_suffix, target, block.nonce, should_abort)
+
+    def _search(self, preimage_prefix, preimage_suffix, target, start, should_abort):
+        preimage_prefix_hash = hashlib.sha256(preimage_prefix)
+        while True:
+            nonce = _try_nonces(preimage_prefix_hash, preimage_suffix, target, start, 1, self.check_interval)
+            if nonce is not None:
+                return nonce
+
+            if should_abort():
+                return None
+
+            start += self.check_interval
+
+    def _parallel_search(self, preimage_prefix, preimage_suffix, target, start, should_abort):
+        if self._pool is None:
+            context = get_process_context()
+            self._stop = context.Event()
+            self._pool = context.Pool(
+                processes=self.processes, initializer=_init_mining_worker, initargs=(self._stop,)
+            )
+
+        self._stop.clear()
+        done = threading.Event()
+
+        def on_result(nonce):
+            if nonce is not None:
+                done.set()
+
+        results = [
+            self._pool.apply_async(
+                _search_nonce,
+                (preimage_prefix, preimage_suffix, target, start + i, self.processes, self.check_interval),
+                callback=on_result, error_callback=lambda e: done.set()
+            )
+            for i in range(self.processes)
+        ]
+
+        aborted = False
+        while not done.wait(timeout=self.poll_interval):
+            if should_abort():
+                aborted = True
+                break
+
+        # stop every other worker, and wait for them so that the next search starts clean.
+        self._stop.set()
+        nonces = [nonce for nonce in (result.get() for result in results) if nonce is not None]
+
+        if aborted or not nonces:
+            return None
+
+        return min(nonces)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+
+class EcdsaBackend:
+    # the pure Python one, always available. whatever the backend, signing keys are ecdsa.SigningKey objects,
+    #   signatures are the raw 64 bytes of r || s (RFC 6979, so the same key and data always give the same signature),
+    #   public keys the raw 64 bytes of x || y, and addresses the hex SHA-256 of the public key.
+    name = "ecdsa"
+
+    def sign(self, key, data):
+        return key.sign_deterministic(data, hashfunc=hashlib.sha256)
+
+    def public_key(self, key):
+        return key.verifying_key.to_string()
+
+    def parse_public_key(self, public_key):
+        # only the raw encoding, so that every backend agrees on which keys are valid: the compressed and uncompressed
+        #   SEC 1 encodings of the same point would have other addresses.
+        if len(public_key) != 64:
+            raise ValueError("Public key must be 64 bytes long, not %s" % len(public_key))
+
+        # the point has to know the curve's order for its multiplication tables to be precomputed later on.
+        point = ecdsa.ellipticcurve.PointJacobi.from_bytes(
+            ecdsa.SECP256k1.curve, public_key, order=ecdsa.SECP256k1.order
+        )
+        return ecdsa.VerifyingKey.from_public_point(point, curve=ecdsa.SECP256k1)
+
+    def precompute(self, parsed_public_key):
+        # costs about as much as 3 verifications and halves the cost of every later one.
+        parsed_public_key.precompute()
+
+    def verify(self, parsed_public_key, signature, data):
+        # raises ecdsa.BadSignatureError, whatever the backend.
+        parsed_public_key.verify(signature=signature, data=data, hashfunc=hashlib.sha256)
+
+    def address(self, public_key):
+        return hashlib.sha256(public_key).hexdigest()
+
+
+class CryptographyBackend(EcdsaBackend):
+    # OpenSSL, through the `cryptography` package.
+    name = "cryptography"
+
+    def __init__(self):
+        # {secret: ec.EllipticCurvePrivateKey}, deriving the key costs about as much as signing.
+        self._private_keys = LRUCache(maxsize=64)
+
+    def sign(self, key, data):
+        private_key = self._private_keys.get(key.privkey.secret_multiplier)
+        if private_key is None:
+            private_key = ec.derive_private_key(key.privkey.secret_multiplier, ec.SECP256K1())
+            self._private_keys.put(key.privkey.secret_multiplier, private_key)
+
+        r, s = ec_utils.decode_dss_signature(
+            private_key.sign(data, ec.ECDSA(hashes.SHA256(), deterministic_signing=True))
+        )
+        return r.to_bytes(32, 'big') + s.to_bytes(32, 'big')
+
+    def parse_public_key(self, public_key):
+        if len(public_key) != 64:
+            raise ValueError("Public key must be 64 bytes long, not %s" % len(public_key))
+
+        return ec.EllipticCurvePublicKey.from_encoded_point(ec.SECP256K1(), b'\x04' + public_key)
+
+    def precompute(self, parsed_public_key):
+        pass
+
+    def verify(self, parsed_public_key, signature, data):
+        if len(signature) != 64:
+            raise ecdsa.BadSignatureError("Signature must be 64 bytes long, not %s" % len(signature))
+
+        der_signature = ec_utils.encode_dss_signature(
+            int.from_bytes(signature[:32], 'big'), int.from_bytes(signature[32:], 'big')
+        )
+        try:
+            parsed_public_key.verify(der_signature, data, ec.ECDSA(hashes.SHA256()))
+        except InvalidSignature:
+            raise ecdsa.BadSignatureError("Signature verification failed")
+
+
+crypto_backends = {backend.name: backend for backend in (EcdsaBackend, CryptographyBackend)}
+
+
+def select_crypto_backend(name=None):
+    # name: one of `crypto_backends`, defaults to TOYCHAIN_CRYPTO_BACKEND, or else to the fastest one installed.
+    name = name or os.getenv("TOYCHAIN_CRYPTO_BACKEND") or ("cryptography" if ec is not None else "ecdsa")
+    if name not in crypto_backends:
+        raise ValueError("Unknown crypto backend: %s" % name)
+
+    if name == "cryptography" and ec is None:
+        raise ValueError("The cryptography crypto backend needs the `cryptography` package, 44.0 onwards, installed")
+
+    return crypto_backends[name]()
+
+
+crypto_backend = select_crypto_backend()
+
+
+# {(backend name, public_key): {"key": parsed public key, "address": str, "uses": int}}, public keys being raw bytes.
+#   it's per process, the signature verification workers keep their own.
+_public_keys = LRUCache(maxsize=1024)
+
+
+def get_public_key(public_key):
+    # public_key: raw bytes. parsing the point and hashing it for the address is done once per key.
+    entry = _public_keys.get((crypto_backend.name, public_key))
+    if entry is None:
+        entry = {
+            "key": crypto_backend.parse_public_key(public_key),
+            "address": crypto_backend.address(public_key),
+            "uses": 0
+        }
+        _public_keys.put((crypto_backend.name, public_key), entry)
+
+    return entry
+
+
+def verify_signatures(checks):
+    # checks: [(public_key, signature, data), ...], all raw bytes. raises ecdsa.BadSignatureError on the first bad one.
+    for public_key, signature, data in checks:
+        entry = get_public_key(public_key)
+
+        # precomputing pays off for keys that are seen more than once only.
+        entry["uses"] += 1
+        if entry["uses"] == 2:
+            crypto_backend.precompute(entry["key"])
+
+        crypto_backend.verify(entry["key"], signature, data)
+
+
+def find_bad_signatures(check_groups):
+    # check_groups: [[(public_key, signature, data), ...], ...]. returns, for each group, None if all of its signatures
+    #   are good, or the exception raised by its first bad one.
+    results = []
+    for checks in check_groups:
+        try:
+            verify_signatures(checks)
+        except Exception as e:
+            results.append(e)
+        else:
+            results.append(None)
+
+    return results
+
+
+class SignatureVerifier:
+    # how many chunks per worker a batch is split in, so that the workers finish at about the same time.
+    chunks_per_worker = 4
+
+    def __init__(self, workers=0):
+        # workers: size of the process pool that batches are verified on, 0 verifies everything in the calling thread.
+        self.workers = workers
+
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def verify(self, checks):
+        # the signature checks of a single transaction, which aren't worth a round trip to another process.
+        return verify_signatures(checks)
+
+    def verify_each(self, check_groups):
+        # same as `find_bad_signatures`, on the process pool: every group is verified, once, bad signatures or not.
+        if not self.workers or len(check_groups) <= 1:
+            return find_bad_signatures(check_groups)
+
+        executor = self._get_executor()
+        chunk_size = math.ceil(len(check_groups) / (self.workers * self.chunks_per_worker))
+        futures = [
+            executor.submit(find_bad_signatures, check_groups[i:i + chunk_size])
+            for i in range(0, len(check_groups), chunk_size)
+        ]
+        return [result for future in futures for result in future.result()]
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=get_process_context()
+                )
+
+            return self._executor
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+class GossipDispatcher:
+    # announces blocks and transactions to peers in the background, so that a slow peer doesn't hold up whoever
+    #   publishes them, and fetches what peers announce, so that they don't wait on us either. a send per peer, or a
+    #   fetch per announcement, is queued, and the queue is bounded: the ones that don't fit are dropped, and counted.
+    def __init__(self, workers=4, max_queue_size=1000, timeout=5):
+        # workers: threads sending to peers in parallel, 0 sends everything in the calling thread. timeout: seconds to
+        #   connect to a peer, and then to wait for its response.
+        self.workers = workers
+        self.max_queue_size = max_queue_size
+        self.timeout = timeout
+        self.dropped = 0
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._threads = []
+        # {peer: requests.Session}, to keep the connections to each peer alive.
+        self._sessions = {}
+        # {peer: {"sent": count, "failed": count, "seconds": total latency}}
+        self._peer_stats = {}
+        self._lock = threading.Lock()
+
+    def announce(self, peers, inventory):
+        # inventory: {"blocks": [hash], "transactions": [hash]}, for peers to fetch what they lack. returns how many
+        #   sends were queued.
+        data = json.dumps(inventory).encode('utf-8')
+
+        queued = 0
+        for peer in peers:
+            if self.submit(functools.partial(self._send, peer, "/inventory", data, "application/json")):
+                queued += 1
+            else:
+                logger.warning("Gossip queue is full, send to peer: %s dropped", peer)
+
+        return queued
+
+    def submit(self, task):
+        # task: a callable, run by a worker, or right away with no workers. returns whether it was queued.
+        if not self.workers:
+            self._call(task)
+            return True
+
+        self._start()
+        try:
+            self._queue.put_nowait(task)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+        return True
+
+    def _start(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name="gossip-%s" % len(self._threads), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._call(item)
+            finally:
+                self._queue.task_done()
+
+    def _call(self, task):
+        try:
+            task()
+        except Exception:
+            logger.exception("Gossip task failed")
+
+    def _session(self, peer):
+        with self._lock:
+            if peer not in self._sessions:
+                self._sessions[peer] = requests.Session()
+                self._peer_stats[peer] = {"sent": 0, "failed": 0, "seconds": 0.0}
+            return self._sessions[peer]
+
+    def _send(self, peer, path, data, content_type):
+        session = self._session(peer)
+        start = time.perf_counter()
+        try:
+            session.post(
+                "http://%s:5000%s" % (peer, path), data=data, headers={"Content-Type": content_type},
+                timeout=self.timeout
+            )
+            sent = True
+        except requests.exceptions.RequestException as e:
+            logger.info("Unable to send to peer: %s, %s", peer, e)
+            sent = False
+
+        with self._lock:
+            peer_stats = self._peer_stats[peer]
+            peer_stats["sent" if sent else "failed"] += 1
+            peer_stats["seconds"] += time.perf_counter() - start
+
+    def join(self):
+        # wait until every queued send is done.
+        self._queue.join()
+
+    def close(self):
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_size": self._queue.qsize(),
+                "max_queue_size": self.max_queue_size,
+                "workers": self.workers,
+                "dropped": self.dropped,
+                "peers": {
+                    peer: {
+                        "sent": peer_stats["sent"],
+                        "failed": peer_stats["failed"],
+                        "average_latency": peer_stats["seconds"] / ((peer_stats["sent"] + peer_stats["failed"]) or 1)
+                    }
+                    for peer, peer_stats in self._peer_stats.items()
+                }
+            }
+
+
+def encode_block_record(block):
+    # how blocks are stored: a format byte, 0 for binary and 1 for JSON for the blocks that can't be represented
+    #   exactly in binary, then the block.
+    try:
+        return b'\x00' + block.encode()
+    except ValueError:
+        return b'\x01' + json.dumps(block.serialize()).encode('utf-8')
+
+
+def decode_block_record(record):
+    record = memoryview(record)
+    if record[0] == 0:
+        return Block.decode(record[1:])
+
+    return Block.unserialize(json.loads(bytes(record[1:])))
+
+
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+BINARY_STREAM_CONTENT_TYPE = "application/vnd.toychain.binary-stream"
+_block_stream_record_header = struct.Struct("<I")
+
+
+def encode_block_stream(blocks, binary=False):
+    # a chunk per block, to be streamed: a line of JSON, or a length (u32) prefixed block record.
+    for block in blocks:
+        if binary:
+            record = encode_block_record(block)
+            yield _block_stream_record_header.pack(len(record)) + record
+        else:
+            yield json.dumps(block.serialize()).encode('utf-8') + b"\n"
+
+
+def decode_block_stream(chunks, binary=False):
+    # the blocks in `encode_block_stream`'s output, however it was split into chunks on the way.
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        offset = 0
+        while True:
+            try:
+                if binary:
+                    if len(buffer) - offset < _block_stream_record_header.size:
+                        break
+                    (length, ) = _block_stream_record_header.unpack_from(buffer, offset)
+                    end = offset + _block_stream_record_header.size + length
+                    if len(buffer) < end:
+                        break
+                    block = decode_block_record(bytes(buffer[offset + _block_stream_record_header.size:end]))
+                else:
+                    end = buffer.find(b"\n", offset) + 1
+                    if end == 0:
+                        break
+                    block = Block.unserialize(json.loads(bytes(buffer[offset:end])))
+            except (AttributeError, IndexError, KeyError, TypeError, ValueError) as e:
+                # whatever the peer sent, it's not a block
+                raise InvalidEncodingError("Block stream has a malformed block, %r" % e)
+
+            yield block
+            offset = end
+
+        del buffer[:offset]
+
+    if buffer:
+        raise InvalidEncodingError("Block stream ends with a truncated block")
+
+
+class BlockLog:
+    # the main chain on disk, one block after the other. blocks are appended to segment files, and an index of fixed
+    #   size records, memory mapped, tells where each one is by height. blocks are only read when asked for.
+    #
+    # segment record: length (u32), format (u8, 0: binary, 1: JSON for blocks that can't be encoded in binary), block.
+    # index: magic, version (u32), block count (u64), then a record per height: segment (u32), offset (u64),
+    #   length (u32), block hash (32 bytes).
+    index_magic = b"TCIX"
+    index_version = 1
+    _index_header = struct.Struct("<4sIQ")
+    _index_record = struct.Struct("<IQI32s")
+    _segment_record_header = struct.Struct("<I")
+
+    def __init__(self, directory, segment_size=128 * 1024 * 1024):
+        # segment_size: a new segment is started once the current one has grown past it.
+        self.directory = directory
+        self.segment_size = segment_size
+
+        self._lock = threading.RLock()
+        self._segments = {}  # {segment number: file descriptor}
+
+        os.makedirs(directory, exist_ok=True)
+        index_filename = os.path.join(directory, "index.dat")
+        self._index_file = open(index_filename, "r+b" if os.path.exists(index_filename) else "w+b")
+        if os.fstat(self._index_file.fileno()).st_size == 0:
+            self._index_file.write(self._index_header.pack(self.index_magic, self.index_version, 0))
+            self._index_file.truncate(self._index_header.size + 1024 * self._index_record.size)
+        self._index = mmap.mmap(self._index_file.fileno(), 0)
+
+        magic, version, self._count = self._index_header.unpack_from(self._index)
+        if magic != self.index_magic or version != self.index_version:
+            raise BlockLogError("%s is not a version %s block log index" % (index_filename, self.index_version))
+
+        # anything past the last indexed block was a write that didn't complete.
+        if self._count:
+            segment, offset, length, _ = self._read_index_record(self._count - 1)
+            self._segment_end = (segment, offset + length)
+        else:
+            self._segment_end = (0, 0)
+        os.ftruncate(self._segment(self._segment_end[0]), self._segment_end[1])
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, height):
+        if height < 0:
+            height += self._count
+        if not 0 <= height < self._count:
+            raise IndexError("Block log height out of range: %s" % height)
+
+        return self.read(height)
+
+    def __iter__(self):
+        for height in range(self._count):
+            yield self.read(height)
+
+    def get_height(self, block_hash):
+        # searched for in the index, from the tip down, rather than kept in memory.
+        try:
+            block_hash = bytes.fromhex(block_hash)
+        except ValueError:
+            return None
+
+        with self._lock:
+            start = self._index_header.size
+            position = self._index.rfind(block_hash, start, start + self._count * self._index_record.size)
+            while position != -1:
+                height, offset = divmod(position - start, self._index_record.size)
+                if offset == self._index_record.size - len(block_hash):
+                    return height
+
+                position = self._index.rfind(block_hash, start, position + len(block_hash) - 1)
+
+        return None
+
+    def get_hash(self, height):
+        with self._lock:
+            return self._read_index_record(height)[3].hex()
+
+    def read(self, height):
+        with self._lock:
+            segment, offset, length, _ = self._read_index_record(height)
+            record = os.pread(self._segment(segment), length, offset)
+
+        return decode_block_record(memoryview(record)[self._segment_record_header.size:])
+
+    def append(self, block):
+        block_record = encode_block_record(block)
+        record = self._segment_record_header.pack(len(block_record) - 1) + block_record
+
+        with self._lock:
+            segment, offset = self._segment_end
+            if offset and offset + len(record) > self.segment_size:
+                segment, offset = segment + 1, 0
+
+            # the block first, then its index record, then the count that makes it visible.
+            os.pwrite(self._segment(segment), record, offset)
+            self._segment_end = (segment, offset + len(record))
+
+            height = self._count
+            if self._index_header.size + (height + 1) * self._index_record.size > len(self._index):
+                self._grow_index()
+            self._index_record.pack_into(
+                self._index, self._index_header.size + height * self._index_record.size,
+                segment, offset, len(record), bytes.fromhex(block.calculate_hash())
+            )
+            self._set_count(height + 1)
+
+        return height
+
+    def truncate(self, count):
+        # drop every block from height `count` onwards, as they've been disconnected from the main chain.
+        with self._lock:
+            if count >= self._count:
+                return
+
+            segment, offset, _, _ = self._read_index_record(count)
+            self._set_count(count)
+
+            os.ftruncate(self._segment(segment), offset)
+            for later_segment in range(segment + 1, self._segment_end[0] + 1):
+                if later_segment in self._segments:
+                    os.close(self._segments.pop(later_segment))
+                os.remove(self._segment_filename(later_segment))
+            self._segment_end = (segment, offset)
+
+    def flush(self):
+        with self._lock:
+            for fd in self._segments.values():
+                os.fsync(fd)
+            self._index.flush()
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            for fd in self._segments.values():
+                os.close(fd)
+            self._segments = {}
+            self._index.close()
+            self._index_file.close()
+
+    def write_branches(self, fork, orphans):
+        # fork and orphan blocks are few and short lived, they're rewritten in full.
+        filename = os.path.join(self.directory, "branches.json")
+        with open(filename + ".tmp", "w") as f:
+            json.dump({"fork": [b.serialize() for b in fork], "orphans": [b.serialize() for b in orphans]}, f)
+        os.replace(filename + ".tmp", filename)
+
+    def read_branches(self):
+        try:
+            with open(os.path.join(self.directory, "branches.json")) as f:
+                branches = json.load(f)
+        except FileNotFoundError:
+            return [], []
+
+        return (
+            [Block.unserialize(b) for b in branches["fork"]], [Block.unserialize(b) for b in branches["orphans"]]
+        )
+
+    def _read_index_record(self, height):
+        return self._index_record.unpack_from(self._index, self._index_header.size + height * self._index_record.size)
+
+    def _set_count(self, count):
+        self._count = count
+        self._index_header.pack_into(self._index, 0, self.index_magic, self.index_version, count)
+
+    def _grow_index(self):
+        size = len(self._index)
+        self._index.close()
+        self._index_file.truncate(self._index_header.size + 2 * (size - self._index_header.size))
+        self._index = mmap.mmap(self._index_file.fileno(), 0)
+
+    def _segment_filename(self, segment):
+        return os.path.join(self.directory, "blocks-%05d.dat" % segment)
+
+    def _segment(self, segment):
+        if segment not in self._segments:
+            self._segments[segment] = os.open(self._segment_filename(segment), os.O_RDWR | os.O_CREAT, 0o644)
+
+        return self._segments[segment]
+
+
+class _BlockLogBlocks(collections.abc.Sequence):
+    # the main chain's blocks of a `MemoryChainstate` loaded from a block log. the ones that are in the log stay there,
+    #   and are read from it when they aren't among the recently used ones, the ones connected since are kept in memory.
+    def __init__(self, block_log, hot_blocks=16):
+        self._block_log = block_log
+        # blocks below this height are the log's.
+        self._logged = 0
+        self._blocks = []
+        self._hot_blocks = LRUCache(maxsize=hot_blocks)
+
+    def __len__(self):
+        return self._logged + len(self._blocks)
+
+    def __getitem__(self, height):
+        if isinstance(height, slice):
+            return [self[h] for h in range(*height.indices(len(self)))]
+
+        if height < 0:
+            height += len(self)
+        if not 0 <= height < len(self):
+            raise IndexError("Block height out of range: %s" % height)
+
+        if height >= self._logged:
+            return self._blocks[height - self._logged]
+
+        block = self._hot_blocks.get(height)
+        if block is None:
+            block = self._block_log.read(height)
+            self._hot_blocks.put(height, block)
+
+        return block
+
+    def get_hashes(self, start, stop):
+        return [
+            self._block_log.get_hash(height) if height < self._logged else self[height].calculate_hash()
+            for height in range(*slice(start, stop).indices(len(self)))
+        ]
+
+    def append(self, block):
+        # blocks are connected while loading in the same order as they are in the log, the log's prefix that the main
+        #   chain shares is never written to by `Blockchain.save`.
+        if (
+            not self._blocks and self._logged < len(self._block_log)
+            and self._block_log.get_hash(self._logged) == block.calculate_hash()
+        ):
+            self._hot_blocks.put(self._logged, block)
+            self._logged += 1
+        else:
+            self._blocks.append(block)
+
+    def pop(self):
+        if self._blocks:
+            return self._blocks.pop()
+
+        block = self[-1]
+        self._logged -= 1
+        self._hot_blocks.pop(self._logged)
+        return block
+
+
+class MemoryChainstate:
+    # the main chain and its indexes, as plain lists and dicts. `blocks`, `utxos`, `block_index` and
+    #   `transaction_index` are read directly, and only changed through the methods below.
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.blocks = []
+        # the UTXO set of the main chain, {(transaction_id, vout): {"address": str, "amount": int}}. it's updated as
+        #   blocks get connected to or disconnected from the main chain, so that we never have to scan the chain.
+        self.utxos = {}
+        # {block_hash: block_height} for every block in the main chain.
+        self.block_index = {}
+        # {transaction_id: (block_height, position)} for every transaction in the main chain.
+        self.transaction_index = {}
+        # for every block in the main chain, the outputs it spent: [[((transaction_id, vout), output), ...], ...], so
+        #   that they can be restored if the block is ever disconnected.
+        self._undo = []
+        # the UTXO set, by address: {address: {(transaction_id, vout): amount}}
+        self._address_index = {}
+        # the height of the oldest block we have. it's above 0 if the chain was started from a snapshot, until the
+        #   blocks below it have been backfilled, and those blocks are None in `blocks`.
+        self.history_start = 0
+
+    def read_blocks_from(self, block_log):
+        # for an empty chainstate, about to be loaded from `block_log`: blocks are read from it again when needed,
+        #   rather than all of them being kept in memory.
+        self.blocks = _BlockLogBlocks(block_log)
+
+    def start_at(self, height):
+        # for an empty chainstate to go on from a snapshot, whose oldest block is at `height`.
+        self.blocks = [None] * height
+        self._undo = [None] * height
+        self.history_start = height
+
+    @contextlib.contextmanager
+    def batch(self):
+        # changes made within are applied all at once, if the chainstate supports it.
+        yield
+
+    def append_block(self, block, spent):
+        self.blocks.append(block)
+        self._undo.append(spent)
+        self.block_index[block.calculate_hash()] = len(self.blocks) - 1
+
+    def pop_block(self):
+        # returns the tip, and the outputs it spent.
+        block = self.blocks.pop()
+        del self.block_index[block.calculate_hash()]
+        return block, self._undo.pop()
+
+    def get_undo(self, height):
+        # the outputs the block at `height` spent, None for backfilled blocks.
+        return self._undo[height]
+
+    def get_block_hashes(self, start, stop):
+        # the hashes of the blocks from height `start` up to, not including, `stop`.
+        if isinstance(self.blocks, _BlockLogBlocks):
+            return self.blocks.get_hashes(start, stop)
+
+        return [block.calculate_hash() for block in self.blocks[start:stop]]
+
+    def backfill_block(self, height, block):
+        # `block` goes right below `history_start`, as history only: its outputs are already accounted for in the UTXO
+        #   set.
+        self.blocks[height] = block
+        self.block_index[block.calculate_hash()] = height
+        self.history_start = height
+
+    def index_transaction(self, transaction_id, block_height, position):
+        self.transaction_index[transaction_id] = (block_height, position)
+
+    def unindex_transaction(self, transaction_id):
+        self.transaction_index.pop(transaction_id, None)
+
+    def add_unspent_output(self, outpoint, output):
+        self.utxos[outpoint] = output
+        self._address_index.setdefault(output['address'], {})[outpoint] = output['amount']
+
+    def remove_unspent_output(self, outpoint):
+        output = self.utxos.pop(outpoint, None)
+        if output is not None:
+            address_outputs = self._address_index[output['address']]
+            del address_outputs[outpoint]
+            if not address_outputs:
+                del self._address_index[output['address']]
+
+        return output
+
+    def get_address_outputs(self, address):
+        # {(transaction_id, vout): amount}
+        return dict(self._address_index.get(address, {}))
+
+    def unspent_outputs(self):
+        # every (outpoint, output) in the UTXO set, sorted by outpoint.
+        return sorted(self.utxos.items())
+
+    def close(self):
+        pass
+
+
+class _SQLiteBlocks(collections.abc.Sequence):
+    # the main chain's blocks, read from the database when they aren't among the recently used ones.
+    def __init__(self, chainstate):
+        self._chainstate = chainstate
+
+    def __len__(self):
+        return self._chainstate._block_count
+
+    def __getitem__(self, height):
+        if isinstance(height, slice):
+            return [self[h] for h in range(*height.indices(len(self)))]
+
+        if height < 0:
+            height += len(self)
+        if not 0 <= height < len(self):
+            raise IndexError("Block height out of range: %s" % height)
+
+        return self._chainstate._read_block(height)
+
+
+class _SQLiteMapping(collections.abc.Mapping):
+    # a read-only view of a table, by its primary key.
+    def __init__(self, chainstate, get_query, keys_query, count_query, make_key=lambda row: row[0], make_value=None):
+        self._chainstate = chainstate
+        self._get_query = get_query
+        self._keys_query = keys_query
+        self._count_query = count_query
+        self._make_key = make_key
+        self._make_value = make_value
+
+    def __getitem__(self, key):
+        rows = self._chainstate._query(self._get_query, key if isinstance(key, tuple) else (key, ))
+        if not rows:
+            raise KeyError(key)
+
+        return self._make_value(rows[0])
+
+    def __iter__(self):
+        return iter([self._make_key(row) for row in self._chainstate._query(self._keys_query)])
+
+    def __len__(self):
+        return self._chainstate._query(self._count_query)[0][0]
+
+
+class SQLiteChainstate:
+    # the same as `MemoryChainstate`, in an SQLite database, so that the node doesn't need to keep the whole chain in
+    #   memory or read it all again on restart. only the `hot_blocks` most recently used blocks are kept in memory.
+    #   every connected or disconnected block is a single database transaction. when started from a snapshot, there are
+    #   no rows for the blocks below `history_start`, and backfilled blocks have no undo.
+    schema = """
+        CREATE TABLE IF NOT EXISTS blocks (
+            height INTEGER PRIMARY KEY, hash TEXT NOT NULL UNIQUE, block BLOB NOT NULL, undo TEXT
+        );
+        CREATE TABLE IF NOT EXISTS transactions (
+            transaction_id TEXT PRIMARY KEY, height INTEGER NOT NULL, position INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS utxos (
+            transaction_id TEXT NOT NULL, vout INTEGER NOT NULL, address TEXT NOT NULL, amount NOT NULL,
+            PRIMARY KEY (transaction_id, vout)
+        );
+        CREATE INDEX IF NOT EXISTS utxos_by_address ON utxos (address);
+    """
+
+    def __init__(self, filename, hot_blocks=16):
+        self.filename = filename
+
+        self._lock = threading.RLock()
+        self._batch_depth = 0
+        # autocommit, transactions are started explicitly by `batch`.
+        self._connection = sqlite3.connect(filename, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(self.schema)
+
+        self._hot_blocks = LRUCache(maxsize=hot_blocks)
+        self._count_blocks()
+
+        self.blocks = _SQLiteBlocks(self)
+        self.utxos = _SQLiteMapping(
+            self,
+            "SELECT address, amount FROM utxos WHERE transaction_id = ? AND vout = ?",
+            "SELECT transaction_id, vout FROM utxos", "SELECT COUNT(*) FROM utxos",
+            make_key=tuple, make_value=lambda row: FrozenDict(address=row[0], amount=row[1])
+        )
+        self.block_index = _SQLiteMapping(
+            self,
+            "SELECT height FROM blocks WHERE hash = ?", "SELECT hash FROM blocks", "SELECT COUNT(*) FROM blocks",
+            make_value=lambda row: row[0]
+        )
+        self.transaction_index = _SQLiteMapping(
+            self,
+            "SELECT height, position FROM transactions WHERE transaction_id = ?",
+            "SELECT transaction_id FROM transactions", "SELECT COUNT(*) FROM transactions",
+            make_value=tuple
         )
 
-    def calculate_hash(self):
-        return hashlib.sha256(json.dumps(self.hashable_contents, sort_keys=True).encode('utf-8')).hexdigest()
+    def reset(self):
+        with self.batch():
+            self._query("DELETE FROM blocks")
+            self._query("DELETE FROM transactions")
+            self._query("DELETE FROM utxos")
+            self._block_count = 0
+            self.history_start = 0
+            self._hot_blocks.clear()
+
+    def read_blocks_from(self, block_log):
+        # the blocks are kept in the database already.
+        pass
+
+    def start_at(self, height):
+        self._block_count = height
+        self.history_start = height
+
+    @contextlib.contextmanager
+    def batch(self):
+        with self._lock:
+            if self._batch_depth == 0:
+                self._connection.execute("BEGIN")
+            self._batch_depth += 1
+            try:
+                yield
+            except BaseException:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    self._connection.execute("ROLLBACK")
+                    # the in memory state may not match what's been rolled back.
+                    self._count_blocks()
+                    self._hot_blocks.clear()
+                raise
+            else:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    self._connection.execute("COMMIT")
+
+    def append_block(self, block, spent):
+        undo = json.dumps([[outpoint[0], outpoint[1], output['address'], output['amount']] for outpoint, output in spent])
+        with self.batch():
+            self._query(
+                "INSERT INTO blocks (height, hash, block, undo) VALUES (?, ?, ?, ?)",
+                (self._block_count, block.calculate_hash(), encode_block_record(block), undo)
+            )
+            self._hot_blocks.put(self._block_count, block)
+            self._block_count += 1
+
+    def pop_block(self):
+        with self.batch():
+            height = self._block_count - 1
+            block = self._read_block(height)
+            spent = self.get_undo(height)
+            self._query("DELETE FROM blocks WHERE height = ?", (height, ))
+            self._block_count -= 1
+
+        self._hot_blocks.pop(height)
+        return block, spent
+
+    def get_undo(self, height):
+        rows = self._query("SELECT undo FROM blocks WHERE height = ?", (height, ))
+        if not rows or rows[0][0] is None:
+            return None
 
+        return [
+            ((transaction_id, vout), FrozenDict(address=address, amount=amount))
+            for transaction_id, vout, address, amount in json.loads(rows[0][0])
+        ]
 
-class Transaction:
-    def __init__(self, inputs, outputs, timestamp=None):
-        self.inputs = inputs  # list of {"transaction_id": str, "vout": int} Dicts.
-        self.outputs = outputs  # list of {"address": str, "amount": int} Dicts.
-        self.timestamp = timestamp or time.time_ns()
+    def get_block_hashes(self, start, stop):
+        # from the `hash` column, without reading or decoding the blocks.
+        return [
+            row[0] for row in self._query(
+                "SELECT hash FROM blocks WHERE height >= ? AND height < ? ORDER BY height", (start, stop)
+            )
+        ]
 
-        self.signature = None
-        self.public_key = None
+    def backfill_block(self, height, block):
+        with self.batch():
+            self._query(
+                "INSERT INTO blocks (height, hash, block, undo) VALUES (?, ?, ?, NULL)",
+                (height, block.calculate_hash(), encode_block_record(block))
+            )
+            self.history_start = height
 
-    @property
-    def is_coinbase(self):
-        return len(self.inputs) == 0
+    def index_transaction(self, transaction_id, block_height, position):
+        self._query(
+            "INSERT OR REPLACE INTO transactions (transaction_id, height, position) VALUES (?, ?, ?)",
+            (transaction_id, block_height, position)
+        )
 
-    @property
-    def hashable_contents(self):
+    def unindex_transaction(self, transaction_id):
+        self._query("DELETE FROM transactions WHERE transaction_id = ?", (transaction_id, ))
+
+    def add_unspent_output(self, outpoint, output):
+        self._query(
+            "INSERT OR REPLACE INTO utxos (transaction_id, vout, address, amount) VALUES (?, ?, ?, ?)",
+            (*outpoint, output['address'], output['amount'])
+        )
+
+    def remove_unspent_output(self, outpoint):
+        with self.batch():
+            output = self.utxos.get(outpoint)
+            if output is not None:
+                self._query("DELETE FROM utxos WHERE transaction_id = ? AND vout = ?", outpoint)
+
+        return output
+
+    def get_address_outputs(self, address):
         return {
-            'inputs': self.inputs,
-            'outputs': self.outputs,
-            'timestamp': self.timestamp
+            (transaction_id, vout): amount
+            for transaction_id, vout, amount in self._query(
+                "SELECT transaction_id, vout, amount FROM utxos WHERE address = ?", (address, )
+            )
         }
 
-    def serialize(self):
-        return self.hashable_contents | {
-            'signature': self.signature.decode('utf-8') if self.signature else None,
-            'public_key': self.public_key.decode('utf-8') if self.public_key else None,
-            'hash': self.calculate_hash()
-        }
+    def unspent_outputs(self):
+        return [
+            ((transaction_id, vout), FrozenDict(address=address, amount=amount))
+            for transaction_id, vout, address, amount in self._query(
+                "SELECT transaction_id, vout, address, amount FROM utxos ORDER BY transaction_id, vout"
+            )
+        ]
 
-    @classmethod
-    def unserialize(cls, serialized_transaction):
-        transaction = Transaction(
-            inputs=serialized_transaction["inputs"],
-            outputs=serialized_transaction["outputs"],
-            timestamp=serialized_transaction["timestamp"],
-        )
+    def close(self):
+        with self._lock:
+            self._connection.close()
 
-        # unsigned transactions won't have these
-        signature = serialized_transaction.get('signature')
-        if signature:
-            transaction.signature = signature.encode('utf-8')
+    def _count_blocks(self):
+        # blocks are numbered from `history_start` to the tip, with no gaps.
+        low, high = self._query("SELECT MIN(height), MAX(height) FROM blocks")[0]
+        self.history_start = low or 0
+        self._block_count = high + 1 if high is not None else 0
 
-        public_key = serialized_transaction.get('public_key')
-        if public_key:
-            transaction.public_key = public_key.encode('utf-8')
+    def _read_block(self, height):
+        if height < self.history_start:
+            return None
 
-        return transaction
+        block = self._hot_blocks.get(height)
+        if block is None:
+            block = decode_block_record(self._query("SELECT block FROM blocks WHERE height = ?", (height, ))[0][0])
+            self._hot_blocks.put(height, block)
 
-    def calculate_hash(self):
-        return hashlib.sha256(json.dumps(self.hashable_contents, sort_keys=True).encode('utf-8')).hexdigest()
+        return block
 
-    def sign(self, key: ecdsa.SigningKey):
-        # not a fan of these capabilities on what are otherwise plain data structs, however this is rather convenient,
-        # at least for now.
-        signature = key.sign(json.dumps(self.hashable_contents, sort_keys=True).encode('utf-8'), hashfunc=hashlib.sha256)
-        self.signature = base64.b64encode(signature)
-        self.public_key = base64.b64encode(key.verifying_key.to_string())
+    def _query(self, query, parameters=()):
+        # every row, fetched before another thread gets to use the connection.
+        with self._lock:
+            return self._connection.execute(query, parameters).fetchall()
+
+
+def import_blockchain_file(filename, block_log):
+    # one-shot, from the JSON file `/persistence/save` used to write.
+    with open(filename) as f:
+        blockchain = Blockchain.unserialize(json.load(f))
+
+    blockchain.save(block_log)
+    return blockchain
+
+
+def resolve_host(host):
+    # the IP addresses `host` resolves to, none if it doesn't.
+    try:
+        return {address_info[4][0] for address_info in socket.getaddrinfo(host, None)}
+    except (socket.gaierror, UnicodeError):
+        return set()
 
 
 class Blockchain:
-    def __init__(self, transactions_per_block=2, confirmations=2, base_difficulty=20, base_block_reward=50):
+    # what holds the main chain and its indexes when no chainstate is given.
+    chainstate_factory = MemoryChainstate
+
+    def __init__(
+        self, transactions_per_block=2, confirmations=2, base_difficulty=20, base_block_reward=50, mining_processes=1,
+        verification_workers=0, signature_cache_size=100000, chainstate=None, gossip_workers=4,
+        seen_cache_size=100000
+    ):
         self.transactions_per_block = transactions_per_block
         self.confirmations = confirmations
         self.base_difficulty = base_difficulty
         self.base_block_reward = base_block_reward
 
         self.transaction_pool = TransactionPool()
-
-        self.blocks = []
+        self.mining_engine = MiningEngine(processes=mining_processes)
+        self.signature_verifier = SignatureVerifier(workers=verification_workers)
+        # {(transaction_id, input index): (public_key, signature)} of the inputs that have passed the address and the
+        #   signature checks already. the transaction id commits to the input's outpoint, and so to the output's
+        #   address.
+        self.signature_cache = LRUCache(maxsize=signature_cache_size)
+
+        # the main chain, its UTXO set and its indexes: a MemoryChainstate or an SQLiteChainstate.
+        self.chainstate = chainstate if chainstate is not None else self.chainstate_factory()
         self.fork = []
         self.orphans = []
 
         self.peers = set()
+        # how blocks and transactions are fetched from peers, "json" or "binary". every node can reply in both.
+        self.wire_format = "json"
+        # seconds to connect to a peer, and then to wait for each part of its response, when fetching from it. a peer
+        #   that takes longer is given up on, for the next one.
+        self.fetch_timeout = 10
+        self.gossip_dispatcher = GossipDispatcher(workers=gossip_workers)
+        # {block or transaction hash: True} of the ones that have been announced to our peers already, so that they're
+        #   neither fetched nor received, verified and announced again when peers announce or send them back to us.
+        self.seen_cache = LRUCache(maxsize=seen_cache_size)
+        # {transaction_id: hash of our tip when it was rejected} of the announced transactions that were fetched and
+        #   rejected, so that they're not fetched and verified again every time they're announced. a new tip may make
+        #   them valid, so they're only skipped until it changes.
+        self.rejected_cache = LRUCache(maxsize=seen_cache_size)
+        # {peer: the IP addresses its host name resolves to}
+        self._peer_addresses = {}
+        # blocks fetched as compact blocks: rebuilt, how many of their transactions had to be requested, and failed
+        #   to rebuild, which are then fetched in full.
+        self.compact_block_stats = {"rebuilt": 0, "requested_transactions": 0, "failed": 0}
 
     def serialize(self):
         # TODO: what about the transaction pool? should we dump the transactions?
+        self._check_history()
         return {
             "blocks": [block.serialize() for block in self.blocks],
             "fork": [block.serialize() for block in self.fork],
@@ -187,14 +2052,173 @@ class Blockchain:
         }
 
     @classmethod
-    def unserialize(cls, serialized_blockchain):
-        blockchain = cls()
-        blockchain.blocks = [Block.unserialize(sb) for sb in serialized_blockchain["blocks"]]
+    def unserialize(cls, serialized_blockchain, chainstate=None):
+        # chainstate: emptied and filled with the blockchain's blocks, optional.
+        blockchain = cls(chainstate=chainstate)
+        blockchain.chainstate.reset()
+        for serialized_block in serialized_blockchain["blocks"]:
+            blockchain._connect_block(Block.unserialize(serialized_block))
         blockchain.fork = [Block.unserialize(sb) for sb in serialized_blockchain["fork"]]
         blockchain.orphans = [Block.unserialize(sb) for sb in serialized_blockchain["orphans"]]
 
         return blockchain
 
+    def save(self, block_log):
+        # append the main chain's new blocks to `block_log`, after dropping the ones that have been disconnected since
+        #   the last save.
+        self._check_history()
+        height = min(len(block_log), len(self.blocks))
+        while height > 0 and block_log.get_hash(height - 1) != self.chainstate.get_block_hashes(height - 1, height)[0]:
+            height -= 1
+
+        block_log.truncate(height)
+        for block in self.blocks[height:]:
+            block_log.append(block)
+
+        block_log.write_branches(self.fork, self.orphans)
+        block_log.flush()
+
+    @classmethod
+    def load(cls, block_log, chainstate=None):
+        # blocks are read and connected one by one, never all of them at once, and they are read from `block_log` again
+        #   later on rather than kept in memory. chainstate: same as in `unserialize`.
+        blockchain = cls(chainstate=chainstate)
+        blockchain.chainstate.reset()
+        blockchain.chainstate.read_blocks_from(block_log)
+        for block in block_log:
+            blockchain._connect_block(block)
+        blockchain.fork, blockchain.orphans = block_log.read_branches()
+
+        return blockchain
+
+    def write_snapshot(self, filename, recent_blocks=16):
+        # the UTXO set as of the tip, and the most recent blocks along with the outputs they spent, so that they can
+        #   still be disconnected. returns the snapshot's hash, for whoever loads it to check it against.
+        if self.height < 0:
+            raise BlockchainError("Can't snapshot an empty blockchain")
+
+        start = self.height
+        while start > 0 and self.height - start + 1 < recent_blocks and self.chainstate.get_undo(start - 1) is not None:
+            start -= 1
+
+        buffer = bytearray()
+        _write_header(buffer, _BINARY_SNAPSHOT)
+        _write_varint(buffer, self.height)
+        _write_varint(buffer, self.height - start + 1)
+        for height in range(start, self.height + 1):
+            _write_bytes(buffer, encode_block_record(self.blocks[height]))
+            spent = self.chainstate.get_undo(height)
+            _write_varint(buffer, len(spent))
+            for outpoint, output in spent:
+                self._write_unspent_output(buffer, outpoint, output)
+
+        unspent_outputs = self.chainstate.unspent_outputs()
+        _write_varint(buffer, len(unspent_outputs))
+        for outpoint, output in unspent_outputs:
+            self._write_unspent_output(buffer, outpoint, output)
+
+        snapshot_hash = hashlib.sha256(buffer).digest()
+        with open(filename + ".tmp", "wb") as f:
+            f.write(buffer)
+            f.write(snapshot_hash)
+        os.replace(filename + ".tmp", filename)
+
+        return snapshot_hash.hex()
+
+    @classmethod
+    def load_snapshot(cls, filename, snapshot_hash=None, chainstate=None):
+        # the blocks below the snapshot's are missing until `backfill` has run. snapshot_hash: checked if given.
+        #   chainstate: same as in `unserialize`.
+        with open(filename, "rb") as f:
+            data = memoryview(f.read())
+
+        actual_hash = hashlib.sha256(data[:-32]).digest()
+        if actual_hash != data[-32:]:
+            raise InvalidEncodingError("Snapshot: %s is corrupted" % filename)
+        if snapshot_hash is not None and actual_hash.hex() != snapshot_hash:
+            raise InvalidEncodingError("Snapshot hash: %s does not match: %s" % (actual_hash.hex(), snapshot_hash))
+
+        reader = _BinaryReader(data[:-32])
+        reader.read_header(_BINARY_SNAPSHOT)
+        height = reader.read_varint()
+        recent_blocks = []
+        for _ in range(reader.read_varint()):
+            block = decode_block_record(reader.read_bytes())
+            if recent_blocks and block.prev != recent_blocks[-1][0].calculate_hash():
+                raise InvalidBlockError("Snapshot block: %s does not follow the previous one" % block.calculate_hash())
+            recent_blocks.append((block, [cls._read_unspent_output(reader) for _ in range(reader.read_varint())]))
+
+        blockchain = cls(chainstate=chainstate)
+        blockchain.chainstate.reset()
+        with blockchain.chainstate.batch():
+            blockchain.chainstate.start_at(height - len(recent_blocks) + 1)
+            for block, spent in recent_blocks:
+                for position, transaction in enumerate(block.transactions):
+                    blockchain.chainstate.index_transaction(transaction.calculate_hash(), blockchain.height + 1, position)
+                blockchain.chainstate.append_block(block, spent)
+
+            for _ in range(reader.read_varint()):
+                blockchain.chainstate.add_unspent_output(*cls._read_unspent_output(reader))
+            reader.done()
+
+        return blockchain
+
+    @staticmethod
+    def _write_unspent_output(buffer, outpoint, output):
+        _write_hash(buffer, outpoint[0])
+        _write_varint(buffer, outpoint[1])
+        _write_hash(buffer, output['address'])
+        _write_amount(buffer, output['amount'])
+
+    @staticmethod
+    def _read_unspent_output(reader):
+        outpoint = (reader.read_hash(), reader.read_varint())
+        return outpoint, FrozenDict(address=reader.read_hash(), amount=reader.read_amount())
+
+    def backfill(self):
+        # fetch the blocks below the snapshot the chain was started from, newest first, from our peers. returns whether
+        #   the whole history is there now.
+        while self.chainstate.history_start > 0:
+            height = self.chainstate.history_start - 1
+            block_hash = self.blocks[height + 1].prev
+            block = self._fetch_block(block_hash)
+            if block is None:
+                logger.warning("No peer has block: %s, backfill stopped at height: %s", block_hash, height + 1)
+                return False
+
+            if block.calculate_hash() != block_hash:
+                raise InvalidBlockError("Backfilled block: %s is not: %s" % (block.calculate_hash(), block_hash))
+
+            with self.chainstate.batch():
+                self.chainstate.backfill_block(height, block)
+                for position, transaction in enumerate(block.transactions):
+                    self.chainstate.index_transaction(transaction.calculate_hash(), height, position)
+
+        logger.info("Backfill complete, height: %s", self.height)
+        return True
+
+    def _check_history(self):
+        if self.chainstate.history_start > 0:
+            raise HistoryIsUnavailableError(
+                "Blocks below height: %s haven't been backfilled yet" % self.chainstate.history_start
+            )
+
+    @property
+    def blocks(self):
+        return self.chainstate.blocks
+
+    @property
+    def utxos(self):
+        return self.chainstate.utxos
+
+    @property
+    def _block_index(self):
+        return self.chainstate.block_index
+
+    @property
+    def _transaction_index(self):
+        return self.chainstate.transaction_index
+
     @property
     def tip(self):
         return self.blocks[-1]
@@ -213,31 +2237,19 @@ class Blockchain:
         return int(self.base_block_reward/(int(self.height / 5)+1))
 
     def calculate_balance(self, address):
-        outputs = {}  # {(transaction_id, vout): amount}
+        return sum(self.chainstate.get_address_outputs(address).values())
 
-        for block_number, block in enumerate(self.blocks):
-            for transaction in block.transactions:
-                transaction_id = transaction.calculate_hash()
-
-                # prune spent
-                for input in transaction.inputs:
-                    amount = outputs.pop((input['transaction_id'], input['vout']), None)
-                    if amount:
-                        logger.info(
-                            "%s:%s (%s units) spent on transaction_id: %s, block_number: %s",
-                            input['transaction_id'], input['vout'], amount, transaction_id, block_number
-                        )
+    def calculate_balances(self, addresses):
+        return {address: self.calculate_balance(address) for address in addresses}
 
-                # collect unspent
-                for vout, output in enumerate(transaction.outputs):
-                    if output['address'] == address:
-                        outputs[(transaction_id, vout)] = output['amount']
-                        logger.info(
-                            "%s units received on transaction_id: %s, vout: %s, block_number: %s",
-                            output['amount'], transaction_id, vout, block_number
-                        )
+    def get_unspent_output(self, transaction_id, vout):
+        return self.utxos.get((transaction_id, vout))
 
-        return sum(outputs.values())
+    def get_unspent_outputs(self, address):
+        return [
+            {"transaction_id": transaction_id, "vout": vout, "amount": amount}
+            for (transaction_id, vout), amount in self.chainstate.get_address_outputs(address).items()
+        ]
 
     def add_transaction_to_pool(self, transaction):
         transaction_id = transaction.calculate_hash()
@@ -251,6 +2263,94 @@ class Blockchain:
             # if it's in the pool, it means that it was published, too.
             logger.info("transaction_id: %s is already in the transaction pool", transaction_id)
 
+    def add_transactions_to_pool(self, transactions):
+        # same as `add_transaction_to_pool`, but signatures are verified in a single batch, and the accepted transactions
+        #   are announced together. returns, for each transaction, its fee if it's in the pool, or the exception that
+        #   kept it out.
+        results = [None] * len(transactions)
+        pending = []  # [(index, fee, signature_checks)]
+        first_indexes = {}  # {transaction_id: index of its first occurrence in the batch}
+        duplicates = []  # [(index, index of the first occurrence)]
+        transaction_ids = {transaction.calculate_hash() for transaction in transactions}
+
+        for index, transaction in enumerate(transactions):
+            if transaction.calculate_hash() in first_indexes:
+                duplicates.append((index, first_indexes[transaction.calculate_hash()]))
+                continue
+            first_indexes[transaction.calculate_hash()] = index
+
+            try:
+                results[index] = self.transaction_pool.get_transaction(transaction.calculate_hash())['fee']
+                continue
+            except TransactionIsNotInPoolError:
+                pass
+
+            try:
+                fee, signature_checks = self._check_transaction(transaction)
+            except InputIsUnavailableError as e:
+                batch_inputs = [input for input in transaction.inputs if input['transaction_id'] in transaction_ids]
+                if batch_inputs:
+                    # no zero-conf inputs, from the pool or from the same batch.
+                    e = InputIsUnavailableError(
+                        "Can't verify transaction because input: %s spends a transaction of the same batch, which "
+                        "isn't confirmed yet" % batch_inputs[0]
+                    )
+                results[index] = e
+            except Exception as e:
+                results[index] = e
+            else:
+                pending.append((index, fee, signature_checks))
+
+        # one pass over the batch, which tells the bad signatures apart, too.
+        bad_signatures = self.signature_verifier.verify_each([signature_checks for _, _, signature_checks in pending])
+        verified = []
+        for (index, fee, signature_checks), bad_signature in zip(pending, bad_signatures):
+            if bad_signature is not None:
+                results[index] = bad_signature
+            else:
+                verified.append((index, fee, signature_checks))
+
+        pending = verified
+
+        # of the transactions of the batch that spend the same outputs, only the highest fee one goes on to the pool,
+        #   where it may still replace, or lose to, the ones that are there already.
+        spent = {}  # {outpoint: transaction_id}
+        not_conflicting = []
+        for index, fee, signature_checks in sorted(pending, key=lambda p: (-p[1], p[0])):
+            transaction = transactions[index]
+            outpoints = [(input['transaction_id'], input['vout']) for input in transaction.inputs]
+            conflicts = [spent[outpoint] for outpoint in outpoints if outpoint in spent]
+            if conflicts:
+                results[index] = TransactionConflictError(
+                    "transaction_id: %s conflicts with transaction_id: %s of the same batch, which pays a higher fee" % (
+                        transaction.calculate_hash(), conflicts[0]
+                    )
+                )
+                continue
+
+            spent.update((outpoint, transaction.calculate_hash()) for outpoint in outpoints)
+            not_conflicting.append((index, fee, signature_checks))
+
+        accepted = []
+        for index, fee, _ in sorted(not_conflicting):
+            transaction = transactions[index]
+            self._cache_signature(transaction)
+            try:
+                self.transaction_pool.add_transaction(transaction=transaction, fee=fee)
+            except TransactionPoolError as e:
+                results[index] = e
+            else:
+                results[index] = fee
+                accepted.append(transaction)
+
+        if accepted:
+            self.publish_transactions(accepted)
+
+        for index, first_index in duplicates:
+            results[index] = results[first_index]
+
+        return results
+
     def _remove_transactions_from_pool(self, block):
         for transaction in block.transactions:
             if not transaction.is_coinbase:
@@ -261,40 +2361,60 @@ class Blockchain:
                         "transaction_id: %s not in transaction pool", transaction.calculate_hash()
                     )
 
+                    # pooled transactions spending the same outputs can't be mined anymore
+                    for conflict in self.transaction_pool.delete_conflicts(transaction):
+                        logger.warning(
+                            "transaction_id: %s conflicts with transaction_id: %s, removed from the transaction pool",
+                            conflict['transaction'].calculate_hash(), transaction.calculate_hash()
+                        )
+
     def get_next_block(self, previous_hash):
-        for block_number, block in enumerate(self.blocks):
-            if block.calculate_hash() == previous_hash:
-                if len(self.blocks) == block_number + 1:  # this is the last block!
-                    return None
-                else:
-                    return self.blocks[block_number + 1]
+        block_height = self.get_block_height(previous_hash)
+        if block_height is None:
+            raise BlockIsNotInMainChainError("There is no block with hash: %s in our main chain" % previous_hash)
+
+        if block_height == self.height:  # this is the last block!
+            return None
+
+        return self.blocks[block_height + 1]
+
+    def get_blocks_after(self, previous_hash, limit):
+        # up to `limit` blocks of the main chain following `previous_hash`, or from the Genesis block if it's None.
+        return [self.blocks[height] for height in self._heights_after(previous_hash, limit)]
+
+    def get_block_hashes_after(self, previous_hash, limit):
+        # same as `get_blocks_after`, only their hashes, which are read from the chainstate without the blocks.
+        heights = self._heights_after(previous_hash, limit)
+        return self.chainstate.get_block_hashes(heights.start, heights.stop)
+
+    def _heights_after(self, previous_hash, limit):
+        if previous_hash is None:
+            start = 0
+        else:
+            block_height = self.get_block_height(previous_hash)
+            if block_height is None:
+                raise BlockIsNotInMainChainError("There is no block with hash: %s in our main chain" % previous_hash)
+            start = block_height + 1
+
+        if start < self.chainstate.history_start:
+            raise HistoryIsUnavailableError(
+                "Blocks below height: %s haven't been backfilled yet" % self.chainstate.history_start
+            )
 
-        raise BlockIsNotInMainChainError("There is no block with hash: %s in our main chain" % previous_hash)
+        return range(start, min(start + limit, self.height + 1))
 
     def get_block_height(self, hash):
-        for block_height, block in enumerate(self.blocks):
-            if block.calculate_hash() == hash:
-                return block_height
+        return self._block_index.get(hash)
 
     def get_block(self, hash):
-        for block in self.blocks:
-            if block.calculate_hash() == hash:
-                return block
-
-    # def get_block(self, hash, limit=None):
-    #     for i in range(limit or self.height + 1):
-    #         if self.height < i:
-    #             # can't go before the Genesis block
-    #             return None, None
-    #
-    #         block_height = self.height - i
-    #         block = self.blocks[block_height]
-    #         if block.calculate_hash() == hash:
-    #             return block, block_height
-    #
-    #     return None, None
+        block_height = self.get_block_height(hash)
+        if block_height is not None:
+            return self.blocks[block_height]
 
-    def receive_block(self, block):
+    def receive_block(self, block, publish=True):
+        # publish: whether to send the block on to our peers once connected, which blocks downloaded from a peer while
+        #   synchronizing aren't.
+        #
         # This blockchain can handle currently only one fork from the main chain at any given time.
         # TODO: support a tree of forks.
         # The way this algorithm would work is:
@@ -324,7 +2444,7 @@ class Blockchain:
             logger.info("Block with hash: %s exists in our chain at height: %s", block_hash, block_height)
             return
 
-        if self._receive_block(block):
+        if self._receive_block(block, publish=publish):
             # process orphans
             while True:
                 success = False
@@ -333,7 +2453,7 @@ class Blockchain:
                 for orphan_block in orphan_blocks:
                     orphan_block_hash = orphan_block.calculate_hash()
                     logger.info("Attempt to link orphan block with hash: %s", orphan_block_hash)
-                    if self._receive_block(orphan_block):
+                    if self._receive_block(orphan_block, publish=publish):
                         logger.info("Successfully linked orphan block with hash: %s", orphan_block_hash)
                         success = True
 
@@ -342,23 +2462,25 @@ class Blockchain:
 
         self._reconverge()
 
-    def _receive_block(self, block):
+    def _receive_block(self, block, publish=True):
         # return True if we have been able to connect the block, either to the main chain or to the secondary chain
 
         if self.height < 0:
             if not block.is_genesis:
                 raise Exception("First block in the chain must be a Genesis block")
 
-            self.blocks.append(block)
+            self._connect_block(block)
             logger.info("Genesis block has been added")
-            self.publish_block(block)
+            if publish:
+                self.publish_block(block)
             return True
 
         elif block.prev == self.tip.calculate_hash():
-            self.blocks.append(block)
+            self._connect_block(block)
             logger.info("New block has been added, new height: %s", self.height)
             self._remove_transactions_from_pool(block)
-            self.publish_block(block)
+            if publish:
+                self.publish_block(block)
             return True
 
         else:
@@ -408,23 +2530,31 @@ class Blockchain:
                     self.confirmations, fork_block_height
                 )
 
+                if any(self.chainstate.get_undo(h) is None for h in range(fork_block_height + 1, self.height + 1)):
+                    # the chain was started from a snapshot, and doesn't know which outputs those blocks spent.
+                    logger.warning("Can't disconnect blocks down to height: %s, clearing fork", fork_block_height)
+                    self.fork.clear()
+                    return
+
                 # return transactions in the dead branch to the transaction pool
-                blocks_to_remove = self.blocks[fork_block_height+1:]
+                blocks_to_remove = [self._disconnect_block() for _ in range(self.height - fork_block_height)]
+                blocks_to_remove.reverse()
 
                 # reconverge
-                self.blocks[fork_block_height+1:] = self.fork[:]
-
-                for block in blocks_to_remove:
-                    for transaction in block.transactions:
-                        if not transaction.is_coinbase:
-                            try:
-                                self.add_transaction_to_pool(transaction)
-                            except InputIsUnavailableError as e:
-                                # one or more inputs may have been spent
-                                logger.warning(
-                                    "Can't return transaction_id: %s to transaction pool: %s",
-                                    transaction.calculate_hash(), str(e)
-                                )
+                for block in self.fork:
+                    self._connect_block(block)
+
+                transactions = [
+                    transaction for block in blocks_to_remove for transaction in block.transactions
+                    if not transaction.is_coinbase
+                ]
+                for transaction, result in zip(transactions, self.add_transactions_to_pool(transactions)):
+                    if isinstance(result, Exception):
+                        # one or more inputs may have been spent, or the transaction pool may be full
+                        logger.warning(
+                            "Can't return transaction_id: %s to transaction pool: %s",
+                            transaction.calculate_hash(), str(result)
+                        )
 
                 # remove transactions in the new branch from the transaction pool
                 for block in self.fork:
@@ -432,49 +2562,87 @@ class Blockchain:
 
                 self.fork.clear()
 
-    def get_transaction(self, transaction_id, block_height=None):
-        # linear lookup of transaction `transaction_id`,  from `block_height`, backwards. Assume chain tip if no
-        # `block_height` is passed.
-        if block_height is None:
-            block_height = self.height
+    def get_transaction(self, transaction_id, include_transaction_pool=False):
+        # look transaction `transaction_id` up in the main chain and, optionally, in the transaction pool.
+        try:
+            block_height, position = self._transaction_index[transaction_id]
+        except KeyError:
+            pass
+        else:
+            logger.info("transaction_id: %s found in block_height: %s", transaction_id, block_height)
+            return self.blocks[block_height].transactions[position]
+
+        if include_transaction_pool:
+            try:
+                return self.transaction_pool.get_transaction(transaction_id)['transaction']
+            except TransactionIsNotInPoolError:
+                pass
 
-        if block_height < 0:
+        return None
+
+    def get_transaction_proof(self, transaction_id):
+        # proof of inclusion of transaction `transaction_id` in a main chain block. only version 2 blocks commit to a
+        #   merkle root in their header.
+        try:
+            block_height, _ = self._transaction_index[transaction_id]
+        except KeyError:
             return None
 
-        for transaction in self.blocks[block_height].transactions:
-            if transaction.calculate_hash() == transaction_id:
-                logger.info("transaction_id: %s found in block_height: %s", transaction_id, block_height)
-                return transaction
+        block = self.blocks[block_height]
+        if block.version < 2:
+            return None
 
-        return self.get_transaction(transaction_id, block_height=block_height - 1)
+        return {
+            "block_hash": block.calculate_hash(),
+            "block_height": block_height,
+            "merkle_root": block.merkle_root,
+            "proof": block.merkle_proof(transaction_id)
+        }
 
-    def _is_output_available(self, output, block_height=None):
-        # scan every transaction in every block to make sure that the output hasn't been spent in a previous
-        #   transaction. this operation is suboptimal, to be very kind to myself.
-        # this is how bitcoin nodes track the UTXO set:
-        #   https://en.bitcoin.it/wiki/Bitcoin_Core_0.11_(ch_2):_Data_Storage#The_UTXO_set_.28chainstate_leveldb.29
-        # no zero-conf inputs allowed
-        if block_height is None:
-            block_height = self.height
+    def _connect_block(self, block):
+        # append `block` to the main chain and apply its transactions to the UTXO set.
+        with self.chainstate.batch():
+            spent = []
+            block_height = self.height + 1
+            for position, transaction in enumerate(block.transactions):
+                transaction_id = transaction.calculate_hash()
+                self.chainstate.index_transaction(transaction_id, block_height, position)
 
-        if block_height == 0:
-            return True
+                for input in transaction.inputs:
+                    outpoint = (input['transaction_id'], input['vout'])
+                    output = self.chainstate.remove_unspent_output(outpoint)
+                    if output is None:
+                        # blocks aren't fully validated on reception yet, so this is not fatal.
+                        logger.warning("transaction_id: %s spends unknown output %s:%s", transaction_id, *outpoint)
+                    else:
+                        spent.append((outpoint, output))
 
-        for transaction in self.blocks[block_height].transactions:
-            for input in transaction.inputs:
-                if input['transaction_id'] == output['transaction_id'] and input['vout'] == output['vout']:
-                    logger.warning(
-                        "Output was spent in transaction_id: %s, vout: %s",
-                        input['transaction_id'], input['vout']
-                    )
-                    return False
+                for vout, output in enumerate(transaction.outputs):
+                    self.chainstate.add_unspent_output((transaction_id, vout), output)
+
+            self.chainstate.append_block(block, spent)
+
+    def _disconnect_block(self):
+        # remove the tip of the main chain and revert its transactions from the UTXO set.
+        if self.height == self.chainstate.history_start > 0 or self.chainstate.get_undo(self.height) is None:
+            raise HistoryIsUnavailableError("Block at height: %s can't be disconnected" % self.height)
+
+        with self.chainstate.batch():
+            block, spent = self.chainstate.pop_block()
+
+            for transaction in reversed(block.transactions):
+                transaction_id = transaction.calculate_hash()
+                self.chainstate.unindex_transaction(transaction_id)
+                for vout in range(len(transaction.outputs)):
+                    self.chainstate.remove_unspent_output((transaction_id, vout))
 
-        return self._is_output_available(output, block_height - 1)
+            for outpoint, output in spent:
+                self.chainstate.add_unspent_output(outpoint, output)
 
-    def _can_redeem(self, transaction, source_transaction, vout):
-        output = source_transaction.outputs[vout]
-        public_key_bytes = base64.b64decode(transaction.public_key)
-        public_key_hash = hashlib.sha256(public_key_bytes).hexdigest()
+        return block
+
+    def _check_address(self, transaction, output):
+        public_key_hash = get_public_key(base64.b64decode(transaction.public_key))["address"]
 
         # in a cheap attempt to resemble "OP_EQUALVERIFY"
         if output['address'] != public_key_hash:
@@ -482,33 +2650,24 @@ class Blockchain:
                 "Public Key hash: %s does not match output's address: %s" % (public_key_hash, output['address'])
             )
 
-        # same, but with "OP_CHECKSIG"
-        public_key = ecdsa.VerifyingKey.from_string(public_key_bytes, curve=ecdsa.SECP256k1)
-
-        # TODO: wrap this exception in an exception of our own.
-        public_key.verify(
-            signature=base64.b64decode(transaction.signature),
-            data=json.dumps(transaction.hashable_contents, sort_keys=True).encode('utf-8'),
-            hashfunc=hashlib.sha256
-        )
-
-    def _verify_transaction(self, transaction):
+    def _check_transaction(self, transaction):
+        # everything but the signature. returns the fee and the signature checks that are left to be verified.
         utxos = []
+        transaction_id = transaction.calculate_hash()
+        cached = True
 
-        # check that the inputs haven't been spent.
-        for input in transaction.inputs:
-            if not self._is_output_available(input):
+        # check that the inputs haven't been spent. no zero-conf inputs allowed, only outputs in the main chain's UTXO
+        #   set can be spent.
+        for index, input in enumerate(transaction.inputs):
+            output = self.get_unspent_output(input['transaction_id'], input['vout'])
+            if output is None:
                 raise InputIsUnavailableError("Can't verify transaction because input: %s is unavailable" % input)
 
             # prove that the transaction signer is entitled to redeeming that output.
-            source_transaction = self.get_transaction(input['transaction_id'])
-            if not source_transaction:  # TODO: write testcase
-                raise Exception("transaction_id: %s could not be found" % input['transaction_id'])
-
-            self._can_redeem(transaction, source_transaction, vout=input['vout'])
+            if self.signature_cache.get((transaction_id, index)) != (transaction.public_key, transaction.signature):
+                self._check_address(transaction, output)
+                cached = False
 
-            vout = input['vout']
-            output = source_transaction.outputs[vout]
             utxos.append(output)
 
         # calculate fee
@@ -518,28 +2677,49 @@ class Blockchain:
             if fee < 0:
                 raise Exception("Output amount is higher than input amount")
 
-            logger.info("transaction_id: %s pays %s units in miner fees", transaction.calculate_hash(), fee)
-            return fee
+            logger.info("transaction_id: %s pays %s units in miner fees", transaction_id, fee)
+
+            if cached:
+                return fee, []
+
+            # same, but with "OP_CHECKSIG". every input is signed by the same key with the same signature, so it's
+            #   verified once per transaction.
+            signature_check = (
+                base64.b64decode(transaction.public_key),
+                base64.b64decode(transaction.signature),
+                transaction.preimage
+            )
+            return fee, [signature_check]
+
+        return 0, []
+
+    def _cache_signature(self, transaction):
+        # to be called once `transaction` has been verified.
+        transaction_id = transaction.calculate_hash()
+        for index in range(len(transaction.inputs)):
+            self.signature_cache.put((transaction_id, index), (transaction.public_key, transaction.signature))
+
+    def _verify_transaction(self, transaction):
+        fee, signature_checks = self._check_transaction(transaction)
 
-        return 0
+        # TODO: wrap this exception in an exception of our own.
+        self.signature_verifier.verify(signature_checks)
+        self._cache_signature(transaction)
+        return fee
 
-    def mine(self, miner_address):
+    def mine(self, miner_address, abort=None):
+        # `abort` is an optional callable, the attempt is given up as soon as it returns True.
         miner_fees = 0
 
         # handle Genesis block case
-        transaction_entries = self.transaction_pool.get_transactions(count=2)
+        transaction_entries = self._select_transactions()
         if len(transaction_entries) == 0 and self.height >= 0:
             # not an error per se, as the transaction pool can be empty.
             return None
 
-        # create an empty block, point at the previous block (except in Genesis block case)
-        block = Block(
-            prev=self.tip.calculate_hash() if self.height >= 0 else "0" * 64,
-            timestamp=time.time_ns()
-        )
-
+        transactions = []
         for transaction_entry in transaction_entries:
-            block.transactions.append(transaction_entry['transaction'])
+            transactions.append(transaction_entry['transaction'])
             miner_fees += transaction_entry['fee']
 
         # create the transaction to pay the block reward + mining fees
@@ -549,78 +2729,437 @@ class Blockchain:
         )
 
         # coinbase transaction has no signature.
-        block.transactions.append(coinbase_transaction)
+        transactions.append(coinbase_transaction)
+
+        # create the block, point at the previous block (except in Genesis block case)
+        block = Block(
+            prev=self.tip.calculate_hash() if self.height >= 0 else "0" * 64,
+            timestamp=time.time_ns(),
+            transactions=transactions
+        )
 
         # mine the block.
         mask = int('f'*64, base=16) >> self.difficulty
 
-        hash = block.calculate_hash()
+        def should_abort():
+            if abort is not None and abort():
+                logger.info("Mining has been interrupted, so we'll abort this attempt.")
+                return True
 
-        logger.info("Attempt to mine a new block with %s transactions", len(transaction_entries))
-        while not int(hash, base=16) <= mask:
-            if self.blocks and self.tip.prev == block.prev:
+            if self.blocks and self.tip.calculate_hash() != block.prev:
                 logger.info("Someone else has already mined the next block, so we'll abort this attempt.")
-                return
+                return True
+
+            return False
 
-            block.nonce += 1
-            hash = block.calculate_hash()
+        logger.info("Attempt to mine a new block with %s transactions", len(transaction_entries))
+        nonce = self.mining_engine.search(block, mask, should_abort)
+        if nonce is None:
+            return None
 
-        logger.info("A new block with hash: %s has been mined, tentative new height: %s", hash, self.height + 1)
+        block.nonce = nonce
+        logger.info(
+            "A new block with hash: %s has been mined, tentative new height: %s", block.calculate_hash(), self.height + 1
+        )
         self.receive_block(block)
 
         return block
 
+    def _select_transactions(self):
+        # pooled transactions were verified when they were added, but a block received since then may have spent some
+        #   of their inputs, or two of them may spend the same output. check them against the UTXO set once more.
+        transaction_entries = []
+        spent = set()
+        for transaction_entry in self.transaction_pool.get_transactions(count=self.transactions_per_block):
+            outpoints = {(input['transaction_id'], input['vout']) for input in transaction_entry['transaction'].inputs}
+            if any(outpoint not in self.utxos for outpoint in outpoints):
+                logger.warning(
+                    "transaction_id: %s spends unavailable outputs, removing it from the transaction pool",
+                    transaction_entry['transaction_id']
+                )
+                self.transaction_pool.delete_transaction(transaction_id=transaction_entry['transaction_id'])
+                continue
+
+            if spent & outpoints:
+                # double spend within the pool, the one with the higher fee goes first.
+                continue
+
+            spent |= outpoints
+            transaction_entries.append(transaction_entry)
+
+        return transaction_entries
+
     def publish_block(self, block):
-        successful = 0
-        for peer in self.peers:
-            # this call is blocking, we eventually want to make it so that it's non-blocking.
-            logger.info("Attempt to send block to peer: %s", peer)
+        block_hash = block.calculate_hash()
+        self.seen_cache.put(block_hash, True)
+        queued = self.gossip_dispatcher.announce(self.peers, {"blocks": [block_hash]})
+        logger.info("Block announced to %s peer(s)", queued)
+
+    def publish_transaction(self, transaction):
+        self.publish_transactions([transaction])
+
+    def publish_transactions(self, transactions):
+        # announced together, in a single message per peer.
+        transaction_ids = [transaction.calculate_hash() for transaction in transactions]
+        for transaction_id in transaction_ids:
+            self.seen_cache.put(transaction_id, True)
+        queued = self.gossip_dispatcher.announce(self.peers, {"transactions": transaction_ids})
+        logger.info("%s transaction(s) announced to %s peer(s)", len(transaction_ids), queued)
+
+    def has_seen(self, block_or_transaction_hash):
+        return self.seen_cache.get(block_or_transaction_hash) is not None
+
+    def has_rejected(self, transaction_id):
+        return self.height >= 0 and self.rejected_cache.get(transaction_id) == self.tip.calculate_hash()
+
+    def find_peer(self, address):
+        # the one of our peers at IP `address`: they're known by host name, while announcements come from an address.
+        #   the address itself if it's none of them, it can be fetched from just as well. host names are resolved once,
+        #   and again when no peer matches, in case their addresses have changed.
+        if address in self.peers:
+            return address
+
+        for refresh in (False, True):
+            for peer in self.peers:
+                if refresh or peer not in self._peer_addresses:
+                    self._peer_addresses[peer] = resolve_host(peer)
+                if address in self._peer_addresses[peer]:
+                    return peer
+
+        # an IPv6 address is bracketed, to be the host of a URL as it is.
+        return "[%s]" % address if ":" in address else address
+
+    def receive_inventory(self, inventory, peer=None):
+        # fetch the blocks and transactions announced by `peer` that we haven't seen, from it first and then from the
+        #   others, and receive them. returns the hashes of the ones that were fetched.
+        peers = [peer] + [p for p in self.peers if p != peer] if peer else list(self.peers)
+        fetched = {"blocks": [], "transactions": []}
+
+        for block_hash in inventory.get("blocks", []):
+            if (
+                self.has_seen(block_hash) or self.get_block_height(block_hash) is not None
+                or any(b.calculate_hash() == block_hash for b in self.fork + self.orphans)
+            ):
+                continue
+
+            block = self._fetch_compact_block(block_hash, peers=peers) or self._fetch_block(block_hash, peers=peers)
+            if block is None or block.calculate_hash() != block_hash:
+                logger.warning("Announced block: %s could not be fetched", block_hash)
+                continue
+
+            fetched["blocks"].append(block_hash)
+            self.receive_block(block)
+
+        transaction_ids = [
+            transaction_id for transaction_id in dict.fromkeys(inventory.get("transactions", []))
+            if not (
+                self.has_seen(transaction_id) or self.has_rejected(transaction_id)
+                or transaction_id in self._transaction_index or transaction_id in self.transaction_pool
+            )
+        ]
+        # all of them at once, rather than a round trip each
+        fetched_transactions = self._fetch_transactions(transaction_ids, peers=peers) if transaction_ids else {}
+        transactions = []
+        for transaction_id in transaction_ids:
+            if transaction_id not in fetched_transactions:
+                logger.warning("Announced transaction: %s could not be fetched", transaction_id)
+                continue
+
+            fetched["transactions"].append(transaction_id)
+            transactions.append(fetched_transactions[transaction_id])
+
+        # verified as a batch, and announced in turn as one
+        for transaction, result in zip(transactions, self.add_transactions_to_pool(transactions)):
+            if isinstance(result, Exception):
+                logger.warning("Announced transaction: %s was rejected, %s", transaction.calculate_hash(), result)
+                if self.height >= 0:
+                    self.rejected_cache.put(transaction.calculate_hash(), self.tip.calculate_hash())
+
+        return fetched
+
+    def _fetch_block(self, block_hash, peers=None):
+        # from the first peer that has it.
+        for peer in self.peers if peers is None else peers:
             try:
-                requests.post("http://%s:5000/blocks" % peer, json=block.serialize())
-                successful += 1
-            except requests.exceptions.ConnectionError:
-                pass
+                response = requests.get(
+                    "http://%s:5000/blocks/%s" % (peer, block_hash), headers=self._accept_header(),
+                    timeout=self.fetch_timeout
+                )
+                if response.status_code == 200:
+                    return self._read_block_response(response)
+            except requests.exceptions.RequestException as e:
+                logger.warning("Block: %s could not be retrieved from peer: %s, %s", block_hash, peer, e)
+            except (BlockchainError, AttributeError, KeyError, TypeError, ValueError) as e:
+                logger.warning("Block: %s from peer: %s is malformed, %r", block_hash, peer, e)
+
+        return None
+
+    @staticmethod
+    def _read_block_response(response):
+        if response.headers.get("Content-Type") == BINARY_CONTENT_TYPE:
+            return Block.decode(response.content)
+
+        return Block.unserialize(response.json())
+
+    def get_compact_block(self, block_hash):
+        # prefilled: the coinbase, that no peer can have, and the transactions that we haven't announced, that our peers
+        #   are unlikely to have either.
+        block = self.get_block(block_hash)
+        if block is None:
+            return None
 
-        logger.info("Block sent to %s peer(s)", successful)
+        return block.compact(prefilled_indexes={
+            index for index, transaction in enumerate(block.transactions)
+            if transaction.is_coinbase or not self.has_seen(transaction.calculate_hash())
+        })
 
-    def publish_transaction(self, transaction):
-        successful = 0
-        for peer in self.peers:
-            # this call is blocking, we eventually want to make it so that it's non-blocking.
-            logger.info("Attempt to send transaction to peer: %s", peer)
+    def get_block_transactions(self, block_hash, indexes):
+        # the transactions at `indexes` in main chain block `block_hash`, for peers that couldn't rebuild it whole.
+        block = self.get_block(block_hash)
+        if block is None:
+            return None
+
+        if any(index < 0 for index in indexes):
+            raise IndexError("Transaction indexes can't be negative")
+
+        return [block.transactions[index] for index in indexes]
+
+    def _rebuild_transactions(self, compact_block):
+        # the compact block's transactions, from its prefilled ones and from our transaction pool, None where neither
+        #   has them.
+        transactions = [None] * (len(compact_block['short_ids']) + len(compact_block['prefilled_transactions']))
+        for prefilled_transaction in compact_block['prefilled_transactions']:
+            transactions[prefilled_transaction['index']] = Transaction.unserialize(prefilled_transaction['transaction'])
+
+        pooled_transactions = {
+            calculate_short_transaction_id(compact_block['hash'], transaction.calculate_hash()): transaction
+            for transaction in self.transaction_pool
+        }
+        short_ids = iter(compact_block['short_ids'])
+        for index, transaction in enumerate(transactions):
+            if transaction is None:
+                transactions[index] = pooled_transactions.get(next(short_ids))
+
+        return transactions
+
+    def _fetch_compact_block(self, block_hash, peers=None):
+        # from the first peer that has it, rebuilt from our transaction pool and the transactions missing from it.
+        for peer in self.peers if peers is None else peers:
             try:
-                requests.post("http://%s:5000/transactions" % peer, json=transaction.serialize())
-                successful += 1
-            except requests.exceptions.ConnectionError:
-                pass
+                response = requests.get(
+                    "http://%s:5000/blocks/%s/compact" % (peer, block_hash), timeout=self.fetch_timeout
+                )
+                if response.status_code != 200:
+                    continue
+
+                compact_block = response.json()
+                transactions = self._rebuild_transactions(compact_block)
+                missing_indexes = [index for index, transaction in enumerate(transactions) if transaction is None]
+                if missing_indexes:
+                    response = requests.get(
+                        "http://%s:5000/blocks/%s/transactions" % (peer, block_hash),
+                        params={"indexes": ",".join(str(index) for index in missing_indexes)},
+                        timeout=self.fetch_timeout
+                    )
+                    if response.status_code != 200 or len(response.json()) != len(missing_indexes):
+                        continue
+                    for index, serialized_transaction in zip(missing_indexes, response.json()):
+                        transactions[index] = Transaction.unserialize(serialized_transaction)
+            except requests.exceptions.RequestException as e:
+                logger.warning("Compact block: %s could not be retrieved from peer: %s, %s", block_hash, peer, e)
+                continue
+            except (AttributeError, KeyError, IndexError, TypeError, ValueError, StopIteration) as e:
+                logger.warning("Compact block: %s from peer: %s is malformed, %r", block_hash, peer, e)
+                continue
+
+            block = Block(
+                prev=compact_block['prev'], nonce=compact_block['nonce'], timestamp=compact_block['timestamp'],
+                transactions=transactions, version=compact_block['version']
+            )
+            try:
+                if block.calculate_hash() != block_hash:
+                    raise InvalidBlockError("Block hash: %s is not: %s" % (block.calculate_hash(), block_hash))
+                if block.version >= 2:
+                    block.check_merkle_root(compact_block['merkle_root'])
+            except InvalidBlockError:
+                # short ids that collided with the wrong transactions of our pool
+                logger.warning("Compact block: %s could not be rebuilt", block_hash)
+                self.compact_block_stats["failed"] += 1
+                return None
+
+            logger.info(
+                "Compact block: %s rebuilt, %s of its %s transactions requested",
+                block_hash, len(missing_indexes), len(transactions)
+            )
+            self.compact_block_stats["rebuilt"] += 1
+            self.compact_block_stats["requested_transactions"] += len(missing_indexes)
+            return block
+
+        return None
+
+    def _fetch_transactions(self, transaction_ids, peers=None):
+        # {transaction_id: Transaction} of the ones that any peer has, in its transaction pool or in its main chain.
+        #   each peer in turn is asked for all of the ones that the previous ones didn't have, 10000 per request.
+        transactions = {}
+        for peer in self.peers if peers is None else peers:
+            missing_ids = [transaction_id for transaction_id in transaction_ids if transaction_id not in transactions]
+            if not missing_ids:
+                break
+
+            for i in range(0, len(missing_ids), 10000):
+                chunk = missing_ids[i:i + 10000]
+                try:
+                    response = requests.post(
+                        "http://%s:5000/transactions/lookup" % peer, params={"include-transaction-pool": ""},
+                        json={"transaction_ids": chunk}, timeout=self.fetch_timeout
+                    )
+                    if response.status_code != 200:
+                        break
+
+                    for transaction_id, serialized_transaction in zip(chunk, response.json()):
+                        if serialized_transaction is None:
+                            continue
+
+                        transaction = Transaction.unserialize(serialized_transaction)
+                        if transaction.calculate_hash() == transaction_id:
+                            transactions[transaction_id] = transaction
+                except requests.exceptions.RequestException as e:
+                    logger.warning("Transactions could not be retrieved from peer: %s, %s", peer, e)
+                    break
+                except (BlockchainError, AttributeError, KeyError, TypeError, ValueError) as e:
+                    logger.warning("Transactions from peer: %s are malformed, %r", peer, e)
+                    break
 
-        logger.info("Transaction sent to %s peer(s)", successful)
+        return transactions
 
-    def synchronize(self):
+    def _accept_header(self):
+        if self.wire_format == "binary":
+            return {"Accept": "%s, application/json;q=0.9" % BINARY_CONTENT_TYPE}
+
+        return {"Accept": "application/json"}
+
+    def _fetch_block_range(self, peer, previous_hash, limit):
+        # the blocks of the peer's main chain following `previous_hash`, none if it doesn't have it in its main chain.
+        if self.wire_format == "binary":
+            accept = "%s, %s;q=0.9" % (BINARY_STREAM_CONTENT_TYPE, NDJSON_CONTENT_TYPE)
+        else:
+            accept = NDJSON_CONTENT_TYPE
+        params = {"limit": limit}
+        if previous_hash is not None:
+            params["from-hash"] = previous_hash
+
+        with requests.get(
+            "http://%s:5000/blocks/range" % peer, params=params, headers={"Accept": accept}, stream=True,
+            timeout=self.fetch_timeout
+        ) as response:
+            if response.status_code != 200:
+                return []
+
+            binary = response.headers.get("Content-Type") == BINARY_STREAM_CONTENT_TYPE
+            return list(decode_block_stream(response.iter_content(chunk_size=64 * 1024), binary=binary))
+
+    def _fetch_block_hashes(self, peer, previous_hash, limit=10000):
+        # the hashes of the blocks of the peer's main chain following `previous_hash`, all of them, `limit` at a time.
+        block_hashes = []
+        while True:
+            params = {"limit": limit}
+            if previous_hash is not None:
+                params["from-hash"] = previous_hash
+
+            response = requests.get("http://%s:5000/blocks/hashes" % peer, params=params, timeout=self.fetch_timeout)
+            if response.status_code != 200:
+                return block_hashes
+
+            block_hashes.extend(response.json())
+            if len(response.json()) < limit:
+                return block_hashes
+            previous_hash = block_hashes[-1]
+
+    def synchronize(self, batch_size=500):
+        # learn which blocks follow our tip from the first peer that answers, then download them in ranges of
+        #   `batch_size` from all of the peers at once, each range from the next peer in turn and from the following
+        #   ones if that fails. the ranges are received in order, while the next ones are downloaded. returns how each
+        #   peer did.
         if len(self.peers) == 0:
             raise Exception("Can't synchronize if there is not at least one peer")
 
-        # pick one peer in the set
-        peer = next(iter(self.peers))
+        peers = list(self.peers)
+        tip_hash = self.tip.calculate_hash() if self.height >= 0 else None
+        for peer in peers:
+            try:
+                block_hashes = self._fetch_block_hashes(peer, tip_hash)
+                break
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.warning("Block hashes could not be retrieved from peer: %s, %s", peer, e)
+                error = e
+        else:
+            raise error
+        logger.info("Synchronize %s blocks from %s peer(s)", len(block_hashes), len(peers))
+
+        ranges = [
+            (block_hashes[i - 1] if i > 0 else tip_hash, block_hashes[i:i + batch_size])
+            for i in range(0, len(block_hashes), batch_size)
+        ]
+        peer_stats = {peer: {"blocks": 0, "seconds": 0.0, "failures": 0} for peer in peers}
+        peer_stats_lock = threading.Lock()
+
+        def download(index):
+            previous_hash, expected_hashes = ranges[index]
+            for attempt in range(len(peers)):
+                peer = peers[(index + attempt) % len(peers)]
+                start = time.perf_counter()
+                try:
+                    blocks = self._fetch_block_range(peer, previous_hash, len(expected_hashes))
+                    received_hashes = [b.calculate_hash() for b in blocks]
+                except (requests.exceptions.RequestException, BlockchainError, ValueError) as e:
+                    logger.warning(
+                        "Blocks following: %s could not be retrieved from peer: %s, %s", previous_hash, peer, e
+                    )
+                    blocks = None
+
+                with peer_stats_lock:
+                    peer_stats[peer]["seconds"] += time.perf_counter() - start
+                    if blocks is not None and received_hashes == expected_hashes:
+                        peer_stats[peer]["blocks"] += len(blocks)
+                        return blocks
+                    peer_stats[peer]["failures"] += 1
+
+            raise BlockchainError("No peer could send the blocks following: %s" % previous_hash)
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(peers), thread_name_prefix="synchronize"
+        ) as executor:
+            # at most two ranges per peer are downloaded ahead of the one being received.
+            downloads = collections.deque()
+            next_range = 0
+            while downloads or next_range < len(ranges):
+                while next_range < len(ranges) and len(downloads) < 2 * len(peers):
+                    downloads.append(executor.submit(download, next_range))
+                    next_range += 1
+
+                try:
+                    blocks = downloads.popleft().result()
+                except BlockchainError:
+                    for pending_download in downloads:
+                        pending_download.cancel()
+                    raise
+
+                for block in blocks:
+                    self.receive_block(block, publish=False)
 
-        def retrieve():
-            current_tip_hash = self.tip.calculate_hash()
+        for peer, stats in peer_stats.items():
             logger.info(
-                "Attempt to retrieve the next block, current tip: %s, height: %s", current_tip_hash, self.height
+                "Synchronized from peer: %s, blocks: %s, %.0f blocks/s, failures: %s",
+                peer, stats["blocks"], stats["blocks"] / stats["seconds"] if stats["seconds"] else 0, stats["failures"]
             )
-            return requests.get("http://%s:5000/blocks/get-next" % peer, params={"current-tip": current_tip_hash})
-
-        response = retrieve()
-        while len(response.content) > 0:
-            block = Block.unserialize(response.json())
-            logger.info("A new block with hash: %s was retrieved", block.calculate_hash())
-            self.receive_block(block)
 
-            response = retrieve()
+        return peer_stats
 
     def initialize(self, miner_address):
-        self.blocks = []
+        self.chainstate.reset()
         self.transaction_pool.flush()
+        self.seen_cache.clear()
+        self.rejected_cache.clear()
         return self.mine(miner_address=miner_address)
 
 
@@ -631,7 +3170,7 @@ class Client:
             self.load_keys(keys)
 
     def load_keys(self, keys: list[ecdsa.SigningKey]):
-        new_keys = {hashlib.sha256(key.verifying_key.to_string()).hexdigest(): key for key in keys}
+        new_keys = {crypto_backend.address(crypto_backend.public_key(key)): key for key in keys}
         logger.info("Loaded Wallets: %s", ", ".join(new_keys.keys()))
 
         self.keys.update(new_keys)
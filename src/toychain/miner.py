@@ -25,7 +25,7 @@ class Miner(threading.Thread):
         # TODO: concurrent access to data such as blocks needs proper locking
         while not self._stop_execution.is_set():
             logger.info("Attempt to mine a new block, if there are any transactions in the pool...")
-            block = self.blockchain.mine(miner_address=self.miner_address)
+            block = self.blockchain.mine(miner_address=self.miner_address, abort=self._stop_execution.is_set)
             if block:
                 logger.info("Mined new block: %s", block.serialize())
 
@@ -2,7 +2,33 @@ import ecdsa
 import pytest
 
 # own
-from main import Client
+import main
+from main import Block, Blockchain, Client, Transaction
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--chainstate", choices=["memory", "sqlite"], default="memory",
+        help="what every Blockchain created by the tests keeps its main chain in"
+    )
+
+
+@pytest.fixture(autouse=True)
+def chainstate(request, tmp_path, monkeypatch):
+    if request.config.getoption("chainstate") == "sqlite":
+        chainstates = []
+
+        def sqlite_chainstate():
+            chainstates.append(main.SQLiteChainstate(str(tmp_path / ("chainstate-%s.sqlite" % len(chainstates)))))
+            return chainstates[-1]
+
+        monkeypatch.setattr(main.Blockchain, "chainstate_factory", staticmethod(sqlite_chainstate))
+        yield
+        for sqlite_chainstate in chainstates:
+            sqlite_chainstate.close()
+
+    else:
+        yield
 
 
 @pytest.fixture(scope="session")
@@ -22,3 +48,23 @@ def client():
         user_04_key = ecdsa.SigningKey.from_pem(f.read())
 
     return Client([user_01_key, user_02_key, user_03_key, user_04_key])
+
+
+@pytest.fixture
+def source():
+    # a chain of 30 blocks on top of Genesis, to copy, synchronize or snapshot.
+    blockchain = Blockchain(base_difficulty=2)
+    blockchain.initialize(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+    extend(blockchain, 30)
+    return blockchain
+
+
+def coinbase_block(prev, address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d', amount=50):
+    # proof of work isn't checked on reception, which lets us build chains quickly.
+    return Block(prev=prev, transactions=[Transaction(inputs=[], outputs=[{'address': address, 'amount': amount}])])
+
+
+def extend(blockchain, count, **kwargs):
+    # connects `count` coinbase only blocks on top of the tip.
+    for _ in range(count):
+        blockchain._connect_block(coinbase_block(prev=blockchain.tip.calculate_hash(), **kwargs))
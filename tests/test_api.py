@@ -0,0 +1,109 @@
+import json
+
+# others
+import pytest
+
+# own
+import toychain.api
+import toychain.miner
+from main import Transaction
+
+
+ADDRESS = 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d'
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    # a node with an empty blockchain, no peers and no miner running in the background
+    for name in ("TOYCHAIN_PEERS", "TOYCHAIN_BLOCK_LOG", "TOYCHAIN_CHAINSTATE", "TOYCHAIN_SNAPSHOT_FILE",
+                 "TOYCHAIN_SYNCHRONIZE"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("TOYCHAIN_BLOCKCHAIN_FILE", str(tmp_path / "blockchain.json"))
+    monkeypatch.setenv("TOYCHAIN_GOSSIP_WORKERS", "0")
+    monkeypatch.setattr(toychain.miner.Miner, "start", lambda miner: None)
+
+    app = toychain.api.create_app()
+    toychain.api.blockchain.base_difficulty = 2
+    toychain.api.blockchain.initialize(miner_address=ADDRESS)
+    return app.test_client()
+
+
+def test_balances(api):
+    response = api.post('/balances?include-unspent-outputs', json={"addresses": [ADDRESS, "00" * 32]})
+    assert response.status_code == 200
+    assert response.json["balances"] == {ADDRESS: 50, "00" * 32: 0}
+    assert [output["amount"] for output in response.json["unspent_outputs"][ADDRESS]] == [50]
+    assert response.json["unspent_outputs"]["00" * 32] == []
+
+    for body in ({}, {"addresses": ADDRESS}, {"addresses": [ADDRESS, 1]}, {"addresses": None}, [ADDRESS], None):
+        assert api.post('/balances', json=body).status_code == 400
+    assert api.post('/balances', data="{", content_type="application/json").status_code == 400
+
+
+@pytest.fixture
+def transaction(client):
+    # spends the Genesis coinbase
+    transaction = Transaction(
+        inputs=[{'transaction_id': toychain.api.blockchain.tip.transactions[0].calculate_hash(), 'vout': 0}],
+        outputs=[{'address': 'b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225', 'amount': 45}]
+    )
+    client.sign(transaction, ADDRESS)
+    return transaction
+
+
+def test_receive_transactions(api, transaction):
+    response = api.post('/transactions/batch', json=[transaction.serialize(), {"inputs": []}, 5, transaction.serialize()])
+    assert response.status_code == 200
+    assert response.json[0] == response.json[3] == {"transaction_id": transaction.calculate_hash(), "fee": 5}
+    assert response.json[1]["error"] == "KeyError" and "transaction_id" not in response.json[1]
+    assert response.json[2]["error"] == "TypeError"
+    assert transaction.calculate_hash() in toychain.api.blockchain.transaction_pool
+
+    for body in (5, None, {"transactions": []}):
+        assert api.post('/transactions/batch', json=body).status_code == 400
+    assert api.post('/transactions/batch', data="[", content_type="application/json").status_code == 400
+
+    assert api.post('/transactions/batch', json=[{}] * 10001).status_code == 413
+
+
+def test_receive_transactions_as_ndjson(api, transaction):
+    lines = [json.dumps(transaction.serialize()), "", "{", "5"]
+    response = api.post('/transactions/batch', data="\n".join(lines) + "\n", content_type="application/x-ndjson")
+    assert response.status_code == 200
+    assert [result.get("fee", result.get("error")) for result in response.json] == [5, "JSONDecodeError", "TypeError"]
+
+    response = api.post('/transactions/batch', data="{}\n" * 10001, content_type="application/x-ndjson")
+    assert response.status_code == 413
+
+
+def test_get_transactions(api, transaction):
+    coinbase = toychain.api.blockchain.tip.transactions[0]
+    api.post('/transactions', json=transaction.serialize())
+    transaction_ids = [coinbase.calculate_hash(), transaction.calculate_hash(), "00" * 32]
+
+    response = api.post('/transactions/lookup', json={"transaction_ids": transaction_ids})
+    assert response.status_code == 200
+    assert [t and t["hash"] for t in response.json] == transaction_ids[:1] + [None, None]
+    response = api.post('/transactions/lookup?include-transaction-pool', json={"transaction_ids": transaction_ids})
+    assert [t and t["hash"] for t in response.json] == transaction_ids[:2] + [None]
+
+    for body in ({}, {"transaction_ids": "00" * 32}, {"transaction_ids": [1]}, transaction_ids, None):
+        assert api.post('/transactions/lookup', json=body).status_code == 400
+    assert api.post('/transactions/lookup', json={"transaction_ids": ["00" * 32] * 10001}).status_code == 413
+
+
+def test_receive_inventory(api, monkeypatch):
+    received = []
+    monkeypatch.setattr(
+        toychain.api.blockchain, "receive_inventory",
+        lambda inventory, peer=None: received.append((inventory, peer)) or {"blocks": [], "transactions": []}
+    )
+
+    # acknowledged, and fetched from the announcing node, by its address when it isn't one of our peers
+    inventory = {"blocks": ["00" * 32]}
+    assert api.post('/inventory', json=inventory).status_code == 202
+    assert api.post('/inventory', json=inventory, environ_base={"REMOTE_ADDR": "fd00::2"}).status_code == 202
+    assert received == [(inventory, "127.0.0.1"), (inventory, "[fd00::2]")]
+
+    for body in ([], None, "blocks"):
+        assert api.post('/inventory', json=body).status_code == 400
@@ -0,0 +1,294 @@
+import hashlib
+import json
+import math
+import time
+
+# others
+import ecdsa
+import pytest
+
+# own
+import main
+from main import Block, Blockchain, Transaction
+from conftest import extend
+
+
+pytestmark = pytest.mark.benchmark
+
+
+@pytest.fixture
+def sha256_calls(monkeypatch):
+    calls = []
+    sha256 = hashlib.sha256
+
+    def counting_sha256(*args, **kwargs):
+        calls.append(args)
+        return sha256(*args, **kwargs)
+
+    monkeypatch.setattr(main.hashlib, "sha256", counting_sha256)
+    return calls
+
+
+def test_hash_calls_per_received_block(client, sha256_calls):
+    blockchain_a = Blockchain(base_difficulty=2, transactions_per_block=10)
+    genesis_block = blockchain_a.initialize(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+    genesis_coinbase_hash = genesis_block.transactions[0].calculate_hash()
+
+    blockchain_b = Blockchain(base_difficulty=2, transactions_per_block=10)
+    blockchain_b.receive_block(Block.unserialize(genesis_block.serialize()))
+
+    # 10 transactions + block_01's coinbase. blocks aren't validated on reception, so they needn't be valid spends.
+    transactions = []
+    for vout in range(10):
+        transaction = Transaction(
+            inputs=[{'transaction_id': genesis_coinbase_hash, 'vout': 0}],
+            outputs=[{'address': 'b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225', 'amount': vout}]
+        )
+        transactions.append(transaction)
+    transactions.append(
+        Transaction(inputs=[], outputs=[{'address': 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d', 'amount': 50}])
+    )
+    block = Block(prev=genesis_block.calculate_hash(), transactions=transactions)
+
+    # merkle tree nodes above the leaves
+    merkle_nodes, level = 0, len(transactions)
+    while level > 1:
+        level = (level + 1) // 2
+        merkle_nodes += level
+
+    serialized_block = block.serialize()
+    sha256_calls.clear()
+
+    # as if it had been received from a peer
+    received_block = Block.unserialize(serialized_block)
+    blockchain_b.receive_block(received_block)
+    assert blockchain_b.height == 1
+
+    print("sha256 calls to receive a block with %s transactions: %s" % (len(transactions), len(sha256_calls)))
+
+    # each transaction is hashed exactly once, then the merkle tree, then the block header.
+    assert len(sha256_calls) == len(transactions) + merkle_nodes + 1
+
+    # and never again
+    sha256_calls.clear()
+    received_block.serialize()
+    blockchain_b.get_block(received_block.calculate_hash())
+    assert len(sha256_calls) == 0
+
+
+def make_block(transaction_count, version=Block.version):
+    transactions = [
+        Transaction(
+            inputs=[{'transaction_id': 'd0d9da8e1c009d6c19854d7bc0bce911c4e94afb86b9cfbcf0ce7e8004bf19b8', 'vout': i}],
+            outputs=[{'address': 'b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225', 'amount': i}]
+        )
+        for i in range(transaction_count)
+    ]
+    return Block(
+        prev='00000ff249a92ae61550eb3086c59abf181aec8ef67c55cd30bbea74a3e51152', transactions=transactions, version=version
+    )
+
+
+@pytest.mark.parametrize("version", [1, 2])
+@pytest.mark.parametrize("transaction_count", [1, 50])
+def test_mining_hash_rate(transaction_count, version):
+    block = make_block(transaction_count, version=version)
+    mask = 0  # never met, so that every nonce is tried
+    nonces = 2000
+
+    # previously: serialize the whole block and parse the hex digest, for every nonce.
+    start = time.perf_counter()
+    for nonce in range(nonces):
+        block.nonce = nonce
+        int(block.calculate_hash(), base=16) <= mask
+    before = nonces / (time.perf_counter() - start)
+
+    block.nonce = 0
+    preimage_prefix, preimage_suffix = block.preimage_template()
+    start = time.perf_counter()
+    assert main._try_nonces(hashlib.sha256(preimage_prefix), preimage_suffix, bytes(32), 0, 1, nonces) is None
+    after = nonces / (time.perf_counter() - start)
+
+    print(
+        "version %s, %s transactions, hash rate before: %.0f nonces/s, after: %.0f nonces/s (x%.1f)" % (
+            version, transaction_count, before, after, after / before
+        )
+    )
+
+    # both compute the same hash
+    for nonce in (0, 7, 123456789):
+        block.nonce = nonce
+        assert hashlib.sha256(preimage_prefix + b'%d' % nonce + preimage_suffix).hexdigest() == block.calculate_hash()
+
+
+def test_header_preimage_does_not_grow_with_transactions():
+    assert len(make_block(1).preimage_template()[1]) == len(make_block(500).preimage_template()[1])
+    assert len(make_block(1, version=1).preimage_template()[1]) < len(make_block(500, version=1).preimage_template()[1])
+
+
+def test_signature_verification_rate_for_a_repeated_signer():
+    key = ecdsa.SigningKey.generate(curve=ecdsa.SECP256k1)
+    public_key = key.verifying_key.to_string()
+    checks = []
+    for i in range(50):
+        data = b'transaction %d' % i
+        checks.append((public_key, key.sign(data, hashfunc=hashlib.sha256), data))
+
+    # previously: parse the public key for every signature.
+    start = time.perf_counter()
+    for public_key, signature, data in checks:
+        ecdsa.VerifyingKey.from_string(public_key, curve=ecdsa.SECP256k1).verify(
+            signature=signature, data=data, hashfunc=hashlib.sha256
+        )
+    before = len(checks) / (time.perf_counter() - start)
+
+    main._public_keys.clear()
+    start = time.perf_counter()
+    main.verify_signatures(checks)
+    after = len(checks) / (time.perf_counter() - start)
+
+    print("verifications before: %.0f/s, after: %.0f/s (x%.1f)" % (before, after, after / before))
+    assert main.get_public_key(public_key)["address"] == hashlib.sha256(public_key).hexdigest()
+
+    # a bad signature is still caught with a precomputed key
+    with pytest.raises(ecdsa.BadSignatureError):
+        main.verify_signatures([(public_key, checks[0][1], checks[1][2])])
+
+
+def test_signature_throughput_per_crypto_backend(client):
+    pytest.importorskip("cryptography")
+
+    key = client.keys['b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d']
+    data = [b'transaction %d' % i for i in range(50)]
+
+    for name in ("ecdsa", "cryptography"):
+        backend = main.select_crypto_backend(name)
+        public_key = backend.parse_public_key(backend.public_key(key))
+
+        start = time.perf_counter()
+        signatures = [backend.sign(key, d) for d in data]
+        sign_rate = len(data) / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for signature, d in zip(signatures, data):
+            backend.verify(public_key, signature, d)
+        verify_rate = len(data) / (time.perf_counter() - start)
+
+        print("%s: %.0f signatures/s, %.0f verifications/s" % (name, sign_rate, verify_rate))
+
+
+@pytest.mark.parametrize("transaction_count", [1, 50])
+def test_binary_encoding_size_and_throughput(client, transaction_count):
+    block = make_block(transaction_count)
+    for transaction in block.transactions:
+        client.sign(transaction, 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+    rounds = 200
+
+    json_block = json.dumps(block.serialize()).encode('utf-8')
+    binary_block = block.encode()
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        json.dumps(block.serialize()).encode('utf-8')
+    json_encode_rate = rounds / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        block.encode()
+    binary_encode_rate = rounds / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        Block.unserialize(json.loads(json_block))
+    json_decode_rate = rounds / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        Block.decode(binary_block)
+    binary_decode_rate = rounds / (time.perf_counter() - start)
+
+    print(
+        "%s transactions, JSON: %s bytes, %.0f encodes/s, %.0f decodes/s. binary: %s bytes (%.0f%%), %.0f encodes/s, "
+        "%.0f decodes/s" % (
+            transaction_count, len(json_block), json_encode_rate, json_decode_rate, len(binary_block),
+            100 * len(binary_block) / len(json_block), binary_encode_rate, binary_decode_rate
+        )
+    )
+    assert len(binary_block) < len(json_block) / 2
+
+
+def test_transaction_preimage_rate():
+    transactions = make_block(200).transactions
+
+    # previously: sort and dump every dict, for each of hashing, signing and verifying.
+    start = time.perf_counter()
+    for transaction in transactions:
+        json.dumps(transaction.hashable_contents, sort_keys=True).encode('utf-8')
+    before = len(transactions) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for transaction in transactions:
+        transaction.preimage
+    after = len(transactions) / (time.perf_counter() - start)
+
+    print("transaction preimages before: %.0f/s, after: %.0f/s (x%.1f), and cached after that" % (
+        before, after, after / before
+    ))
+    assert all(
+        t.preimage == json.dumps(t.hashable_contents, sort_keys=True).encode('utf-8') for t in transactions
+    )
+
+
+def test_synchronization_round_trips_and_rate(monkeypatch):
+    source = Blockchain(base_difficulty=2)
+    source.initialize(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+    extend(source, 2000)
+
+    blockchain = Blockchain(base_difficulty=2)
+    blockchain.receive_block(source.blocks[0])
+    blockchain.peers = {"peer"}
+
+    # every batch goes through the binary block stream, as it would over HTTP
+    round_trips = []
+
+    def fetch_block_range(peer, previous_hash, limit):
+        round_trips.append(previous_hash)
+        data = b"".join(main.encode_block_stream(source.get_blocks_after(previous_hash, limit), binary=True))
+        return list(main.decode_block_stream([data], binary=True))
+
+    monkeypatch.setattr(blockchain, "_fetch_block_range", fetch_block_range)
+    monkeypatch.setattr(
+        blockchain, "_fetch_block_hashes", lambda peer, previous_hash: source.get_block_hashes_after(previous_hash, 10000)
+    )
+    start = time.perf_counter()
+    blockchain.synchronize()
+    elapsed = time.perf_counter() - start
+
+    # previously: a `/blocks/get-next` round trip per block. plus one for the hashes.
+    print("synchronized %s blocks in %.2fs (%.0f blocks/s), round trips: %s, previously: %s" % (
+        source.height, elapsed, source.height / elapsed, len(round_trips) + 1, source.height + 1
+    ))
+    assert blockchain.tip.calculate_hash() == source.tip.calculate_hash()
+    assert len(round_trips) == math.ceil(source.height / 500)
+
+
+def test_compact_block_size_and_rebuild_rate():
+    # a block whose transactions are all in the receiver's transaction pool, but the coinbase
+    block = make_block(500)
+    blockchain = Blockchain(base_difficulty=2)
+    for transaction in block.transactions[1:]:
+        blockchain.transaction_pool.add_transaction(transaction=transaction, fee=1)
+
+    compact_block = block.compact(prefilled_indexes={0})
+    full_size = len(json.dumps(block.serialize()))
+    compact_size = len(json.dumps(compact_block))
+
+    start = time.perf_counter()
+    transactions = blockchain._rebuild_transactions(compact_block)
+    elapsed = time.perf_counter() - start
+
+    print("block of %s transactions: %s bytes, compact: %s bytes (%.1f%%), rebuilt in %.1fms" % (
+        len(block.transactions), full_size, compact_size, 100 * compact_size / full_size, elapsed * 1000
+    ))
+    assert [t.calculate_hash() for t in transactions] == [t.calculate_hash() for t in block.transactions]
+    assert compact_size < full_size / 5
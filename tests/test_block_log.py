@@ -0,0 +1,132 @@
+import os
+
+# others
+import pytest
+
+# own
+from main import Block, BlockLog, BlockLogError, Blockchain, MemoryChainstate, Transaction, import_blockchain_file
+from conftest import coinbase_block, extend
+
+
+@pytest.fixture
+def blockchain():
+    blockchain = Blockchain(base_difficulty=2)
+    blockchain.initialize(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+    return blockchain
+
+
+def test_import_blockchain_file(tmp_path):
+    blockchain = import_blockchain_file('../src/toychain/blockchain.json', BlockLog(tmp_path))
+
+    block_log = BlockLog(tmp_path)
+    assert len(block_log) == len(blockchain.blocks) == 1
+    assert block_log[0].serialize() == blockchain.blocks[0].serialize()
+    assert block_log.get_height('00000ff249a92ae61550eb3086c59abf181aec8ef67c55cd30bbea74a3e51152') == 0
+    assert block_log.get_height('0' * 64) is None
+
+
+def test_save_appends_new_blocks_only(tmp_path, blockchain, monkeypatch):
+    block_log = BlockLog(tmp_path)
+    extend(blockchain, 5)
+    blockchain.save(block_log)
+    assert len(block_log) == 6
+
+    appended = []
+    append = block_log.append
+    monkeypatch.setattr(block_log, "append", lambda block: appended.append(block) or append(block))
+
+    extend(blockchain, 2)
+    blockchain.save(block_log)
+    assert [b.calculate_hash() for b in appended] == [b.calculate_hash() for b in blockchain.blocks[-2:]]
+
+    blockchain.save(block_log)
+    assert len(appended) == 2
+
+
+def test_load_after_reorganization(tmp_path, blockchain):
+    block_log = BlockLog(tmp_path, segment_size=1024)
+    extend(blockchain, 20)
+    blockchain.save(block_log)
+    segments = len([f for f in os.listdir(tmp_path) if f.startswith("blocks-")])
+    assert segments > 1
+
+    # a reorganization that goes back a few segments
+    for _ in range(15):
+        blockchain._disconnect_block()
+    extend(blockchain, 3, amount=7)
+    blockchain.fork = [coinbase_block(prev=blockchain.blocks[2].calculate_hash())]
+    blockchain.save(block_log)
+    block_log.close()
+
+    assert len([f for f in os.listdir(tmp_path) if f.startswith("blocks-")]) < segments
+
+    loaded_blockchain = Blockchain.load(BlockLog(tmp_path, segment_size=1024))
+    assert [b.calculate_hash() for b in loaded_blockchain.blocks] == [b.calculate_hash() for b in blockchain.blocks]
+    assert loaded_blockchain.utxos == blockchain.utxos
+    assert loaded_blockchain.fork[0].calculate_hash() == blockchain.fork[0].calculate_hash()
+    assert loaded_blockchain.get_block(blockchain.tip.calculate_hash()) is not None
+
+
+def test_loaded_blocks_are_read_from_the_log(tmp_path, blockchain, monkeypatch):
+    block_log = BlockLog(tmp_path)
+    extend(blockchain, 30)
+    blockchain.save(block_log)
+
+    reads = []
+    read = block_log.read
+    monkeypatch.setattr(block_log, "read", lambda height: reads.append(height) or read(height))
+    loaded_blockchain = Blockchain.load(block_log, chainstate=MemoryChainstate())
+    reads.clear()
+
+    # the old ones are read again, the recent ones aren't
+    assert loaded_blockchain.blocks[3].calculate_hash() == blockchain.blocks[3].calculate_hash()
+    assert loaded_blockchain.blocks[3].calculate_hash() == blockchain.blocks[3].calculate_hash()
+    assert loaded_blockchain.tip.calculate_hash() == blockchain.tip.calculate_hash()
+    assert reads == [3]
+    assert loaded_blockchain.get_block_hashes_after(None, 100) == [b.calculate_hash() for b in blockchain.blocks]
+    assert reads == [3]
+
+    # a reorganization below the loaded tip, then new blocks, which are kept in memory until they're saved
+    for _ in range(5):
+        loaded_blockchain._disconnect_block()
+    extend(loaded_blockchain, 2, amount=7)
+    loaded_blockchain.save(block_log)
+    assert [b.calculate_hash() for b in Blockchain.load(block_log).blocks] == [
+        b.calculate_hash() for b in loaded_blockchain.blocks
+    ]
+    assert block_log.get_height(loaded_blockchain.tip.calculate_hash()) == loaded_blockchain.height
+    assert block_log.get_height(blockchain.tip.calculate_hash()) is None
+
+
+def test_incomplete_write_is_discarded(tmp_path, blockchain):
+    block_log = BlockLog(tmp_path)
+    blockchain.save(block_log)
+    block_log.close()
+
+    # as if we had crashed halfway through appending a block
+    with open(tmp_path / "blocks-00000.dat", "ab") as f:
+        f.write(b"\xff" * 10)
+
+    block_log = BlockLog(tmp_path)
+    extend(blockchain, 1)
+    blockchain.save(block_log)
+    assert [b.calculate_hash() for b in block_log] == [b.calculate_hash() for b in blockchain.blocks]
+
+
+def test_blocks_that_cant_be_encoded_in_binary(tmp_path):
+    block = Block(
+        prev='0' * 64,
+        transactions=[Transaction(inputs=[], outputs=[{'address': 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d', 'amount': 0.5}])]
+    )
+    block_log = BlockLog(tmp_path)
+    block_log.append(block)
+
+    assert block_log[-1].calculate_hash() == block.calculate_hash()
+
+
+def test_not_a_block_log(tmp_path):
+    with open(tmp_path / "index.dat", "wb") as f:
+        f.write(b"{}" * 100)
+
+    with pytest.raises(BlockLogError):
+        BlockLog(tmp_path)
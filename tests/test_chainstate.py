@@ -0,0 +1,82 @@
+# others
+import pytest
+
+# own
+from main import Blockchain, MemoryChainstate, SQLiteChainstate
+from conftest import coinbase_block, extend
+
+
+def chain_state(blockchain):
+    return (
+        [b.calculate_hash() for b in blockchain.blocks],
+        dict(blockchain.utxos),
+        dict(blockchain._block_index),
+        dict(blockchain._transaction_index),
+        blockchain.calculate_balance('b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d'),
+    )
+
+
+def test_backends_agree(tmp_path):
+    memory_blockchain = Blockchain(base_difficulty=2, chainstate=MemoryChainstate())
+    sqlite_blockchain = Blockchain(
+        base_difficulty=2, chainstate=SQLiteChainstate(str(tmp_path / "chainstate.sqlite"))
+    )
+    memory_blockchain.initialize(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+    extend(memory_blockchain, 10)
+    for block in memory_blockchain.blocks:
+        sqlite_blockchain._connect_block(block)
+
+    # a reorganization
+    for _ in range(4):
+        memory_blockchain._disconnect_block()
+        sqlite_blockchain._disconnect_block()
+    for _ in range(2):
+        block = coinbase_block(prev=memory_blockchain.tip.calculate_hash(), amount=7)
+        memory_blockchain._connect_block(block)
+        sqlite_blockchain._connect_block(block)
+
+    assert chain_state(memory_blockchain) == chain_state(sqlite_blockchain)
+
+
+def test_sqlite_chainstate_survives_a_restart(tmp_path):
+    blockchain = Blockchain(base_difficulty=2, chainstate=SQLiteChainstate(str(tmp_path / "chainstate.sqlite")))
+    blockchain.initialize(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+    extend(blockchain, 5)
+    state = chain_state(blockchain)
+    blockchain.chainstate.close()
+
+    restarted_blockchain = Blockchain(chainstate=SQLiteChainstate(str(tmp_path / "chainstate.sqlite")))
+    assert chain_state(restarted_blockchain) == state
+    assert restarted_blockchain.height == 5
+
+    # and goes on from there
+    extend(restarted_blockchain, 1)
+    restarted_blockchain._disconnect_block()
+    restarted_blockchain._disconnect_block()
+    assert restarted_blockchain.height == 4
+
+
+def test_sqlite_chainstate_keeps_few_blocks_in_memory(tmp_path):
+    chainstate = SQLiteChainstate(str(tmp_path / "chainstate.sqlite"), hot_blocks=4)
+    blockchain = Blockchain(base_difficulty=2, chainstate=chainstate)
+    blockchain.initialize(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+    extend(blockchain, 20)
+
+    assert len(chainstate._hot_blocks) <= 4
+    assert [b.calculate_hash() for b in blockchain.blocks[:3]] == [
+        blockchain.get_block(b.calculate_hash()).calculate_hash() for b in blockchain.blocks[:3]
+    ]
+    assert len(chainstate._hot_blocks) <= 4
+
+
+def test_sqlite_chainstate_rolls_back_a_failed_block(tmp_path):
+    chainstate = SQLiteChainstate(str(tmp_path / "chainstate.sqlite"))
+    blockchain = Blockchain(base_difficulty=2, chainstate=chainstate)
+    blockchain.initialize(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+    state = chain_state(blockchain)
+
+    # a block that's already in the main chain can't be appended again
+    with pytest.raises(Exception):
+        blockchain._connect_block(blockchain.tip)
+
+    assert chain_state(blockchain) == state
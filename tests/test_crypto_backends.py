@@ -0,0 +1,96 @@
+import base64
+import json
+
+# others
+import ecdsa
+import pytest
+
+# own
+import main
+from main import Transaction
+
+
+@pytest.fixture(params=["ecdsa", "cryptography"])
+def backend(request):
+    if request.param == "cryptography":
+        pytest.importorskip("cryptography")
+
+    return main.select_crypto_backend(request.param)
+
+
+@pytest.fixture
+def other_backend(backend):
+    # the backend `backend` has to agree with.
+    pytest.importorskip("cryptography")
+    return main.select_crypto_backend("ecdsa" if backend.name == "cryptography" else "cryptography")
+
+
+def test_signatures_are_identical(client, backend, other_backend):
+    key = client.keys['b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d']
+    data = b'{"inputs": [], "outputs": []}'
+
+    signature = backend.sign(key, data)
+    assert len(signature) == 64
+    assert signature == other_backend.sign(key, data)
+
+    public_key = backend.public_key(key)
+    assert public_key == other_backend.public_key(key)
+    assert backend.address(public_key) == other_backend.address(public_key) == (
+        'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d'
+    )
+
+    # a signature made with one is verified with the other
+    other_backend.verify(other_backend.parse_public_key(public_key), signature, data)
+
+
+def test_bad_signatures(client, backend):
+    key = client.keys['b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d']
+    public_key = backend.parse_public_key(backend.public_key(key))
+    signature = backend.sign(key, b'data')
+
+    # precomputing doesn't change the outcome
+    backend.verify(public_key, signature, b'data')
+    backend.precompute(public_key)
+    backend.verify(public_key, signature, b'data')
+
+    for bad_signature, data in (
+        (signature, b'other data'),
+        (backend.sign(client.keys['5803922ef28c4db7e6ca909cb35644400d9ec08cb3f1d7cfb29399afac149883'], b'data'), b'data'),
+        (signature[:32] + bytes(32), b'data'),
+    ):
+        with pytest.raises(ecdsa.BadSignatureError):
+            backend.verify(public_key, bad_signature, data)
+
+    # not a point of the curve
+    with pytest.raises(Exception):
+        backend.parse_public_key(bytes(64))
+
+    # the same point, SEC 1 compressed and uncompressed: only the raw encoding is accepted, by every backend
+    raw_public_key = backend.public_key(key)
+    for encoded_public_key in (
+        key.verifying_key.to_string("compressed"), key.verifying_key.to_string("uncompressed"), raw_public_key[:-1]
+    ):
+        assert encoded_public_key != raw_public_key
+        with pytest.raises(ValueError, match="Public key must be 64 bytes long, not %s" % len(encoded_public_key)):
+            backend.parse_public_key(encoded_public_key)
+
+
+def test_transaction_signed_by_either_backend_is_valid(client, backend, monkeypatch):
+    monkeypatch.setattr(main, "crypto_backend", backend)
+
+    transaction = Transaction(inputs=[], outputs=[])
+    client.sign(transaction, 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+
+    main.verify_signatures([(
+        base64.b64decode(transaction.public_key),
+        base64.b64decode(transaction.signature),
+        json.dumps(transaction.hashable_contents, sort_keys=True).encode('utf-8')
+    )])
+    assert main.get_public_key(base64.b64decode(transaction.public_key))['address'] == (
+        'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d'
+    )
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        main.select_crypto_backend("openssh")
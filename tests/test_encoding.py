@@ -0,0 +1,127 @@
+import json
+
+# others
+import pytest
+
+# own
+from main import Block, Blockchain, InvalidBlockError, InvalidEncodingError, Transaction
+
+
+@pytest.fixture
+def transaction(client):
+    transaction = Transaction(
+        inputs=[
+            {'transaction_id': 'd0d9da8e1c009d6c19854d7bc0bce911c4e94afb86b9cfbcf0ce7e8004bf19b8', 'vout': 0}
+        ],
+        outputs=[
+            {'address': 'b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225', 'amount': 20},
+            {'address': 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d', 'amount': 28}  # change
+        ]
+    )
+    client.sign(transaction, 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+    return transaction
+
+
+def test_transaction_round_trip(transaction):
+    encoded_transaction = transaction.encode()
+    decoded_transaction = Transaction.decode(encoded_transaction)
+
+    assert decoded_transaction.calculate_hash() == transaction.calculate_hash()
+    assert decoded_transaction.serialize() == transaction.serialize()
+    assert len(encoded_transaction) < len(json.dumps(transaction.serialize())) / 2
+
+    # unsigned, too
+    unsigned_transaction = Transaction(inputs=[], outputs=[])
+    assert Transaction.decode(unsigned_transaction.encode()).serialize() == unsigned_transaction.serialize()
+
+
+@pytest.mark.parametrize("version", [1, 2])
+def test_block_round_trip(transaction, version):
+    coinbase = Transaction(inputs=[], outputs=[{'address': 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d', 'amount': 52}])
+    block = Block(
+        prev='00000ff249a92ae61550eb3086c59abf181aec8ef67c55cd30bbea74a3e51152', nonce=2 ** 40,
+        transactions=[transaction, coinbase], version=version
+    )
+
+    decoded_block = Block.decode(block.encode())
+    assert decoded_block.version == version
+    assert decoded_block.calculate_hash() == block.calculate_hash()
+    assert decoded_block.serialize() == block.serialize()
+
+    # from any bytes-like object
+    assert Block.decode(memoryview(bytearray(block.encode()))).calculate_hash() == block.calculate_hash()
+
+
+def test_genesis_block_round_trip():
+    with open('../src/toychain/blockchain.json') as f:
+        blockchain = Blockchain.unserialize(json.load(f))
+
+    genesis_block = blockchain.blocks[0]
+    assert Block.decode(genesis_block.encode()).serialize() == genesis_block.serialize()
+
+
+@pytest.mark.parametrize("inputs, outputs", [
+    # uppercase hex wouldn't hash the same once decoded
+    ([{'transaction_id': 'D0D9DA8E1C009D6C19854D7BC0BCE911C4E94AFB86B9CFBCF0CE7E8004BF19B8', 'vout': 0}], []),
+    ([{'transaction_id': 'd0d9', 'vout': 0}], []),
+    ([{'transaction_id': 'd0d9da8e1c009d6c19854d7bc0bce911c4e94afb86b9cfbcf0ce7e8004bf19b8', 'vout': -1}], []),
+    ([], [{'address': 'b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225', 'amount': 2.5}]),
+    ([], [{'address': 'b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225', 'amount': 2, 'memo': ''}]),
+])
+def test_values_that_cant_be_encoded(inputs, outputs):
+    with pytest.raises(ValueError):
+        Transaction(inputs=inputs, outputs=outputs).encode()
+
+
+def test_negative_amounts_round_trip():
+    transaction = Transaction(
+        inputs=[], outputs=[{'address': 'b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225', 'amount': -3}]
+    )
+    assert Transaction.decode(transaction.encode()).outputs[0]['amount'] == -3
+
+
+def test_invalid_messages(transaction):
+    block = Block(prev='00000ff249a92ae61550eb3086c59abf181aec8ef67c55cd30bbea74a3e51152', transactions=[transaction])
+    encoded_block = block.encode()
+
+    with pytest.raises(InvalidEncodingError):
+        Block.decode(encoded_block[:-1])  # truncated
+    with pytest.raises(InvalidEncodingError):
+        Block.decode(encoded_block + b'\0')  # trailing bytes
+    with pytest.raises(InvalidEncodingError):
+        Block.decode(transaction.encode())  # not a block
+    with pytest.raises(InvalidEncodingError):
+        Block.decode(b'{"prev": "..."}')  # not binary at all
+
+    # a merkle root that doesn't match the transactions
+    merkle_root_offset = encoded_block.index(bytes.fromhex(block.merkle_root))
+    tampered_block = bytearray(encoded_block)
+    tampered_block[merkle_root_offset] ^= 0xff
+    with pytest.raises(InvalidBlockError):
+        Block.decode(tampered_block)
+
+
+@pytest.mark.parametrize("inputs, outputs, timestamp", [
+    ([], [], 1652666393901498900),
+    (
+        [{'transaction_id': 'd0d9da8e1c009d6c19854d7bc0bce911c4e94afb86b9cfbcf0ce7e8004bf19b8', 'vout': 0}] * 3,
+        [{'address': 'b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225', 'amount': -20}] * 2,
+        1652666393901498900
+    ),
+    # strings that need escaping
+    ([{'transaction_id': 'd0"\\\né\U0001f600', 'vout': 0}], [{'address': '', 'amount': 0}], 1),
+    # and the fallback: floats, bools, unexpected or missing keys
+    ([], [{'address': 'b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225', 'amount': 2.5}], 1.5),
+    ([], [{'address': 'b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225', 'amount': True}], 1),
+    ([{'transaction_id': 'd0d9', 'vout': 0, 'sequence': 1}], [{'address': 'b628'}], 1),
+])
+def test_preimage_is_byte_identical_to_json(inputs, outputs, timestamp):
+    transaction = Transaction(inputs=inputs, outputs=outputs, timestamp=timestamp)
+    assert transaction.preimage == json.dumps(transaction.hashable_contents, sort_keys=True).encode('utf-8')
+
+
+def test_genesis_transaction_hash_is_unchanged():
+    with open('../src/toychain/blockchain.json') as f:
+        serialized_transaction = json.load(f)['blocks'][0]['transactions'][0]
+
+    assert Transaction.unserialize(serialized_transaction).calculate_hash() == serialized_transaction['hash']
@@ -0,0 +1,347 @@
+import json
+import threading
+import time
+
+# others
+import pytest
+import requests
+
+# own
+import main
+from main import Block, Blockchain, GossipDispatcher, Transaction
+from conftest import extend
+
+
+@pytest.fixture
+def posts(monkeypatch):
+    # peer: the posts it received. "slow" waits until `release` is set, "down" can't be reached.
+    posts = {}
+    release = threading.Event()
+
+    def post(session, url, data=None, headers=None, timeout=None):
+        assert timeout is not None
+        peer = url.split("//")[1].split(":")[0]
+        if peer == "down":
+            raise requests.exceptions.ConnectionError("%s is unreachable" % peer)
+        if peer == "slow":
+            release.wait()
+        posts.setdefault(peer, []).append((url, data, headers["Content-Type"]))
+
+    monkeypatch.setattr(main.requests.Session, "post", post)
+    posts["release"] = release
+    return posts
+
+
+@pytest.fixture
+def block():
+    return Block(prev="00" * 32, transactions=[
+        Transaction(inputs=[], outputs=[
+            {'address': 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d', 'amount': 50}
+        ])
+    ])
+
+
+def test_publish_does_not_wait_for_peers(posts, block):
+    blockchain = Blockchain(base_difficulty=2, gossip_workers=2)
+    blockchain.peers = {"slow", "fast", "down"}
+
+    # a slow peer holds up a worker, not the publisher nor the other peers
+    blockchain.publish_block(block)
+    blockchain.publish_transaction(block.transactions[0])
+    posts["release"].set()
+    blockchain.gossip_dispatcher.join()
+
+    for peer in ("fast", "slow"):
+        assert sorted(posts[peer]) == sorted([
+            ("http://%s:5000/inventory" % peer, json.dumps({"blocks": [block.calculate_hash()]}).encode('utf-8'),
+             "application/json"),
+            ("http://%s:5000/inventory" % peer,
+             json.dumps({"transactions": [block.transactions[0].calculate_hash()]}).encode('utf-8'), "application/json")
+        ])
+    assert blockchain.has_seen(block.calculate_hash()) and blockchain.has_seen(block.transactions[0].calculate_hash())
+
+    stats = blockchain.gossip_dispatcher.stats
+    assert stats["queue_size"] == 0 and stats["dropped"] == 0
+    assert stats["peers"]["fast"]["sent"] == stats["peers"]["slow"]["sent"] == 2
+    assert stats["peers"]["down"] == {"sent": 0, "failed": 2, "average_latency": pytest.approx(0, abs=1)}
+    blockchain.gossip_dispatcher.close()
+
+
+def test_full_queue_drops_sends(posts, block):
+    gossip_dispatcher = GossipDispatcher(workers=1, max_queue_size=2)
+    assert gossip_dispatcher.announce(["slow"], {"blocks": [block.calculate_hash()]}) == 1
+    # wait for the worker to pick it up, and to be held up by it
+    while gossip_dispatcher.stats["queue_size"]:
+        time.sleep(0.01)
+
+    assert gossip_dispatcher.announce(["slow", "fast", "slow"], {"blocks": [block.calculate_hash()]}) == 2
+    assert gossip_dispatcher.stats["queue_size"] == 2
+    assert gossip_dispatcher.stats["dropped"] == 1
+
+    posts["release"].set()
+    gossip_dispatcher.join()
+    assert len(posts["slow"]) == 2 and len(posts["fast"]) == 1
+    gossip_dispatcher.close()
+
+
+def test_no_workers_sends_in_the_calling_thread(posts, block):
+    gossip_dispatcher = GossipDispatcher(workers=0)
+    assert gossip_dispatcher.announce(["fast", "down"], {"transactions": [block.transactions[0].calculate_hash()]}) == 2
+    assert len(posts["fast"]) == 1
+    assert gossip_dispatcher.stats["peers"]["down"]["failed"] == 1
+
+
+def test_tasks_run_in_the_background():
+    gossip_dispatcher = GossipDispatcher(workers=1)
+    release = threading.Event()
+    done = []
+
+    def failing_task():
+        raise Exception("Task failed")
+
+    assert gossip_dispatcher.submit(failing_task)
+    assert gossip_dispatcher.submit(lambda: release.wait() and done.append(1))
+    assert done == []
+
+    # a failed task doesn't take the worker down with it
+    release.set()
+    gossip_dispatcher.join()
+    assert done == [1]
+    gossip_dispatcher.close()
+
+
+def test_inventory_fetches_only_what_is_missing(client, monkeypatch):
+    source = Blockchain(base_difficulty=2, gossip_workers=0)
+    source.initialize(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+    blockchain = Blockchain(base_difficulty=2, gossip_workers=0)
+    blockchain.receive_block(source.tip)
+    blockchain.peers = {"peer-1", "peer-2"}
+
+    transaction = Transaction(
+        inputs=[{'transaction_id': source.tip.transactions[0].calculate_hash(), 'vout': 0}],
+        outputs=[{'address': 'b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225', 'amount': 50}]
+    )
+    client.sign(transaction, 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+    source.add_transaction_to_pool(transaction)
+    source.mine(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+
+    fetches = []
+
+    def fetch_block(block_hash, peers=None):
+        fetches.append((block_hash, peers[0]))
+        return source.get_block(block_hash)
+
+    def fetch_transactions(transaction_ids, peers=None):
+        fetches.extend((transaction_id, peers[0]) for transaction_id in transaction_ids)
+        return {transaction_id: source.get_transaction(transaction_id) for transaction_id in transaction_ids}
+
+    announcements = []
+    monkeypatch.setattr(blockchain, "_fetch_block", fetch_block)
+    monkeypatch.setattr(blockchain, "_fetch_transactions", fetch_transactions)
+    monkeypatch.setattr(
+        blockchain.gossip_dispatcher, "announce", lambda peers, inventory: announcements.append(inventory) or len(peers)
+    )
+
+    # the transaction first, then the block that confirms it, and each of them again, from another peer
+    transaction_inventory = {"transactions": [transaction.calculate_hash()]}
+    block_inventory = {"blocks": [source.tip.calculate_hash(), source.blocks[0].calculate_hash()]}
+    assert blockchain.receive_inventory(transaction_inventory, peer="peer-2")["transactions"] == [
+        transaction.calculate_hash()
+    ]
+    assert blockchain.receive_inventory(transaction_inventory, peer="peer-1")["transactions"] == []
+    assert blockchain.receive_inventory(block_inventory, peer="peer-2")["blocks"] == [source.tip.calculate_hash()]
+    assert blockchain.receive_inventory(block_inventory, peer="peer-1")["blocks"] == []
+
+    assert fetches == [(transaction.calculate_hash(), "peer-2"), (source.tip.calculate_hash(), "peer-2")]
+    assert blockchain.tip.calculate_hash() == source.tip.calculate_hash()
+    assert len(blockchain.transaction_pool) == 0
+    # and each of them has been announced to our peers once
+    assert announcements == [
+        {"transactions": [transaction.calculate_hash()]}, {"blocks": [source.tip.calculate_hash()]}
+    ]
+
+
+class Response:
+    def __init__(self, json_data):
+        self.status_code = 404 if json_data is None else 200
+        self.headers = {"Content-Type": "application/json"}
+        self._json_data = json_data
+
+    def json(self):
+        return self._json_data
+
+
+@pytest.fixture
+def compact_blocks(client, monkeypatch):
+    # a block with the coinbase and two transactions, only one of which is in the receiver's transaction pool.
+    source = Blockchain(base_difficulty=2, gossip_workers=0)
+    source.initialize(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+    extend(source, 2)
+    receiver = Blockchain(base_difficulty=2, gossip_workers=0)
+    for block in source.blocks:
+        receiver.receive_block(block)
+
+    transactions = []
+    for block in source.blocks[1:]:
+        transaction = Transaction(
+            inputs=[{'transaction_id': block.transactions[0].calculate_hash(), 'vout': 0}],
+            outputs=[{'address': 'b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225', 'amount': 49}]
+        )
+        client.sign(transaction, 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+        source.add_transaction_to_pool(transaction)
+        transactions.append(transaction)
+    receiver.add_transaction_to_pool(transactions[0])
+    block = source.mine(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+
+    requested_urls = []
+
+    def get(url, params=None, headers=None, timeout=None):
+        # "hung" accepts the connection, and never answers
+        assert timeout == receiver.fetch_timeout
+        if url.startswith("http://hung:"):
+            raise requests.exceptions.ReadTimeout("%s timed out" % url)
+
+        requested_urls.append(url)
+        block_hash = url.split("/")[4]
+        if url.endswith("/compact"):
+            return Response(source.get_compact_block(block_hash))
+        if url.endswith("/transactions"):
+            indexes = [int(index) for index in params["indexes"].split(",")]
+            return Response([t.serialize() for t in source.get_block_transactions(block_hash, indexes)])
+        return Response(source.get_block(block_hash).serialize())
+
+    monkeypatch.setattr(main.requests, "get", get)
+    return source, receiver, block, requested_urls
+
+
+def test_compact_block(compact_blocks):
+    source, receiver, block, requested_urls = compact_blocks
+    compact_block = source.get_compact_block(block.calculate_hash())
+
+    # only the coinbase is sent in full, the other transactions were announced
+    assert [p['index'] for p in compact_block['prefilled_transactions']] == [
+        index for index, transaction in enumerate(block.transactions) if transaction.is_coinbase
+    ]
+    assert len(compact_block['short_ids']) == 2
+    assert len(json.dumps(compact_block)) < len(json.dumps(block.serialize())) / 2
+
+    receiver.peers = {"source"}
+    assert receiver.receive_inventory({"blocks": [block.calculate_hash()]}, peer="source")["blocks"] == [
+        block.calculate_hash()
+    ]
+    assert receiver.tip.calculate_hash() == block.calculate_hash()
+    assert receiver.compact_block_stats == {"rebuilt": 1, "requested_transactions": 1, "failed": 0}
+    assert [url.split("/")[-1] for url in requested_urls] == ["compact", "transactions"]
+
+
+def test_compact_block_that_can_not_be_rebuilt(compact_blocks, monkeypatch):
+    # every transaction in the pool collides with every short id
+    source, receiver, block, requested_urls = compact_blocks
+    monkeypatch.setattr(main, "calculate_short_transaction_id", lambda block_hash, transaction_id: "00" * 6)
+
+    receiver.peers = {"source"}
+    receiver.receive_inventory({"blocks": [block.calculate_hash()]}, peer="source")
+    assert receiver.tip.calculate_hash() == block.calculate_hash()
+    assert receiver.compact_block_stats == {"rebuilt": 0, "requested_transactions": 0, "failed": 1}
+    assert requested_urls[-1].split("/")[-1] == block.calculate_hash()
+
+
+def test_compact_block_from_another_peer_when_the_announcer_hangs(compact_blocks):
+    source, receiver, block, requested_urls = compact_blocks
+
+    receiver.peers = {"hung", "source"}
+    assert receiver.receive_inventory({"blocks": [block.calculate_hash()]}, peer="hung")["blocks"] == [
+        block.calculate_hash()
+    ]
+    assert receiver.tip.calculate_hash() == block.calculate_hash()
+    assert [url.split("/")[2] for url in requested_urls] == ["source:5000", "source:5000"]
+
+
+def test_inventory_fetches_transactions_in_one_request_per_peer(client, monkeypatch):
+    source = Blockchain(base_difficulty=2, gossip_workers=0)
+    source.initialize(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+    extend(source, 2)
+    blockchain = Blockchain(base_difficulty=2, gossip_workers=0)
+    for block in source.blocks:
+        blockchain.receive_block(block)
+
+    transactions = []
+    for block in source.blocks:
+        transaction = Transaction(
+            inputs=[{'transaction_id': block.transactions[0].calculate_hash(), 'vout': 0}],
+            outputs=[{'address': 'b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225', 'amount': 49}]
+        )
+        client.sign(transaction, 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+        transactions.append(transaction)
+    transaction_ids = [transaction.calculate_hash() for transaction in transactions]
+
+    # "hung" never answers, "partial" only has the first transaction, and sends another one in place of the second
+    requests_by_peer = {}
+
+    def post(url, params=None, json=None, timeout=None):
+        assert timeout == blockchain.fetch_timeout
+        peer = url.split("//")[1].split(":")[0]
+        requests_by_peer.setdefault(peer, []).append(json["transaction_ids"])
+        if peer == "hung":
+            raise requests.exceptions.ReadTimeout("%s timed out" % url)
+        if peer == "partial":
+            return Response([transactions[0].serialize(), transactions[2].serialize(), None])
+        return Response([
+            transactions[transaction_ids.index(transaction_id)].serialize() for transaction_id in json["transaction_ids"]
+        ])
+
+    monkeypatch.setattr(main.requests, "post", post)
+
+    blockchain.peers = ["hung", "partial", "source"]
+    assert blockchain.receive_inventory({"transactions": transaction_ids}, peer="hung")["transactions"] == transaction_ids
+    assert requests_by_peer == {"hung": [transaction_ids], "partial": [transaction_ids], "source": [transaction_ids[1:]]}
+    assert all(transaction_id in blockchain.transaction_pool for transaction_id in transaction_ids)
+
+
+def test_rejected_transactions_are_not_fetched_again(client, monkeypatch):
+    source = Blockchain(base_difficulty=2, gossip_workers=0)
+    source.initialize(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+    blockchain = Blockchain(base_difficulty=2, gossip_workers=0)
+    blockchain.receive_block(source.tip)
+    blockchain.peers = {"peer-1"}
+
+    # it spends more than its input
+    transaction = Transaction(
+        inputs=[{'transaction_id': source.tip.transactions[0].calculate_hash(), 'vout': 0}],
+        outputs=[{'address': 'b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225', 'amount': 500}]
+    )
+    client.sign(transaction, 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+
+    fetches = []
+    monkeypatch.setattr(
+        blockchain, "_fetch_transactions",
+        lambda transaction_ids, peers=None: fetches.extend(transaction_ids) or {transaction.calculate_hash(): transaction}
+    )
+
+    inventory = {"transactions": [transaction.calculate_hash()]}
+    for _ in range(3):
+        blockchain.receive_inventory(inventory, peer="peer-1")
+    assert fetches == [transaction.calculate_hash()]
+    assert blockchain.has_rejected(transaction.calculate_hash())
+    assert not blockchain.has_seen(transaction.calculate_hash())
+
+    # until the tip changes
+    extend(blockchain, 1)
+    blockchain.receive_inventory(inventory, peer="peer-1")
+    assert fetches == [transaction.calculate_hash()] * 2
+
+
+def test_find_peer(monkeypatch):
+    addresses = {"peer-1": {"172.18.0.2"}, "peer-2": {"172.18.0.3", "fd00::3"}}
+    monkeypatch.setattr(main, "resolve_host", lambda host: addresses.get(host, set()))
+    blockchain = Blockchain(base_difficulty=2, gossip_workers=0)
+    blockchain.peers = {"peer-1", "peer-2"}
+
+    assert blockchain.find_peer("172.18.0.3") == blockchain.find_peer("fd00::3") == "peer-2"
+    assert blockchain.find_peer("peer-1") == "peer-1"
+    assert blockchain.find_peer("172.18.0.9") == "172.18.0.9"
+    assert blockchain.find_peer("fd00::9") == "[fd00::9]"
+
+    # a peer that has moved
+    addresses["peer-1"] = {"172.18.0.9"}
+    assert blockchain.find_peer("172.18.0.9") == "peer-1"
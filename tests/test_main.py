@@ -5,7 +5,7 @@ import ecdsa
 import pytest
 
 # own
-from main import Blockchain, Client, Transaction
+from main import Block, Blockchain, Client, InputIsUnavailableError, Transaction, TransactionConflictError
 
 
 @pytest.fixture
@@ -248,3 +248,221 @@ def test_cannot_verify_signature(blockchain, client):
 
     with pytest.raises(ecdsa.BadSignatureError) as e:
         blockchain.add_transaction_to_pool(transaction)
+
+
+def test_get_transaction(blockchain, first_transaction):
+    genesis_coinbase_transaction = blockchain.blocks[0].transactions[0]
+    assert blockchain.get_transaction(genesis_coinbase_transaction.calculate_hash()) is genesis_coinbase_transaction
+
+    # pooled transactions are only returned on request
+    blockchain.add_transaction_to_pool(first_transaction)
+    assert blockchain.get_transaction(first_transaction.calculate_hash()) is None
+    assert blockchain.get_transaction(
+        first_transaction.calculate_hash(), include_transaction_pool=True
+    ) is first_transaction
+
+    block = blockchain.mine(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+    assert blockchain.get_transaction(first_transaction.calculate_hash()) is block.transactions[0]
+    assert blockchain.get_transaction(block.transactions[-1].calculate_hash()) is block.transactions[-1]
+
+    # the index is updated when blocks are disconnected
+    blockchain._disconnect_block()
+    assert blockchain.get_transaction(first_transaction.calculate_hash()) is None
+    assert blockchain.get_transaction(block.transactions[-1].calculate_hash()) is None
+
+
+def test_mine_with_multiple_processes(client):
+    blockchain = Blockchain(base_difficulty=8, mining_processes=2)
+    try:
+        block = blockchain.initialize(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+
+        assert blockchain.height == 0
+        mask = int('f' * 64, base=16) >> 8
+        assert int(block.calculate_hash(), base=16) <= mask
+
+        # an attempt that can't succeed is given up as soon as we ask for it
+        blockchain.base_difficulty = 256
+        blockchain.transaction_pool.add_transaction(Transaction(inputs=[], outputs=[]), fee=0)
+        assert blockchain.mine(
+            miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d', abort=lambda: True
+        ) is None
+        assert blockchain.height == 0
+
+    finally:
+        blockchain.mining_engine.close()
+
+
+def test_mine_is_aborted_when_the_tip_changes(blockchain, first_transaction):
+    blockchain.add_transaction_to_pool(first_transaction)
+    blockchain.base_difficulty = 256
+
+    genesis_block = blockchain.tip
+    new_tip = Block(prev=genesis_block.calculate_hash())
+
+    def abort():
+        # someone else's block arrives while we're mining
+        if blockchain.tip is genesis_block:
+            blockchain._connect_block(new_tip)
+        return False
+
+    assert blockchain.mine(
+        miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d', abort=abort
+    ) is None
+    assert blockchain.tip is new_tip
+
+
+@pytest.mark.parametrize("verification_workers", [0, 2])
+def test_add_transactions_to_pool(client, verification_workers):
+    blockchain = Blockchain(base_difficulty=2, verification_workers=verification_workers)
+    try:
+        genesis_block = blockchain.initialize(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+
+        # split the Genesis coinbase in 5 outputs
+        split_transaction = Transaction(
+            inputs=[
+                {'transaction_id': genesis_block.transactions[0].calculate_hash(), 'vout': 0}
+            ],
+            outputs=[
+                {'address': 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d', 'amount': 10}
+            ] * 5
+        )
+        client.sign(split_transaction, 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+        blockchain.add_transaction_to_pool(split_transaction)
+        blockchain.mine(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+
+        transactions = []
+        for vout in range(5):
+            transaction = Transaction(
+                inputs=[
+                    {'transaction_id': split_transaction.calculate_hash(), 'vout': vout}
+                ],
+                outputs=[
+                    {'address': 'b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225', 'amount': 10 - vout}
+                ]
+            )
+            client.sign(transaction, 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+            transactions.append(transaction)
+
+        # user_03's signature with user_01's public key
+        public_key_user_01 = transactions[2].public_key
+        client.sign(transactions[2], '5803922ef28c4db7e6ca909cb35644400d9ec08cb3f1d7cfb29399afac149883')
+        transactions[2].public_key = public_key_user_01
+
+        # an input that does not exist
+        transactions.append(Transaction(
+            inputs=[
+                {'transaction_id': split_transaction.calculate_hash(), 'vout': 5}
+            ],
+            outputs=[]
+        ))
+        client.sign(transactions[5], 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+
+        # a single pass over the batch tells the bad signature apart
+        verify_each = blockchain.signature_verifier.verify_each
+        verified_groups = []
+        blockchain.signature_verifier.verify = lambda checks: pytest.fail("Verified again")
+        blockchain.signature_verifier.verify_each = lambda groups: verified_groups.extend(groups) or verify_each(groups)
+
+        results = blockchain.add_transactions_to_pool(transactions)
+
+        assert len(verified_groups) == 5
+        assert results[0] == 0
+        assert results[1] == 1
+        assert isinstance(results[2], ecdsa.BadSignatureError)
+        assert results[3] == 3
+        assert results[4] == 4
+        assert isinstance(results[5], InputIsUnavailableError)
+
+        assert len(blockchain.transaction_pool) == 4
+
+        # transactions that are already pooled are left as they are
+        assert blockchain.add_transactions_to_pool(transactions[:2]) == [0, 1]
+
+    finally:
+        blockchain.signature_verifier.close()
+
+
+def test_add_transactions_to_pool_within_a_batch(client):
+    blockchain = Blockchain(base_difficulty=2)
+    genesis_block = blockchain.initialize(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+
+    split_transaction = Transaction(
+        inputs=[
+            {'transaction_id': genesis_block.transactions[0].calculate_hash(), 'vout': 0}
+        ],
+        outputs=[
+            {'address': 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d', 'amount': 10}
+        ] * 2
+    )
+    client.sign(split_transaction, 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+    blockchain.add_transaction_to_pool(split_transaction)
+    blockchain.mine(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+
+    def spend(transaction_id, vout, amount):
+        transaction = Transaction(
+            inputs=[
+                {'transaction_id': transaction_id, 'vout': vout}
+            ],
+            outputs=[
+                {'address': 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d', 'amount': amount}
+            ]
+        )
+        client.sign(transaction, 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+        return transaction
+
+    transactions = [
+        spend(split_transaction.calculate_hash(), 0, 9),
+        spend(split_transaction.calculate_hash(), 0, 7),  # conflicts with the first one, with a higher fee
+        None,
+        spend(split_transaction.calculate_hash(), 1, 10)
+    ]
+    transactions[2] = spend(transactions[1].calculate_hash(), 0, 7)  # depends on the second one
+
+    announcements = []
+    blockchain.gossip_dispatcher.announce = lambda peers, inventory: announcements.append(inventory)
+    results = blockchain.add_transactions_to_pool(transactions + [transactions[3]])
+
+    assert isinstance(results[0], TransactionConflictError)
+    assert results[1] == 3
+    assert isinstance(results[2], InputIsUnavailableError) and "same batch" in str(results[2])
+    assert results[3] == results[4] == 0
+    assert len(blockchain.transaction_pool) == 2
+
+    # announced together
+    assert announcements == [
+        {"transactions": [transactions[1].calculate_hash(), transactions[3].calculate_hash()]}
+    ]
+
+
+def test_signature_cache(blockchain, first_transaction, client):
+    signature_checks = []
+    verify = blockchain.signature_verifier.verify
+
+    def counting_verify(checks):
+        signature_checks.extend(checks)
+        return verify(checks)
+
+    blockchain.signature_verifier.verify = counting_verify
+
+    assert blockchain._verify_transaction(first_transaction) == 2
+    assert len(signature_checks) == 1
+
+    # verified already, no ECDSA work this time
+    assert blockchain._verify_transaction(first_transaction) == 2
+    assert len(signature_checks) == 1
+    assert blockchain.signature_cache.stats['hits'] == 1
+
+    # the inputs still have to be unspent
+    blockchain.add_transaction_to_pool(first_transaction)
+    blockchain.mine(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+    with pytest.raises(InputIsUnavailableError):
+        blockchain._verify_transaction(first_transaction)
+
+    # and a different signature for the same transaction is verified once more
+    blockchain._disconnect_block()
+    public_key_user_01 = first_transaction.public_key
+    client.sign(first_transaction, '5803922ef28c4db7e6ca909cb35644400d9ec08cb3f1d7cfb29399afac149883')  # user_03
+    first_transaction.public_key = public_key_user_01
+    with pytest.raises(ecdsa.BadSignatureError):
+        blockchain._verify_transaction(first_transaction)
+    assert len(signature_checks) == 2
@@ -1,5 +1,11 @@
+import json
+
+# others
+import pytest
+
 # own
-from main import Blockchain, Transaction
+from main import Block, Blockchain, BlockIsNotInMainChainError, InvalidBlockError, Transaction, verify_merkle_proof
+from conftest import coinbase_block
 
 
 def test_block_is_genesis_block(client):
@@ -254,3 +260,131 @@ def test_handle_secondary_chain(client):
     assert blockchain_b.calculate_balance('b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225') == 38
 
     # TODO: assert about transactions going back to the transaction pool
+
+
+def test_block_index_follows_main_chain(client):
+    blockchain = Blockchain(base_difficulty=2)
+    genesis_block = blockchain.initialize(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+
+    main_block_01 = coinbase_block(prev=genesis_block.calculate_hash())
+    blockchain.receive_block(main_block_01)
+
+    # a fork that is long enough to become the main chain
+    fork_blocks = [coinbase_block(prev=genesis_block.calculate_hash())]
+    for _ in range(2):
+        fork_blocks.append(coinbase_block(prev=fork_blocks[-1].calculate_hash()))
+
+    for block in fork_blocks:
+        blockchain.receive_block(block)
+
+    assert blockchain.height == 3
+    assert blockchain.get_block_height(main_block_01.calculate_hash()) is None
+    assert blockchain.get_block(main_block_01.calculate_hash()) is None
+
+    for block_height, block in enumerate([genesis_block] + fork_blocks):
+        assert blockchain.get_block_height(block.calculate_hash()) == block_height
+        assert blockchain.get_block(block.calculate_hash()) is block
+
+    assert blockchain.get_next_block(previous_hash=fork_blocks[1].calculate_hash()) is fork_blocks[2]
+    assert blockchain.get_next_block(previous_hash=fork_blocks[2].calculate_hash()) is None
+    with pytest.raises(BlockIsNotInMainChainError):
+        blockchain.get_next_block(previous_hash=main_block_01.calculate_hash())
+
+    # the index is rebuilt when the blockchain gets unserialized
+    unserialized_blockchain = Blockchain.unserialize(blockchain.serialize())
+    for block_height, block in enumerate(blockchain.blocks):
+        assert unserialized_blockchain.get_block_height(block.calculate_hash()) == block_height
+
+
+def test_block_versions(client):
+    # blocks serialized before versioning, like our Genesis block, are version 1
+    with open('../src/toychain/blockchain.json') as f:
+        serialized_genesis_block = json.load(f)["blocks"][0]
+    assert "version" not in serialized_genesis_block
+
+    genesis_block = Block.unserialize(serialized_genesis_block)
+    assert genesis_block.version == 1
+    assert genesis_block.calculate_hash() == serialized_genesis_block["hash"]
+
+    blockchain = Blockchain(base_difficulty=2)
+    blockchain.receive_block(genesis_block)
+
+    # new blocks are version 2, and they hash their header only
+    block = Block(prev=genesis_block.calculate_hash(), transactions=genesis_block.transactions)
+    assert block.version == 2
+    assert Block.hash_header(block.header) == block.calculate_hash()
+
+    unserialized_block = Block.unserialize(json.loads(json.dumps(block.serialize())))
+    assert unserialized_block.version == 2
+    assert unserialized_block.calculate_hash() == block.calculate_hash()
+
+    # the merkle root has to match the transactions
+    serialized_block = block.serialize()
+    serialized_block["merkle_root"] = "0" * 64
+    with pytest.raises(InvalidBlockError):
+        Block.unserialize(serialized_block)
+
+
+def test_duplicate_transactions():
+    # with the last transaction repeated, an odd number of them has the same merkle root, and the same block hash
+    transactions = [
+        Transaction(inputs=[], outputs=[
+            {'address': 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d', 'amount': amount}
+        ])
+        for amount in range(3)
+    ]
+    block = Block(prev="00" * 32, transactions=transactions)
+    malleated_block = Block(
+        prev=block.prev, nonce=block.nonce, timestamp=block.timestamp, transactions=transactions + transactions[-1:]
+    )
+    assert malleated_block.merkle_root == block.merkle_root
+    assert malleated_block.calculate_hash() == block.calculate_hash()
+
+    # the valid one is accepted, the malleated one is rejected, before its merkle root is compared
+    assert Block.unserialize(block.serialize()).calculate_hash() == block.calculate_hash()
+    assert Block.decode(block.encode()).calculate_hash() == block.calculate_hash()
+    with pytest.raises(InvalidBlockError, match="duplicate transaction ids"):
+        Block.unserialize(malleated_block.serialize())
+    with pytest.raises(InvalidBlockError, match="duplicate transaction ids"):
+        Block.decode(malleated_block.encode())
+
+
+@pytest.mark.parametrize("transaction_count", [1, 2, 3, 7, 8])
+def test_merkle_proof(transaction_count):
+    transactions = [
+        Transaction(
+            inputs=[],
+            outputs=[{'address': 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d', 'amount': amount}]
+        )
+        for amount in range(transaction_count)
+    ]
+    block = Block(prev="0" * 64, transactions=transactions)
+
+    for transaction in transactions:
+        proof = block.merkle_proof(transaction.calculate_hash())
+        assert verify_merkle_proof(transaction.calculate_hash(), proof, block.merkle_root)
+        assert not verify_merkle_proof(transaction.calculate_hash(), proof, "0" * 64)
+
+    if transaction_count > 1:
+        # a proof for one transaction doesn't prove another one
+        proof = block.merkle_proof(transactions[0].calculate_hash())
+        assert not verify_merkle_proof(transactions[1].calculate_hash(), proof, block.merkle_root)
+
+    # the block hash commits to the transactions
+    other_block = Block(prev="0" * 64, timestamp=block.timestamp, transactions=transactions[:-1] + [Transaction(
+        inputs=[], outputs=[{'address': 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d', 'amount': 99}]
+    )])
+    assert other_block.calculate_hash() != block.calculate_hash()
+
+
+def test_get_transaction_proof(client):
+    blockchain = Blockchain(base_difficulty=2)
+    genesis_block = blockchain.initialize(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+    coinbase_transaction_hash = genesis_block.transactions[0].calculate_hash()
+
+    proof = blockchain.get_transaction_proof(coinbase_transaction_hash)
+    assert proof["block_hash"] == genesis_block.calculate_hash()
+    assert proof["block_height"] == 0
+    assert verify_merkle_proof(coinbase_transaction_hash, proof["proof"], genesis_block.header["merkle_root"])
+
+    assert blockchain.get_transaction_proof("0" * 64) is None
@@ -0,0 +1,70 @@
+# others
+import pytest
+
+# own
+from main import (
+    Blockchain, MemoryChainstate, SQLiteChainstate, HistoryIsUnavailableError, InvalidEncodingError
+)
+from conftest import extend
+
+
+ADDRESS = 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d'
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_load_snapshot(source, tmp_path, backend):
+    filename = str(tmp_path / "snapshot.dat")
+    snapshot_hash = source.write_snapshot(filename, recent_blocks=5)
+
+    chainstate = MemoryChainstate() if backend == "memory" else SQLiteChainstate(str(tmp_path / "chainstate.sqlite"))
+    blockchain = Blockchain.load_snapshot(filename, snapshot_hash=snapshot_hash, chainstate=chainstate)
+
+    assert blockchain.height == source.height
+    assert blockchain.tip.calculate_hash() == source.tip.calculate_hash()
+    assert dict(blockchain.utxos) == dict(source.utxos)
+    assert blockchain.calculate_balance(ADDRESS) == source.calculate_balance(ADDRESS)
+    assert blockchain.chainstate.history_start == source.height - 4
+    assert blockchain.blocks[0] is None
+
+    # the recent blocks can be disconnected, down to the oldest one, which becomes the tip
+    for _ in range(4):
+        blockchain._disconnect_block()
+    with pytest.raises(HistoryIsUnavailableError):
+        blockchain._disconnect_block()
+
+    # and the chain goes on from there
+    extend(blockchain, 2, amount=7)
+    assert blockchain.height == source.height - 2
+
+
+def test_tampered_snapshot(source, tmp_path):
+    filename = str(tmp_path / "snapshot.dat")
+    source.write_snapshot(filename)
+
+    with pytest.raises(InvalidEncodingError):
+        Blockchain.load_snapshot(filename, snapshot_hash="00" * 32)
+
+    with open(filename, "r+b") as f:
+        f.seek(100)
+        byte = f.read(1)
+        f.seek(100)
+        f.write(bytes([byte[0] ^ 1]))
+
+    with pytest.raises(InvalidEncodingError):
+        Blockchain.load_snapshot(filename)
+
+
+def test_backfill(source, tmp_path):
+    filename = str(tmp_path / "snapshot.dat")
+    source.write_snapshot(filename)
+    blockchain = Blockchain.load_snapshot(filename)
+    with pytest.raises(HistoryIsUnavailableError):
+        blockchain.serialize()
+
+    blockchain._fetch_block = source.get_block
+    assert blockchain.backfill()
+
+    assert blockchain.chainstate.history_start == 0
+    assert [b.calculate_hash() for b in blockchain.blocks] == [b.calculate_hash() for b in source.blocks]
+    assert dict(blockchain._transaction_index) == dict(source._transaction_index)
+    assert blockchain.serialize()['blocks'] == source.serialize()['blocks']
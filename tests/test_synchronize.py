@@ -0,0 +1,171 @@
+# others
+import pytest
+import requests
+
+# own
+import main
+from main import (
+    Block, Blockchain, BlockchainError, BlockIsNotInMainChainError, InvalidEncodingError, Transaction,
+    decode_block_stream, encode_block_stream
+)
+from conftest import extend
+
+
+ADDRESS = 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d'
+
+
+def split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_block_stream_round_trip(source, binary):
+    # a block that can only be represented in JSON, too
+    blocks = list(source.blocks) + [
+        Block(prev=source.tip.calculate_hash(), transactions=[
+            Transaction(inputs=[], outputs=[{'address': ADDRESS, 'amount': 0.1}])
+        ])
+    ]
+    data = b"".join(encode_block_stream(blocks, binary=binary))
+
+    for chunk_size in (1, 7, len(data)):
+        decoded_blocks = list(decode_block_stream(split(data, chunk_size), binary=binary))
+        assert [b.calculate_hash() for b in decoded_blocks] == [b.calculate_hash() for b in blocks]
+
+    with pytest.raises(InvalidEncodingError):
+        list(decode_block_stream([data[:-1]], binary=binary))
+
+    # whatever a peer sends, it's a block or an InvalidEncodingError
+    malformed_data = b'\x01\x00\x00\x00\x01' if binary else b'{"prev": "00"}\n'
+    with pytest.raises(InvalidEncodingError):
+        list(decode_block_stream([malformed_data], binary=binary))
+
+
+def test_get_blocks_after(source):
+    assert source.get_blocks_after(None, 3) == list(source.blocks[:3])
+    assert source.get_blocks_after(source.blocks[5].calculate_hash(), 3) == list(source.blocks[6:9])
+    assert source.get_blocks_after(source.blocks[-2].calculate_hash(), 3) == list(source.blocks[-1:])
+    assert source.get_blocks_after(source.tip.calculate_hash(), 3) == []
+
+    with pytest.raises(BlockIsNotInMainChainError):
+        source.get_blocks_after("00" * 32, 3)
+
+
+def test_get_block_hashes_after(source, monkeypatch):
+    block_hashes = [block.calculate_hash() for block in source.blocks]
+
+    # without reading the blocks themselves
+    monkeypatch.setattr(main, "decode_block_record", lambda record: pytest.fail("Block decoded"))
+    assert source.get_block_hashes_after(None, 2) == block_hashes[:2]
+    assert source.get_block_hashes_after(block_hashes[-3], 10000) == block_hashes[-2:]
+    assert source.get_block_hashes_after(block_hashes[-1], 10000) == []
+
+    with pytest.raises(BlockIsNotInMainChainError):
+        source.get_block_hashes_after("00" * 32, 3)
+
+
+@pytest.fixture
+def peers(source, monkeypatch):
+    # peer name: the source of its blocks, None if it can't be reached, "hung" if it times out, or "malformed" if
+    #   what it sends aren't blocks. every other peer agrees with `source` on which blocks follow which.
+    peers = {}
+
+    def fetch_block_hashes(blockchain, peer, previous_hash, limit=10000):
+        if peers[peer] in (None, "hung"):
+            raise requests.exceptions.ConnectTimeout("%s is unreachable" % peer)
+        return source.get_block_hashes_after(previous_hash, limit * 1000)
+
+    def fetch_block_range(blockchain, peer, previous_hash, limit):
+        if peers[peer] is None:
+            raise requests.exceptions.ConnectionError("%s is unreachable" % peer)
+        if peers[peer] == "hung":
+            raise requests.exceptions.ReadTimeout("%s timed out" % peer)
+        if peers[peer] == "malformed":
+            return list(decode_block_stream([b'{"prev": "%s"}\n' % previous_hash.encode()]))
+        return peers[peer].get_blocks_after(previous_hash, limit)
+
+    monkeypatch.setattr(Blockchain, "_fetch_block_hashes", fetch_block_hashes)
+    monkeypatch.setattr(Blockchain, "_fetch_block_range", fetch_block_range)
+    monkeypatch.setattr(Blockchain, "publish_block", lambda blockchain, block: pytest.fail("Published"))
+    return peers
+
+
+@pytest.mark.parametrize("height", [-1, 0, 7])
+def test_synchronize(source, peers, height):
+    blockchain = Blockchain(base_difficulty=2)
+    for block in source.blocks[:height + 1]:
+        blockchain.receive_block(block, publish=False)
+    peers["peer"] = source
+    blockchain.peers = set(peers)
+
+    peer_stats = blockchain.synchronize(batch_size=4)
+
+    assert blockchain.tip.calculate_hash() == source.tip.calculate_hash()
+    assert dict(blockchain.utxos) == dict(source.utxos)
+    assert peer_stats["peer"]["blocks"] == source.height - height
+    assert peer_stats["peer"]["failures"] == 0
+
+
+def test_synchronize_from_several_peers(source, peers):
+    # a peer on another chain, and an unreachable one: their ranges are downloaded again from the others
+    other_source = Blockchain(base_difficulty=2)
+    other_source.receive_block(source.blocks[0], publish=False)
+    extend(other_source, 20, amount=7)
+    peers.update({"peer-1": source, "peer-2": other_source, "peer-3": None, "peer-4": source})
+
+    blockchain = Blockchain(base_difficulty=2)
+    blockchain.receive_block(source.blocks[0], publish=False)
+    blockchain.peers = set(peers)
+    peer_stats = blockchain.synchronize(batch_size=2)
+
+    assert [b.calculate_hash() for b in blockchain.blocks] == [b.calculate_hash() for b in source.blocks]
+    assert peer_stats["peer-1"]["blocks"] + peer_stats["peer-4"]["blocks"] == source.height
+    assert peer_stats["peer-1"]["blocks"] > 0 and peer_stats["peer-4"]["blocks"] > 0
+    assert peer_stats["peer-2"]["blocks"] == peer_stats["peer-3"]["blocks"] == 0
+    assert peer_stats["peer-2"]["failures"] > 0 and peer_stats["peer-3"]["failures"] > 0
+
+    # nobody has the blocks
+    peers.update({"peer-1": None, "peer-4": None})
+    blockchain = Blockchain(base_difficulty=2)
+    blockchain.receive_block(source.blocks[0], publish=False)
+    blockchain.peers = set(peers)
+    with pytest.raises(BlockchainError):
+        blockchain.synchronize(batch_size=2)
+    assert blockchain.height == 0
+
+
+def test_synchronize_around_unresponsive_peers(source, peers):
+    # the first peers can't tell which blocks follow our tip, and then fail to send them
+    peers.update({"peer-1": None, "peer-2": "hung", "peer-3": "malformed", "peer-4": source})
+
+    blockchain = Blockchain(base_difficulty=2)
+    blockchain.receive_block(source.blocks[0], publish=False)
+    blockchain.peers = list(peers)  # in this order
+    peer_stats = blockchain.synchronize(batch_size=2)
+
+    assert blockchain.tip.calculate_hash() == source.tip.calculate_hash()
+    assert peer_stats["peer-4"]["blocks"] == source.height
+    assert all(peer_stats[peer]["failures"] > 0 for peer in ("peer-1", "peer-2", "peer-3"))
+
+
+def test_fetches_time_out(source, monkeypatch):
+    timeouts = []
+
+    def get(url, params=None, headers=None, stream=False, timeout=None):
+        timeouts.append(timeout)
+        raise requests.exceptions.ReadTimeout("%s timed out" % url)
+
+    monkeypatch.setattr(main.requests, "get", get)
+    blockchain = Blockchain(base_difficulty=2)
+    blockchain.receive_block(source.blocks[0], publish=False)
+    blockchain.peers = {"peer-1", "peer-2"}
+
+    # no peer answers: the last one's error
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        blockchain.synchronize()
+    assert timeouts == [blockchain.fetch_timeout] * 2
+
+    timeouts.clear()
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        blockchain._fetch_block_range("peer-1", source.blocks[0].calculate_hash(), 10)
+    assert timeouts == [blockchain.fetch_timeout]
@@ -0,0 +1,153 @@
+# others
+import pytest
+
+# own
+from main import (
+    Transaction, TransactionConflictError, TransactionIsNotInPoolError, TransactionPool, TransactionPoolIsFullError
+)
+
+
+def make_transaction(amount):
+    return Transaction(
+        inputs=[],
+        outputs=[{'address': 'b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225', 'amount': amount}]
+    )
+
+
+def test_get_transactions_by_fee():
+    transaction_pool = TransactionPool()
+    transactions = [make_transaction(amount) for amount in range(6)]
+    fees = [3, 1, 5, 3, 0, 4]
+    for transaction, fee in zip(transactions, fees):
+        transaction_pool.add_transaction(transaction, fee=fee)
+
+    # equal fees keep their arrival order
+    entries = transaction_pool.get_transactions(count=4)
+    assert [entry['fee'] for entry in entries] == [5, 4, 3, 3]
+    assert [entry['transaction'] for entry in entries] == [transactions[2], transactions[5], transactions[0], transactions[3]]
+    assert entries[0]['transaction_id'] == transactions[2].calculate_hash()
+
+    # selecting doesn't remove anything from the pool
+    assert len(transaction_pool) == 6
+    assert [entry['fee'] for entry in transaction_pool.get_transactions(count=10)] == [5, 4, 3, 3, 1, 0]
+
+
+def test_delete_transaction():
+    transaction_pool = TransactionPool()
+    transactions = [make_transaction(amount) for amount in range(100)]
+    for fee, transaction in enumerate(transactions):
+        transaction_pool.add_transaction(transaction, fee=fee)
+
+    for transaction in transactions[50:]:
+        transaction_pool.delete_transaction(transaction.calculate_hash())
+
+    assert len(transaction_pool) == 50
+    assert [entry['fee'] for entry in transaction_pool.get_transactions(count=3)] == [49, 48, 47]
+
+    # deleted entries don't pile up in the heap
+    assert len(transaction_pool._heap) <= 2 * len(transaction_pool)
+
+    with pytest.raises(TransactionIsNotInPoolError):
+        transaction_pool.delete_transaction(transactions[-1].calculate_hash())
+
+    # a transaction that is added again takes its new fee
+    transaction_pool.add_transaction(transactions[0], fee=1000)
+    assert transaction_pool.get_transactions(count=1)[0]['transaction'] is transactions[0]
+    assert len(transaction_pool) == 50
+
+    transaction_pool.flush()
+    assert len(transaction_pool) == 0
+    assert transaction_pool.get_transactions(count=1) == []
+
+
+def make_spend(transaction_id, vout, amount=1):
+    return Transaction(
+        inputs=[{'transaction_id': transaction_id, 'vout': vout}],
+        outputs=[{'address': 'b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225', 'amount': amount}]
+    )
+
+
+def test_conflicting_transactions():
+    transaction_pool = TransactionPool()
+    transaction_id = 'd0d9da8e1c009d6c19854d7bc0bce911c4e94afb86b9cfbcf0ce7e8004bf19b8'
+
+    transaction_a = make_spend(transaction_id, 0, amount=1)
+    transaction_pool.add_transaction(transaction_a, fee=5)
+
+    # same fee, rejected
+    transaction_b = make_spend(transaction_id, 0, amount=2)
+    with pytest.raises(TransactionConflictError):
+        transaction_pool.add_transaction(transaction_b, fee=5)
+
+    assert transaction_pool.get_conflicts(transaction_b) == [transaction_a.calculate_hash()]
+    assert transaction_pool.stats['conflicts'] == 1
+
+    # higher fee, replaces it
+    transaction_pool.add_transaction(transaction_b, fee=6)
+    assert len(transaction_pool) == 1
+    assert transaction_pool.get_transaction(transaction_b.calculate_hash())['fee'] == 6
+    with pytest.raises(TransactionIsNotInPoolError):
+        transaction_pool.get_transaction(transaction_a.calculate_hash())
+    assert transaction_pool.stats['replaced'] == 1
+
+    # once a conflicting transaction is mined, the pooled one goes away
+    transaction_c = make_spend(transaction_id, 0, amount=3)
+    assert [v['transaction'] for v in transaction_pool.delete_conflicts(transaction_c)] == [transaction_b]
+    assert len(transaction_pool) == 0
+    assert transaction_pool.get_conflicts(transaction_c) == []
+
+
+def test_evict_lowest_fee_transactions():
+    transaction_pool = TransactionPool(max_transactions=3)
+    transactions = [make_transaction(amount) for amount in range(5)]
+
+    for fee, transaction in zip([3, 1, 2], transactions):
+        transaction_pool.add_transaction(transaction, fee=fee)
+
+    assert transaction_pool.add_transaction(transactions[3], fee=4) == [transactions[1].calculate_hash()]
+    assert [entry['fee'] for entry in transaction_pool.get_transactions(count=3)] == [4, 3, 2]
+
+    # too cheap to get in
+    with pytest.raises(TransactionPoolIsFullError):
+        transaction_pool.add_transaction(transactions[4], fee=1)
+
+    assert len(transaction_pool) == 3
+    assert transaction_pool.stats['evicted'] == 2
+
+    # by size
+    transaction_pool = TransactionPool(max_bytes=2 * transaction_pool.get_transaction(transactions[0].calculate_hash())['size'])
+    for fee, transaction in enumerate(transactions[:3]):
+        transaction_pool.add_transaction(transaction, fee=fee)
+
+    assert len(transaction_pool) == 2
+    assert transaction_pool.size_bytes <= transaction_pool.max_bytes
+    assert [entry['transaction'] for entry in transaction_pool.get_transactions(count=3)] == [transactions[2], transactions[1]]
+
+
+def test_replacement_that_does_not_fit():
+    # a replacement that pays more than the transaction it replaces, but is bigger than it, in a pool that is full
+    transaction_id = 'd0d9da8e1c009d6c19854d7bc0bce911c4e94afb86b9cfbcf0ce7e8004bf19b8'
+    transaction_a = make_spend(transaction_id, 0, amount=1)
+    transaction_b = Transaction(inputs=transaction_a.inputs, outputs=transaction_a.outputs * 2)
+    transaction = make_transaction(1)
+
+    transaction_pool = TransactionPool()
+    transaction_pool.add_transaction(transaction, fee=0)
+    transaction_pool.add_transaction(transaction_a, fee=0)
+    transaction_pool = TransactionPool(max_bytes=transaction_pool.size_bytes)
+    transaction_pool.add_transaction(transaction, fee=10)
+    transaction_pool.add_transaction(transaction_a, fee=1)
+
+    with pytest.raises(TransactionPoolIsFullError):
+        transaction_pool.add_transaction(transaction_b, fee=2)
+
+    # the transaction it would have replaced is still there
+    assert [entry['transaction'] for entry in transaction_pool.get_transactions(count=3)] == [transaction, transaction_a]
+    assert transaction_pool.get_conflicts(transaction_b) == [transaction_a.calculate_hash()]
+    assert transaction_pool.size_bytes == transaction_pool.max_bytes
+    assert transaction_pool.stats == {"evicted": 1, "replaced": 0, "conflicts": 0}
+
+    # paying more than the others, it replaces it and pushes them out
+    assert transaction_pool.add_transaction(transaction_b, fee=20) == [transaction.calculate_hash()]
+    assert [entry['transaction'] for entry in transaction_pool.get_transactions(count=3)] == [transaction_b]
+    assert transaction_pool.stats == {"evicted": 2, "replaced": 1, "conflicts": 0}
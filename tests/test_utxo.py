@@ -0,0 +1,145 @@
+import sys
+
+# own
+from main import Blockchain, Transaction
+from conftest import coinbase_block, extend
+
+
+def replay_utxos(blocks):
+    # the UTXO set, rebuilt from scratch the way `calculate_balance` used to do it.
+    utxos = {}
+    for block in blocks:
+        for transaction in block.transactions:
+            for input in transaction.inputs:
+                utxos.pop((input['transaction_id'], input['vout']), None)
+            for vout, output in enumerate(transaction.outputs):
+                utxos[(transaction.calculate_hash(), vout)] = output
+
+    return utxos
+
+
+def test_utxo_set_follows_main_chain(client):
+    blockchain = Blockchain(base_difficulty=2)
+    genesis_block = blockchain.initialize(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+    genesis_coinbase_hash = genesis_block.transactions[0].calculate_hash()
+
+    assert blockchain.utxos == replay_utxos(blockchain.blocks)
+    assert blockchain.get_unspent_output(genesis_coinbase_hash, 0)['amount'] == 50
+
+    transaction = Transaction(
+        inputs=[
+            {'transaction_id': genesis_coinbase_hash, 'vout': 0}
+        ],
+        outputs=[
+            {'address': 'b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225', 'amount': 20},
+            {'address': 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d', 'amount': 28}  # change
+        ]
+    )
+    client.sign(transaction, 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+    blockchain.add_transaction_to_pool(transaction)
+    blockchain.mine(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+
+    assert blockchain.utxos == replay_utxos(blockchain.blocks)
+    assert blockchain.get_unspent_output(genesis_coinbase_hash, 0) is None
+    assert blockchain.get_unspent_output(transaction.calculate_hash(), 1)['amount'] == 28
+
+
+def test_utxo_set_is_restored_on_reconverge(client):
+    blockchain = Blockchain(base_difficulty=2)
+    genesis_block = blockchain.initialize(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+    genesis_hash = genesis_block.calculate_hash()
+    genesis_coinbase_hash = genesis_block.transactions[0].calculate_hash()
+
+    # spend the Genesis coinbase in block_01 of the main chain
+    transaction = Transaction(
+        inputs=[
+            {'transaction_id': genesis_coinbase_hash, 'vout': 0}
+        ],
+        outputs=[
+            {'address': 'b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225', 'amount': 50}
+        ]
+    )
+    client.sign(transaction, 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+    blockchain.add_transaction_to_pool(transaction)
+    blockchain.mine(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+    assert blockchain.get_unspent_output(genesis_coinbase_hash, 0) is None
+
+    # a longer fork that does not include the transaction
+    fork_block_01 = coinbase_block(prev=genesis_hash)
+    fork_block_02 = coinbase_block(prev=fork_block_01.calculate_hash())
+    fork_block_03 = coinbase_block(prev=fork_block_02.calculate_hash())
+    for block in (fork_block_01, fork_block_02, fork_block_03):
+        blockchain.receive_block(block)
+
+    assert blockchain.height == 3
+    assert blockchain.tip.calculate_hash() == fork_block_03.calculate_hash()
+    assert blockchain.utxos == replay_utxos(blockchain.blocks)
+
+    # the Genesis coinbase is spendable again, and the transaction went back to the transaction pool
+    assert blockchain.get_unspent_output(genesis_coinbase_hash, 0)['amount'] == 50
+    assert blockchain.get_unspent_output(transaction.calculate_hash(), 0) is None
+    assert blockchain.transaction_pool.get_transaction(transaction.calculate_hash())['fee'] == 0
+
+
+def test_verify_transaction_on_long_chain(client):
+    blockchain = Blockchain(base_difficulty=2)
+    genesis_block = blockchain.initialize(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+
+    extend(blockchain, sys.getrecursionlimit() + 100)
+
+    transaction = Transaction(
+        inputs=[
+            {'transaction_id': genesis_block.transactions[0].calculate_hash(), 'vout': 0}
+        ],
+        outputs=[
+            {'address': 'b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225', 'amount': 45}
+        ]
+    )
+    client.sign(transaction, 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+
+    assert blockchain._verify_transaction(transaction) == 5
+
+
+def test_unspent_outputs_by_address(client):
+    blockchain = Blockchain(base_difficulty=2)
+    genesis_block = blockchain.initialize(miner_address='b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+    genesis_coinbase_hash = genesis_block.transactions[0].calculate_hash()
+
+    assert blockchain.get_unspent_outputs('b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d') == [
+        {'transaction_id': genesis_coinbase_hash, 'vout': 0, 'amount': 50}
+    ]
+
+    transaction = Transaction(
+        inputs=[
+            {'transaction_id': genesis_coinbase_hash, 'vout': 0}
+        ],
+        outputs=[
+            {'address': 'b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225', 'amount': 20},
+            {'address': 'b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225', 'amount': 30}
+        ]
+    )
+    client.sign(transaction, 'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d')
+    blockchain.add_transaction_to_pool(transaction)
+    block = blockchain.mine(miner_address='d79a2f79fb96a0e687094bc896251dae046e571e02d80d2c940f1a18a539f650')
+
+    assert blockchain.calculate_balances([
+        'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d',
+        'b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225',
+        'd79a2f79fb96a0e687094bc896251dae046e571e02d80d2c940f1a18a539f650',
+    ]) == {
+        'b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d': 0,
+        'b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225': 50,
+        'd79a2f79fb96a0e687094bc896251dae046e571e02d80d2c940f1a18a539f650': blockchain.block_reward,
+    }
+    assert blockchain.get_unspent_outputs('b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d') == []
+    assert blockchain.get_unspent_outputs('b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225') == [
+        {'transaction_id': transaction.calculate_hash(), 'vout': 0, 'amount': 20},
+        {'transaction_id': transaction.calculate_hash(), 'vout': 1, 'amount': 30},
+    ]
+
+    # disconnecting the block restores the index
+    blockchain._disconnect_block()
+    assert blockchain.calculate_balance('b1917dfe83c6fa47b53aee554347e2fae535c7b2e035191946272df19b31694d') == 50
+    assert blockchain.calculate_balance('b6285fe69a577b33773805c0e544cb19c7f1114faf2ae43322bebf8d3edcd225') == 0
+    assert blockchain.calculate_balance('d79a2f79fb96a0e687094bc896251dae046e571e02d80d2c940f1a18a539f650') == 0
+    assert block.calculate_hash() not in blockchain._block_index